@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'student_management.settings')
 
+# Route the student pages to their async views (see settings.STUDENT_ASYNC_VIEWS)
+os.environ.setdefault('STUDENT_ASYNC_VIEWS', '1')
+
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'students.metrics.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'student_management.urls'
@@ -122,3 +124,89 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Student state storage
+# The session only keeps a roster key; rosters live in this store
+# (students.state_store.MemoryStore, DatabaseStore, FileStore or JournalStore)
+
+STUDENT_STATE_STORE = 'students.state_store.DatabaseStore'
+
+# Directory used by students.state_store.FileStore and JournalStore
+
+STUDENT_STATE_DIR = BASE_DIR / 'student_state'
+
+# Journals kept open by JournalStore, each with one file descriptor and its
+# roster in memory; the least recently used one is closed past this number
+
+STUDENT_OPEN_JOURNALS = 128
+
+# Read-only roster snapshots mapped by every worker process
+# (students.shared_snapshot, published by manage.py publish_snapshot)
+
+STUDENT_SNAPSHOT_DIR = BASE_DIR / 'student_snapshots'
+
+# Serve reads of a roster from its published snapshot while the snapshot is
+# at the roster's current version; writes always go through the store
+
+STUDENT_SHARED_SNAPSHOTS = False
+
+# Rosters kept decoded in memory by a state store: the last version, so
+# that unchanged rosters are not read again, and (except for the database
+# store, which keeps its change log in the database) the recent versions
+# served by GET /changes/. The least recently used roster is dropped past
+# this number
+
+STUDENT_CACHED_ROSTERS = 256
+
+# Recent versions of each roster kept by the state store, so that clients
+# can fetch the changes since the version they have (GET /changes/); the
+# database store keeps them as change records in the database
+
+STUDENT_CHANGE_LOG_SIZE = 64
+
+# Worker processes formatting exports of the export_roster command; None
+# uses one per CPU (GET /export/ always formats in the server process)
+
+STUDENT_EXPORT_WORKERS = None
+
+# Serializer of whole rosters, used for JournalStore snapshots
+# (students.serializers.BinaryRosterSerializer or JSONRosterSerializer)
+
+STUDENT_STATE_SERIALIZER = 'students.serializers.BinaryRosterSerializer'
+
+# Serve the async student views (students.async_views) instead of the sync
+# ones. Worth it under ASGI, where they avoid a thread handoff per request;
+# asgi.py turns them on unless STUDENT_ASYNC_VIEWS=0 is set
+
+STUDENT_ASYNC_VIEWS = os.environ.get('STUDENT_ASYNC_VIEWS', '0') == '1'
+
+# Caches. 'students' holds the rendered student lists of the home page and
+# the times roster versions were first served (see students.page_cache); the
+# local-memory backend evicts the least recently used entries past
+# MAX_ENTRIES. Point it to a shared backend (e.g. file-based) to share the
+# entries between processes
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'students': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'students',
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
+
+STUDENT_PAGE_CACHE = 'students'
+
+# Request timing served at /metrics/ (students.metrics.MetricsMiddleware)
+
+STUDENT_METRICS = True
+
+# Share of requests run under cProfile, and where their stats are saved.
+# With DEBUG on, a single request can also be profiled with ?profile=1
+
+STUDENT_PROFILE_SAMPLE_RATE = 0.0
+
+STUDENT_PROFILE_DIR = BASE_DIR / 'student_profiles'
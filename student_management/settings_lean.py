@@ -0,0 +1,49 @@
+"""
+Lean runtime profile of the student_management project.
+
+Loads only what the students app uses: sessions, messages and CSRF
+protection. The admin, auth, contenttypes and staticfiles apps, their
+middleware and context processors are left out, which shortens the start
+of every worker. Select it with
+
+    DJANGO_SETTINGS_MODULE=student_management.settings_lean
+
+Everything else comes from settings.py. Check the start-up cost of both
+profiles with ``python -m students.benchmarks.cold_start``.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+
+INSTALLED_APPS = [
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'students',
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'students.metrics.MetricsMiddleware',
+]
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+# No users, so no password rules
+AUTH_PASSWORD_VALIDATORS = []
@@ -0,0 +1,163 @@
+"""Async versions of the student views, served when running under ASGI
+
+They do the same work as the views in ``views.py``, sharing their
+request-independent parts, but read and write the session and the roster
+with the async methods of ``StudentSessionManager``. Under ASGI a request
+then stays on the event loop instead of occupying a worker thread while it
+waits for the session and the state store. See ``STUDENT_ASYNC_VIEWS`` in
+the settings.
+"""
+from django.contrib import messages
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import require_GET, require_POST
+
+from . import metrics, page_cache
+from .session_manager import StudentSessionManager
+from .state_store import VersionConflict
+from .views import (
+    CONFLICT_MESSAGE, apply_form_action, autocomplete_results, batch_operation, changes_payload,
+    filter_results, home_page, ranking_results, read_changes_params, read_operations, split_home_page
+)
+
+
+def _stream_home(request, lines):
+    """Streams the home page like ``views._stream_home``, from an async iterator"""
+    head, tail = split_home_page(request)
+
+    async def content():
+        yield head
+        for line in lines:
+            yield escape(line) + "\n"
+        yield tail
+
+    return StreamingHttpResponse(content(), content_type='text/html; charset=utf-8')
+
+
+async def home(request):
+    """Async version of ``views.home``
+
+    Args:
+        request: The HTTP request object
+
+    Returns:
+        A rendered template or a redirect response
+    """
+    # Reading the roster also loads the session, so the template and the
+    # messages can read it afterwards without blocking
+    if request.method == 'POST':
+        try:
+            _, notes = await StudentSessionManager.atransact(
+                request.session, lambda state: apply_form_action(state, request.POST)
+            )
+        except VersionConflict:
+            notes = [(messages.ERROR, CONFLICT_MESSAGE)]
+        for level, text in notes:
+            messages.add_message(request, level, text)
+        return redirect('home')
+
+    version, state = await StudentSessionManager.aget_versioned_state(request.session)
+    if request.GET.get('stream') == '1':
+        _, lines = home_page(state, request.GET)
+        return _stream_home(request, lines)
+
+    key = await StudentSessionManager.aget_roster_key(request.session)
+    validate = page_cache.can_validate(request)
+    if validate:
+        response = page_cache.not_modified(request, key, version)
+        if response is not None:
+            return response
+
+    student_list = await page_cache.astudent_list(key, version, request.GET, lambda: home_page(state, request.GET)[1])
+    with metrics.phase('render'):
+        response = render(request, 'students/home.html', {'student_list': mark_safe(student_list)})
+    return page_cache.finish(request, response, key, version, validate)
+
+
+@require_POST
+async def batch(request):
+    """Async version of ``views.batch``
+
+    Args:
+        request: The HTTP request object
+
+    Returns:
+        A JSON response with ``applied`` and one result per operation
+    """
+    operations, error = read_operations(request.body)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    try:
+        _, (results, ok) = await StudentSessionManager.atransact(request.session, batch_operation(operations))
+    except VersionConflict:
+        return JsonResponse({'error': CONFLICT_MESSAGE}, status=409)
+
+    return JsonResponse({'applied': ok, 'results': results}, status=200 if ok else 400)
+
+
+@require_GET
+async def filter_students(request):
+    """Async version of ``views.filter_students``
+
+    Args:
+        request: The HTTP request object
+
+    Returns:
+        A JSON response with the total number of matches and one page of them
+    """
+    state = await StudentSessionManager.aget_state(request.session)
+    payload, status = filter_results(state, request.GET)
+    return JsonResponse(payload, status=status)
+
+
+@require_GET
+async def autocomplete(request):
+    """Async version of ``views.autocomplete``
+
+    Args:
+        request: The HTTP request object
+
+    Returns:
+        A JSON response described by ``views.autocomplete_results``
+    """
+    state = await StudentSessionManager.aget_state(request.session)
+    payload, status = autocomplete_results(state, request.GET)
+    return JsonResponse(payload, status=status)
+
+
+@require_GET
+async def ranking(request):
+    """Async version of ``views.ranking``
+
+    Args:
+        request: The HTTP request object
+
+    Returns:
+        A JSON response described by ``views.ranking_results``
+    """
+    state = await StudentSessionManager.aget_state(request.session)
+    payload, status = ranking_results(state, request.GET)
+    return JsonResponse(payload, status=status)
+
+
+@require_GET
+async def changes(request):
+    """Async version of ``views.changes``
+
+    A long poll waits on the event loop rather than in a worker thread.
+
+    Args:
+        request: The HTTP request object
+
+    Returns:
+        A JSON response described by ``views.changes_payload``
+    """
+    since, wait, error = read_changes_params(request.GET)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    version, state, changes = await StudentSessionManager.aget_changes(request.session, since, wait)
+    return JsonResponse(changes_payload(since, version, state, changes))
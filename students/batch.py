@@ -0,0 +1,136 @@
+from functools import reduce
+
+from .bulk_import import coerce_subjects, parse_grade
+from .functional_core import (
+    add_student, add_subject, update_grade, remove_student, calculate_average
+)
+
+
+# Most operations accepted in a single batch
+MAX_BATCH_OPERATIONS = 10000
+
+
+class OperationError(ValueError):
+    """Raised when an operation of a batch is invalid or cannot be applied"""
+
+
+def _text(op, field):
+    """Reads a required non-empty string field of an operation"""
+    value = op.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise OperationError(f'"{field}" is required')
+    return value
+
+
+def _grade(op):
+    """Reads the required grade of an operation"""
+    try:
+        return parse_grade(op.get('grade'))
+    except ValueError:
+        raise OperationError('"grade" must be a whole number')
+
+
+def _require_student(current, name):
+    if name not in current:
+        raise OperationError(f'Student {name} not found')
+
+
+def _add_student(state, op):
+    name = _text(op, 'name')
+    try:
+        subjects = coerce_subjects(op.get('subjects', {}))
+    except ValueError:
+        raise OperationError('"subjects" must map subjects to whole-number grades')
+    return add_student(state, name, subjects), {}
+
+
+def _add_subject(state, op):
+    name, subject, grade = _text(op, 'name'), _text(op, 'subject'), _grade(op)
+    _require_student(state(), name)
+    return add_subject(state, name, subject, grade), {}
+
+
+def _update_grade(state, op):
+    name, subject, grade = _text(op, 'name'), _text(op, 'subject'), _grade(op)
+    _require_student(state(), name)
+    if subject not in state()[name]:
+        raise OperationError(f'Student {name} has no subject {subject}')
+    return update_grade(state, name, subject, grade), {}
+
+
+def _remove_student(state, op):
+    name = _text(op, 'name')
+    _require_student(state(), name)
+    return remove_student(state, name), {}
+
+
+def _calculate_average(state, op):
+    name = _text(op, 'name')
+    _require_student(state(), name)
+    return state, {'average': calculate_average(state, name)()}
+
+
+# Operation handlers by action name. Each takes the current state lambda and
+# the operation, and returns the new state lambda and extra result fields.
+OPERATIONS = {
+    'add_student': _add_student,
+    'add_subject': _add_subject,
+    'update_grade': _update_grade,
+    'remove_student': _remove_student,
+    'calculate_average': _calculate_average,
+}
+
+
+def apply_operation(state, op):
+    """Applies a single batch operation to a state
+
+    Args:
+        state: A lambda function returning the current state
+        op: A dictionary with an ``action`` and that action's fields
+
+    Returns:
+        A (state, result) tuple with the new state lambda and a result dict
+
+    Raises:
+        OperationError: If the operation is invalid or cannot be applied
+    """
+    if not isinstance(op, dict):
+        raise OperationError('operations must be objects')
+    action = op.get('action')
+    if not isinstance(action, str):
+        raise OperationError('"action" must be a string')
+    handler = OPERATIONS.get(action)
+    if handler is None:
+        raise OperationError(f'unknown action {action!r}')
+    return handler(state, op)
+
+
+def apply_batch(state, operations):
+    """Folds a list of operations into a state as one reduction
+
+    Each operation sees the state produced by the ones before it. A failing
+    operation leaves the state as it was and the fold carries on, so that
+    every problem of the batch is reported at once; the caller only keeps
+    the final state when all of them succeeded.
+
+    Args:
+        state: A lambda function returning the current state
+        operations: A list of operation dictionaries
+
+    Returns:
+        A (state, results, ok) tuple: a lambda returning the final state, one
+        result dict per operation, and whether every operation succeeded
+    """
+    def step(acc, indexed_op):
+        current, results, ok = acc
+        index, op = indexed_op
+        action = op.get('action') if isinstance(op, dict) else None
+        try:
+            current, extra = apply_operation(current, op)
+        except OperationError as exc:
+            results.append({'index': index, 'action': action, 'status': 'error', 'error': str(exc)})
+            return current, results, False
+        results.append({'index': index, 'action': action, 'status': 'ok', **extra})
+        return current, results, ok
+
+    return reduce(step, enumerate(operations), (state, [], True))
@@ -0,0 +1,10 @@
+"""Micro-benchmarks for the student management app
+
+Each module can be run on its own, e.g.::
+
+    python -m students.benchmarks.core_scaling
+
+The regression suite (``suite.py``) runs as a management command::
+
+    python manage.py benchmark --students 10000 --baseline baseline.json
+"""
@@ -0,0 +1,130 @@
+"""Load benchmark of the sync views under WSGI against the async views under ASGI
+
+Sends waves of concurrent requests through Django's test clients, which run
+the full handler and middleware stack without a network server:
+
+- WSGI: the sync views behind ``Client``, with a pool of worker threads
+  standing in for the server's threads (requests beyond the pool queue up)
+- ASGI: the async views behind ``AsyncClient``, all requests of a wave
+  awaited together on one event loop
+
+Each simulated user has its own session and roster in a throwaway test
+database. Latency is measured from the start of the wave, so it includes
+the time spent waiting for a thread::
+
+    python -m students.benchmarks.async_load --concurrency 1000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+
+
+def _urlconf(module):
+    """Returns a URL configuration routing the app to the views of a module"""
+    from students.urls import student_urlpatterns
+
+    urlconf = ModuleType(f'{module.__name__}_urlconf')
+    urlconf.urlpatterns = student_urlpatterns(module)
+    return urlconf
+
+
+def _summary(latencies, elapsed):
+    """Returns (requests per second, median ms, p99 ms)"""
+    latencies = sorted(latencies)
+    return (
+        len(latencies) / elapsed,
+        latencies[len(latencies) // 2] * 1e3,
+        latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1e3,
+    )
+
+
+def run_wsgi(clients, path, waves, threads):
+    """Runs the waves through the sync views; returns (rps, median ms, p99 ms)"""
+    latencies = []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        for _ in range(waves):
+            wave_start = time.perf_counter()
+
+            def request(client):
+                client.get(path)
+                return time.perf_counter() - wave_start
+
+            latencies.extend(pool.map(request, clients))
+        elapsed = time.perf_counter() - start
+    return _summary(latencies, elapsed)
+
+
+def run_asgi(clients, path, waves):
+    """Runs the waves through the async views; returns (rps, median ms, p99 ms)"""
+    async def main():
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(waves):
+            wave_start = time.perf_counter()
+
+            async def request(client):
+                await client.get(path)
+                return time.perf_counter() - wave_start
+
+            latencies.extend(await asyncio.gather(*(request(client) for client in clients)))
+        return latencies, time.perf_counter() - start
+
+    return _summary(*asyncio.run(main()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=1000, help='Requests in flight per wave')
+    parser.add_argument('--waves', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=32, help='WSGI worker threads')
+    parser.add_argument('--path', default='/filter/?subject=math')
+    parser.add_argument('--store', default='students.state_store.DatabaseStore', help='STUDENT_STATE_STORE to use')
+    parser.add_argument('--session-engine', default='django.contrib.sessions.backends.db', help='SESSION_ENGINE to use')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'student_management.settings')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test import AsyncClient, Client
+    from django.test.utils import override_settings, setup_test_environment
+
+    from students import async_views, views
+
+    from students.state_store import get_store
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    override_settings(STUDENT_STATE_STORE=args.store, SESSION_ENGINE=args.session_engine).enable()
+    get_store.cache_clear()
+
+    # One session and roster per simulated user
+    clients = [Client() for _ in range(args.concurrency)]
+    with override_settings(ROOT_URLCONF=_urlconf(views)):
+        for i, client in enumerate(clients):
+            client.post('/', {'action': 'add_student', 'name': f'student{i}', 'subjects': f'math:{i % 101}'})
+    async_clients = []
+    for client in clients:
+        async_client = AsyncClient()
+        async_client.cookies = client.cookies
+        async_clients.append(async_client)
+
+    print(f'{args.concurrency} concurrent requests x {args.waves} waves of GET {args.path}')
+    print(f'store {args.store}, sessions {args.session_engine}')
+    print(f"{'stack':<28} {'req/s':>8} {'median (ms)':>12} {'p99 (ms)':>10}")
+    with override_settings(ROOT_URLCONF=_urlconf(views)):
+        rps, median, p99 = run_wsgi(clients, args.path, args.waves, args.threads)
+    print(f"{f'WSGI sync ({args.threads} threads)':<28} {rps:>8.0f} {median:>12.1f} {p99:>10.1f}")
+    with override_settings(ROOT_URLCONF=_urlconf(async_views)):
+        rps, median, p99 = run_asgi(async_clients, args.path, args.waves)
+    print(f"{'ASGI async':<28} {rps:>8.0f} {median:>12.1f} {p99:>10.1f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""Benchmark of the start-up cost of a worker, checked against a budget
+
+Starts fresh interpreters that load the project with a settings profile
+(the lean one by default) and serve the home page twice through the WSGI
+application, as a new worker does. Each run is measured with
+``python -X importtime``, whose report gives the time spent importing,
+split by top-level package. Reported, as medians over the rounds:
+
+- cold start: from launching the interpreter to the first response;
+- imports: the total import time from ``-X importtime``;
+- setup: ``get_wsgi_application()`` (settings, apps, middleware);
+- first request: the first home page, which also loads the URLs, the
+  views and the templates and opens the database;
+- second request: the same page once everything is loaded.
+
+The runs use a throwaway database, migrated by an untimed run first, and
+an untimed warm-up run fills the bytecode caches. The command exits with
+status 1 when a median is over its budget::
+
+    python -m students.benchmarks.cold_start
+    python -m students.benchmarks.cold_start --settings student_management.settings
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+
+# Budgets of the lean profile in milliseconds. Medians measured on a
+# single-CPU machine over six 7-run benchmarks: cold start 270-350 ms (about
+# 300 typical), imports 240-310 ms (270) and first request 32-39 ms (35).
+# Each budget is the typical median plus a third, which clears the run-to-run
+# spread but fails once a change adds a large import or first-request work.
+BUDGETS = {
+    'cold_start': 400.0,
+    'imports': 360.0,
+    'first_request': 47.0,
+}
+
+# The project root, from which the children import the project
+ROOT = Path(__file__).resolve().parents[2]
+
+# Run by each child: argv is the settings module, the database and the mode
+_CHILD = '''
+import io, json, sys, time
+start = time.perf_counter()
+import django
+from django.conf import settings
+settings.DATABASES['default']['NAME'] = sys.argv[2]
+if sys.argv[3] == 'migrate':
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    sys.exit()
+
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+timings = {'setup': time.perf_counter() - start}
+
+def request():
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    statuses = []
+    body = b''.join(application(environ, lambda status, headers: statuses.append(status)))
+    if not statuses[0].startswith('200') or not body:
+        raise SystemExit('home page answered ' + statuses[0])
+
+for name in ('first_request', 'second_request'):
+    begin = time.perf_counter()
+    request()
+    timings[name] = time.perf_counter() - begin
+    if name == 'first_request':
+        timings['responded_at'] = time.time()
+print(json.dumps(timings))
+'''
+
+# A line of the -X importtime report: self and cumulative microseconds, then
+# the module name indented by its depth in the import tree
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def parse_importtime(report):
+    """Parses the report of ``python -X importtime``
+
+    Args:
+        report: The standard error of the interpreter
+
+    Returns:
+        A list of (module, self microseconds, cumulative microseconds,
+        depth) tuples, in the order of the report
+    """
+    modules = []
+    for line in report.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            modules.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return modules
+
+
+def by_package(modules):
+    """Returns the import time of each top-level package in microseconds, largest first"""
+    totals = defaultdict(int)
+    for module, self_us, _, _ in modules:
+        totals[module.partition('.')[0]] += self_us
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def _child(settings_module, database, mode, importtime=False):
+    """Runs a child interpreter; returns (launch time, stdout, stderr)"""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, PYTHONPATH=str(ROOT))
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [
+        '-c', _CHILD, settings_module, database, mode,
+    ]
+    launched = time.time()
+    process = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    if process.returncode:
+        raise RuntimeError(f'the {mode} run failed:\n{process.stderr[-2000:]}')
+    return launched, process.stdout, process.stderr
+
+
+def measure(settings_module, rounds):
+    """Measures the start-up of a settings profile
+
+    Returns:
+        A (medians, packages) tuple: the median of each timing in
+        milliseconds, and the import time of each top-level package in the
+        median run, in milliseconds
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database = str(Path(directory) / 'db.sqlite3')
+        _child(settings_module, database, 'migrate')
+        # Warm-up: fills the bytecode caches and the OS file cache
+        _child(settings_module, database, 'measure')
+
+        runs = []
+        for _ in range(rounds):
+            launched, stdout, stderr = _child(settings_module, database, 'measure', importtime=True)
+            timings = json.loads(stdout)
+            modules = parse_importtime(stderr)
+            run = {name: timings[name] * 1000 for name in ('setup', 'first_request', 'second_request')}
+            run['cold_start'] = (timings['responded_at'] - launched) * 1000
+            run['imports'] = sum(self_us for _, self_us, _, _ in modules) / 1000
+            runs.append((run, modules))
+
+    medians = {name: statistics.median(run[name] for run, _ in runs) for name in runs[0][0]}
+    _, modules = sorted(runs, key=lambda item: item[0]['imports'])[len(runs) // 2]
+    return medians, [(package, us / 1000) for package, us in by_package(modules)]
+
+
+def over_budget(medians, budgets):
+    """Returns the names of the timings over their budget"""
+    return [name for name, budget in budgets.items() if budget is not None and medians[name] > budget]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--settings', default='student_management.settings_lean', help='Settings module to start the project with',
+    )
+    parser.add_argument('--rounds', type=int, default=5, help='Measured runs (the medians are reported)')
+    parser.add_argument('--top', type=int, default=8, help='Packages listed by import time')
+    for name, budget in BUDGETS.items():
+        parser.add_argument(
+            f'--max-{name.replace("_", "-")}-ms', type=float, default=budget, dest=name,
+            help=f'Budget of the {name.replace("_", " ")} median in ms (default {budget:g}, 0 to skip)',
+        )
+    args = parser.parse_args(argv)
+
+    medians, packages = measure(args.settings, args.rounds)
+    budgets = {name: getattr(args, name) or None for name in BUDGETS}
+    print(f'{args.settings}, median of {args.rounds} runs')
+    for name in ('cold_start', 'imports', 'setup', 'first_request', 'second_request'):
+        budget = f'   (budget {budgets[name]:g})' if budgets.get(name) else ''
+        print(f'  {name.replace("_", " "):<16} {medians[name]:>8.1f} ms{budget}')
+    print('imports by package')
+    for package, ms in packages[:args.top]:
+        print(f'  {package:<24} {ms:>8.1f} ms')
+
+    exceeded = over_budget(medians, budgets)
+    if exceeded:
+        print('over budget: ' + ', '.join(exceeded), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
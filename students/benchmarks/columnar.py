@@ -0,0 +1,105 @@
+"""Benchmark of roster-wide analytics: nested dicts against columnar arrays
+
+Compares pure-Python loops over the ``{name: {subject: grade}}`` state with
+the vectorized operations of ``ColumnarGradebook`` (requires NumPy)::
+
+    python -m students.benchmarks.columnar --grades 1000000
+"""
+import argparse
+import heapq
+import random
+import statistics
+import sys
+import time
+
+from students.columnar import ColumnarGradebook
+
+SUBJECTS = ['math', 'science', 'history', 'art', 'music', 'physics', 'biology', 'literature']
+
+
+def make_roster(grades, subjects_per_student=4, seed=0):
+    """Builds a roster dictionary holding about ``grades`` grades"""
+    rng = random.Random(seed)
+    return {
+        f'student{i}': {subject: rng.randint(0, 100) for subject in rng.sample(SUBJECTS, subjects_per_student)}
+        for i in range(grades // subjects_per_student)
+    }
+
+
+# Pure-Python versions of each analytic over the nested dictionaries
+def _loop_student_averages(roster):
+    return {name: sum(s.values()) / len(s) if s else 0 for name, s in roster.items()}
+
+
+def _loop_subject_means(roster):
+    totals, counts = {}, {}
+    for subjects in roster.values():
+        for subject, grade in subjects.items():
+            totals[subject] = totals.get(subject, 0) + grade
+            counts[subject] = counts.get(subject, 0) + 1
+    return {subject: totals[subject] / counts[subject] for subject in totals}
+
+
+def _loop_percentile(roster):
+    grades = [grade for subjects in roster.values() for grade in subjects.values()]
+    return statistics.quantiles(grades, n=100)[89]
+
+
+def _loop_top_k(roster, k=10):
+    return heapq.nlargest(k, _loop_student_averages(roster).items(), key=lambda item: item[1])
+
+
+def _timed(func, repeat, setup=lambda: None):
+    """Returns the best time of func(setup()) over several runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(grades, repeat=3):
+    """Returns (analytic, loop seconds, vectorized seconds) rows plus build stats"""
+    roster = make_roster(grades)
+    start = time.perf_counter()
+    gradebook = ColumnarGradebook.from_mapping(roster)
+    build = time.perf_counter() - start
+
+    # Each vectorized run gets a fresh gradebook over the same columns, so
+    # the arrays it derives and caches on first use are included in the time
+    def fresh():
+        return ColumnarGradebook(
+            gradebook.students, gradebook.subjects,
+            gradebook.student_idx, gradebook.subject_idx, gradebook.grades,
+        )
+
+    cases = [
+        ('student averages', _loop_student_averages, lambda g: g.student_averages()),
+        ('subject means', _loop_subject_means, lambda g: g.subject_means()),
+        ('90th percentile', _loop_percentile, lambda g: g.percentile(90)),
+        ('top 10 by average', _loop_top_k, lambda g: g.top_k(10)),
+    ]
+    rows = [
+        (label, _timed(loop, repeat, lambda: roster), _timed(vectorized, repeat, fresh))
+        for label, loop, vectorized in cases
+    ]
+    return rows, build, gradebook.nbytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--grades', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rows, build, nbytes = run(args.grades, args.repeat)
+    print(f'{args.grades} grades, columnar build {build:.2f}s, columns {nbytes / 1e6:.1f} MB')
+    print(f"{'analytic':<20} {'loops (ms)':>12} {'columnar (ms)':>14} {'speedup':>8}")
+    for label, loop, vectorized in rows:
+        print(f'{label:<20} {loop * 1e3:>12.1f} {vectorized * 1e3:>14.2f} {loop / vectorized:>7.0f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Scaling benchmark for the functional core operations
+
+Measures how the cost of each mutation grows with roster size, comparing the
+persistent Roster implementation in ``functional_core`` with the previous
+dictionary-copying approach. Run it with::
+
+    python -m students.benchmarks.core_scaling --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import time
+
+from students.functional_core import (
+    add_student, add_subject, update_grade, remove_student
+)
+from students.roster import Roster
+
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+SUBJECTS = ['math', 'science', 'history', 'art']
+
+
+# The dictionary-copying implementations the functional core used to have,
+# kept here as the baseline to compare against
+def _copy_add_student(students, name, subjects_grades):
+    return lambda: {**students(), name: subjects_grades}
+
+
+def _copy_add_subject(students, name, subject, grade):
+    if name not in students():
+        return students
+    updated_subjects = {**students()[name], subject: grade}
+    return lambda: {**students(), name: updated_subjects}
+
+
+def _copy_update_grade(students, name, subject, new_grade):
+    if name not in students() or subject not in students()[name]:
+        return students
+    updated_subjects = {**students()[name], subject: new_grade}
+    return lambda: {**students(), name: updated_subjects}
+
+
+def _copy_remove_student(students, name):
+    return lambda: {k: v for k, v in students().items() if k != name}
+
+
+def make_roster(size):
+    """Builds a roster dictionary with ``size`` students and a few subjects each"""
+    return {
+        f'student{i}': {subject: (i * 7 + j * 13) % 101 for j, subject in enumerate(SUBJECTS)}
+        for i in range(size)
+    }
+
+
+def _operations(add_student_, add_subject_, update_grade_, remove_student_, size):
+    """Returns (label, callable) pairs that each perform one mutation"""
+    target = f'student{size // 2}'
+    return [
+        ('add_student', lambda state, i: add_student_(state, f'new{i}', {'math': 80})()),
+        ('add_subject', lambda state, i: add_subject_(state, target, f'extra{i}', 75)()),
+        ('update_grade', lambda state, i: update_grade_(state, target, 'math', i % 101)()),
+        ('remove_student', lambda state, i: remove_student_(state, f'student{i % size}')()),
+    ]
+
+
+def _time_per_op(operation, state, repeat):
+    """Returns the mean seconds per call of operation on the same state"""
+    start = time.perf_counter()
+    for i in range(repeat):
+        operation(state, i)
+    return (time.perf_counter() - start) / repeat
+
+
+def run(sizes, repeat=20):
+    """Runs the benchmark and returns one result row per (size, operation)
+
+    Args:
+        sizes: Roster sizes to measure
+        repeat: Number of calls to average over for each measurement
+
+    Returns:
+        A list of dictionaries with size, operation and microseconds per op
+    """
+    rows = []
+    for size in sizes:
+        roster = make_roster(size)
+        dict_state = lambda: roster
+        persistent = Roster(roster)
+        map_state = lambda: persistent
+
+        copying = _operations(
+            _copy_add_student, _copy_add_subject, _copy_update_grade, _copy_remove_student, size
+        )
+        structural = _operations(add_student, add_subject, update_grade, remove_student, size)
+
+        for (label, copy_op), (_, map_op) in zip(copying, structural):
+            # The copying baseline is O(N) per call, so fewer calls suffice
+            copy_us = _time_per_op(copy_op, dict_state, max(1, repeat // 4)) * 1e6
+            map_us = _time_per_op(map_op, map_state, repeat) * 1e6
+            rows.append({
+                'size': size,
+                'operation': label,
+                'dict_copy_us': copy_us,
+                'persistent_us': map_us,
+            })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>10} {'operation':<15} {'dict copy (us)':>15} {'persistent (us)':>16} {'speedup':>8}")
+    for row in run(args.sizes, args.repeat):
+        speedup = row['dict_copy_us'] / row['persistent_us']
+        print(
+            f"{row['size']:>10} {row['operation']:<15} "
+            f"{row['dict_copy_us']:>15.1f} {row['persistent_us']:>16.1f} {speedup:>7.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Benchmark of the parallel export against the number of worker processes
+
+Exports the transcripts of a generated roster to a temporary file with
+1, 2, 4... workers up to the number of CPUs, and reports the rows per
+second and the speedup over one worker::
+
+    python -m students.benchmarks.export --students 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from students.export import DEFAULT_CHUNK_SIZE, EXPORTS, FORMATS, export_roster
+from students.roster import Roster
+
+from .generator import generate_roster
+
+
+def _worker_counts(limit):
+    counts, workers = [], 1
+    while workers < limit:
+        counts.append(workers)
+        workers *= 2
+    return counts + [limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=200_000)
+    parser.add_argument('--kind', choices=EXPORTS, default='transcripts')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    roster = Roster(generate_roster(args.students))
+    # Build the indexes up front so that every run pays the same
+    roster.names, roster.aggregates, roster.subjects
+    print(f'{args.students} students, {args.kind} as {args.format}, chunks of {args.chunk_size}')
+
+    base = None
+    with tempfile.TemporaryFile() as output:
+        for workers in _worker_counts(args.max_workers):
+            output.seek(0)
+            output.truncate()
+            start = time.perf_counter()
+            result = export_roster(lambda: roster, args.kind, args.format, output, args.chunk_size, workers)
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            print(
+                f'{workers:>3} workers: {result.rows / elapsed:>12.0f} rows/s, '
+                f'{result.bytes / elapsed / 1e6:>7.1f} MB/s, speedup {base / elapsed:.2f}x'
+            )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Seeded generator of synthetic rosters for the benchmarks
+
+The same arguments always give the same roster, so that runs on different
+machines or commits measure the same data.
+"""
+import random
+
+
+# The first subjects are the ones used throughout the app; larger pools
+# continue with numbered ones
+SUBJECTS = ['math', 'science', 'history', 'art', 'music', 'biology', 'chemistry', 'physics']
+
+
+def subject_pool(count):
+    """Returns ``count`` subject names"""
+    return SUBJECTS[:count] + [f'subject{i}' for i in range(len(SUBJECTS), count)]
+
+
+def student_name(index):
+    """Returns the name of the index-th generated student"""
+    return f'student{index:07d}'
+
+
+def generate_roster(students, subjects_per_student=4, subjects=8, seed=0, grades=(0, 100)):
+    """Generates a roster dictionary
+
+    Every student takes ``subjects_per_student`` distinct subjects drawn from
+    a pool of ``subjects``, with uniformly distributed grades.
+
+    Args:
+        students: Number of students
+        subjects_per_student: Subjects taken by each student
+        subjects: Size of the pool of subjects
+        seed: Seed of the random generator
+        grades: Inclusive (lowest, highest) grade
+
+    Returns:
+        A {name: {subject: grade}} dictionary
+
+    Raises:
+        ValueError: If students take more subjects than the pool holds
+    """
+    if subjects_per_student > subjects:
+        raise ValueError('subjects_per_student cannot exceed the number of subjects')
+    rng = random.Random(seed)
+    pool = subject_pool(subjects)
+    low, high = grades
+    return {
+        student_name(i): {subject: rng.randint(low, high) for subject in rng.sample(pool, subjects_per_student)}
+        for i in range(students)
+    }
@@ -0,0 +1,75 @@
+"""Benchmark of the cost of the request metrics
+
+Serves the same mix of home page views and form posts with and without
+``MetricsMiddleware``, alternating rounds so both see the same conditions,
+and compares the median time per request. The phase timers cannot be
+switched off, so their own cost is measured separately::
+
+    python -m students.benchmarks.metrics_overhead --requests 2000
+"""
+import argparse
+import statistics
+import sys
+import time
+import timeit
+
+
+def _round(client, requests):
+    """Serves ``requests`` requests; returns the time per request in seconds"""
+    start = time.perf_counter()
+    for i in range(requests // 2):
+        client.post('/', {'action': 'update_grade', 'name': f'student{i % 50}', 'subject': 'math', 'grade': i % 100})
+        client.get('/')
+    return (time.perf_counter() - start) / (requests // 2 * 2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per round')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    import os
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'student_management.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment
+
+    from students import metrics
+    from students.state_store import get_store
+
+    setup_test_environment()
+    without = [entry for entry in settings.MIDDLEWARE if entry != 'students.metrics.MetricsMiddleware']
+
+    # In-memory roster and sessions, so the comparison is not lost in disk noise
+    with override_settings(
+        STUDENT_STATE_STORE='students.state_store.MemoryStore',
+        SESSION_ENGINE='django.contrib.sessions.backends.cache',
+        ALLOWED_HOSTS=['*'],
+    ):
+        get_store.cache_clear()
+        client = Client()
+        for i in range(50):
+            client.post('/', {'action': 'add_student', 'name': f'student{i}', 'subjects': 'math:0, art:0'})
+
+        timings = {'on': [], 'off': []}
+        for _ in range(args.rounds):
+            timings['on'].append(_round(client, args.requests))
+            with override_settings(MIDDLEWARE=without):
+                timings['off'].append(_round(client, args.requests))
+        get_store.cache_clear()
+
+    on, off = statistics.median(timings['on']), statistics.median(timings['off'])
+    print(f'without middleware: {off * 1e6:.0f} us/request')
+    print(f'with middleware:    {on * 1e6:.0f} us/request ({(on - off) / off:+.1%})')
+
+    timer = timeit.Timer('with phase("x"): pass', globals={'phase': metrics.phase})
+    per_phase = min(timer.repeat(5, 100_000)) / 100_000
+    print(f'phase timer: {per_phase * 1e6:.2f} us each, {per_phase * 4 / off:.2%} of a request at 4 per request')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
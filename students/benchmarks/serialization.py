@@ -0,0 +1,76 @@
+"""Benchmark of roster serializers: payload size and encode/decode time
+
+Compares Django's default session serializer (JSONSerializer), the same
+JSON compressed with zlib as django.core.signing does, and the binary
+roster serializer with and without compression::
+
+    python -m students.benchmarks.serialization --grades 1000 100000 1000000
+"""
+import argparse
+import gc
+import sys
+import time
+import zlib
+
+
+class _CompressedJSON:
+    """Django's JSON payload compressed like signing.dumps(compress=True)"""
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def dumps(self, students):
+        return zlib.compress(self.serializer.dumps(students))
+
+    def loads(self, data):
+        return self.serializer.loads(zlib.decompress(data))
+
+
+def _best(function, argument, repeat):
+    """Returns (result, best time in seconds) over ``repeat`` calls"""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function(argument)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--grades', type=int, nargs='+', default=[1_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    import os
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'student_management.settings')
+    import django
+    django.setup()
+
+    from django.core.signing import JSONSerializer
+
+    from students.benchmarks.columnar import make_roster
+    from students.serializers import BinaryRosterSerializer
+
+    serializers = [
+        ('django json', JSONSerializer()),
+        ('django json+zlib', _CompressedJSON(JSONSerializer())),
+        ('binary', BinaryRosterSerializer(compress=False)),
+        ('binary+zlib', BinaryRosterSerializer()),
+    ]
+    print(f'{"grades":>9}  {"serializer":<17} {"bytes":>11} {"ratio":>6} {"encode ms":>10} {"decode ms":>10}')
+    for grades in args.grades:
+        roster = make_roster(grades)
+        baseline = None
+        for label, serializer in serializers:
+            payload, encode = _best(serializer.dumps, roster, args.repeat)
+            decoded, decode = _best(serializer.loads, payload, args.repeat)
+            assert decoded == roster
+            baseline = baseline or len(payload)
+            print(f'{grades:>9}  {label:<17} {len(payload):>11} {baseline / len(payload):>5.1f}x '
+                  f'{encode * 1e3:>10.1f} {decode * 1e3:>10.1f}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Benchmark of the memory used by workers sharing a mapped roster snapshot
+
+Starts 1, 2, 4... worker processes that each read a generated roster,
+either from a shared snapshot (students.shared_snapshot) or by decoding
+their own copy of it (the binary serializer of the journal snapshots),
+and reports the total proportional set size (PSS) of the workers, which
+splits shared pages between the processes mapping them. Workers that read
+no roster at all (``none``) give the cost of the workers themselves.
+Linux only::
+
+    python -m students.benchmarks.shared_snapshot --students 1000000
+"""
+import argparse
+import gc
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _pss_kb():
+    """Returns the proportional set size of this process in KB"""
+    with open('/proc/self/smaps_rollup') as file:
+        for line in file:
+            if line.startswith('Pss:'):
+                return int(line.split()[1])
+    raise RuntimeError('no Pss in /proc/self/smaps_rollup')
+
+
+def _worker(mode, directory, names, lookups, barrier, results):
+    from students.serializers import BinaryRosterSerializer
+    from students.shared_snapshot import SharedRoster
+
+    start = time.perf_counter()
+    if mode == 'none':
+        roster = {}
+    elif mode == 'shared':
+        roster = SharedRoster(Path(directory) / 'roster.snapshot')
+    else:
+        roster = BinaryRosterSerializer(compress=False).loads((Path(directory) / 'roster.bin').read_bytes())
+    opened = time.perf_counter() - start
+
+    rng = random.Random()
+    start = time.perf_counter()
+    for _ in range(lookups):
+        roster.get(rng.choice(names))
+    looked_up = time.perf_counter() - start
+
+    # Measure while every worker holds its roster
+    barrier.wait()
+    results.put((_pss_kb(), opened, lookups / looked_up))
+    barrier.wait()
+
+
+def _run(mode, directory, names, workers, lookups):
+    context = multiprocessing.get_context('fork')
+    barrier, results = context.Barrier(workers), context.Queue()
+    processes = [
+        context.Process(target=_worker, args=(mode, directory, names, lookups, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    measured = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return (
+        sum(pss for pss, _, _ in measured) / 1024,
+        max(opened for _, opened, _ in measured),
+        min(rate for _, _, rate in measured),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=200_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--lookups', type=int, default=20_000, help='Lookups by name per worker')
+    args = parser.parse_args(argv)
+
+    import os
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'student_management.settings')
+    import django
+    django.setup()
+
+    from students.serializers import BinaryRosterSerializer
+    from students.shared_snapshot import write_snapshot
+
+    from .generator import generate_roster, student_name
+
+    with tempfile.TemporaryDirectory() as directory:
+        roster = generate_roster(args.students)
+        write_snapshot(Path(directory) / 'roster.snapshot', roster)
+        (Path(directory) / 'roster.bin').write_bytes(BinaryRosterSerializer(compress=False).dumps(roster))
+        # Keep the workers' inherited memory out of the comparison
+        del roster
+        gc.collect()
+        names = [student_name(i) for i in range(args.students)]
+
+        print(f'{args.students} students, {args.lookups} lookups per worker')
+        print(f"{'workers':>7} {'mode':>8} {'total PSS MB':>13} {'open s':>8} {'lookups/s':>10}")
+        for workers in args.workers:
+            for mode in ('none', 'shared', 'private'):
+                pss, opened, rate = _run(mode, directory, names, workers, args.lookups)
+                print(f'{workers:>7} {mode:>8} {pss:>13.1f} {opened:>8.3f} {rate:>10.0f}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""Regression benchmark suite, run by ``python manage.py benchmark``
+
+Each case times one operation of the app on a generated roster: every
+functional core function, the session manager round trips and the home
+view through Django's test client. For each case the suite reports the
+throughput, the memory allocated by one operation (traced by tracemalloc)
+and the peak RSS of the process, and can compare the throughput against a
+baseline saved by an earlier run.
+"""
+import gc
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+from django.test import Client
+
+from students.functional_core import (
+    add_student, add_subject, update_grade, remove_student,
+    calculate_average, subject_average, students_taking, students_in_grade_range,
+    iter_students, page_start, list_students, rank_of, top_k, percentile, search_students
+)
+from students.roster import Roster
+from students.session_manager import StudentSessionManager
+from students.state_store import get_store
+
+from .generator import generate_roster, subject_pool
+
+
+# A benchmark case: a name ('group.operation'), whether it needs the
+# database, and a function taking a Context and returning the operation to
+# time (a function of no arguments)
+Case = namedtuple('Case', ['name', 'needs_db', 'setup'])
+
+# One row of results
+Result = namedtuple('Result', ['name', 'ops_per_sec', 'alloc_kb', 'peak_rss_mb'])
+
+
+class Context:
+    """The roster and random choices shared by the cases of a run"""
+
+    def __init__(self, students, subjects_per_student, subjects, seed):
+        self.params = {
+            'students': students,
+            'subjects_per_student': subjects_per_student,
+            'subjects': subjects,
+            'seed': seed,
+        }
+        self.roster = generate_roster(students, subjects_per_student, subjects, seed)
+        self.names = list(self.roster)
+        self.subjects = subject_pool(subjects)
+        self.rng = random.Random(seed)
+        self._state = None
+
+    def state(self):
+        """Returns a state lambda of the generated roster, built once
+
+        Every index is built up front, outside the timings, so that each
+        change case pays the upkeep of all of them whatever ran before it,
+        as it does in the app once a roster has been queried.
+        """
+        if self._state is None:
+            roster = Roster(self.roster).build_indexes()
+            self._state = lambda: roster
+        return self._state
+
+    def name(self):
+        return self.rng.choice(self.names)
+
+    def subject_of(self, name):
+        return next(iter(self.roster[name]))
+
+
+def _add_student(context):
+    state, counter = context.state(), itertools.count()
+    return lambda: add_student(state, f'new{next(counter)}', {'math': 80})()
+
+
+def _add_subject(context):
+    state, counter = context.state(), itertools.count()
+    return lambda: add_subject(state, context.name(), f'extra{next(counter)}', 75)()
+
+
+def _update_grade(context):
+    state = context.state()
+
+    def operation():
+        name = context.name()
+        return update_grade(state, name, context.subject_of(name), context.rng.randint(0, 100))()
+    return operation
+
+
+def _remove_student(context):
+    state = context.state()
+    return lambda: remove_student(state, context.name())()
+
+
+def _calculate_average(context):
+    state = context.state()
+    return lambda: calculate_average(state, context.name())()
+
+
+def _subject_average(context):
+    state = context.state()
+    return lambda: subject_average(state, context.rng.choice(context.subjects))()
+
+
+def _students_taking(context):
+    state = context.state()
+    return lambda: students_taking(state, context.rng.choice(context.subjects), 0, 100)()
+
+
+def _students_in_grade_range(context):
+    state = context.state()
+    return lambda: students_in_grade_range(state, context.rng.choice(context.subjects), 40, 60, 0, 100)()
+
+
+def _page(context):
+    state = context.state()
+
+    def operation():
+        start = page_start(state, context.rng.randrange(len(context.names) or 1))()
+        return list(iter_students(state, start, 100)())
+    return operation
+
+
+def _rank_of(context):
+    state = context.state()
+    return lambda: rank_of(state, context.name())()
+
+
+def _top_10(context):
+    state = context.state()
+    return lambda: top_k(state, 10)()
+
+
+def _percentile(context):
+    state = context.state()
+    return lambda: percentile(state, context.rng.uniform(0, 100))()
+
+
+def _search_prefix(context):
+    state = context.state()
+    return lambda: search_students(state, context.name()[:10])()
+
+
+def _search_typo(context):
+    state = context.state()
+
+    def operation():
+        # Swap two adjacent characters of a name
+        name = context.name()
+        i = context.rng.randrange(len(name) - 1)
+        return search_students(state, name[:i] + name[i + 1] + name[i] + name[i + 2:])()
+    return operation
+
+
+def _list_students(context):
+    state = context.state()
+    return lambda: list_students(state)()
+
+
+# Session and view cases run against the configured state store; the
+# generated roster is saved once under the roster key of a session
+
+def _session_with_roster(context):
+    """Returns a session (a plain dictionary) whose roster is the generated one"""
+    session = {}
+    get_store().save(StudentSessionManager.get_roster_key(session), Roster(context.roster))
+    return session
+
+
+def _session_get_state(context):
+    session = _session_with_roster(context)
+    return lambda: StudentSessionManager.get_state(session)()
+
+
+def _session_round_trip(context):
+    session = _session_with_roster(context)
+
+    def operation():
+        state = StudentSessionManager.get_state(session)
+        name = context.name()
+        StudentSessionManager.update_session(
+            session, update_grade(state, name, context.subject_of(name), context.rng.randint(0, 100))
+        )
+    return operation
+
+
+def _session_transact(context):
+    session = _session_with_roster(context)
+
+    def operation():
+        name = context.name()
+        grade = context.rng.randint(0, 100)
+        StudentSessionManager.transact(
+            session, lambda state: (update_grade(state, name, context.subject_of(name), grade), None)
+        )
+    return operation
+
+
+def _client_with_roster(context):
+    """Returns a test client whose session's roster is the generated one"""
+    client = Client()
+    client.get('/', {'limit': 1})
+    get_store().save(client.session[StudentSessionManager.ROSTER_KEY], Roster(context.roster))
+    return client
+
+
+def _home_get(context):
+    client = _client_with_roster(context)
+    return lambda: client.get('/')
+
+
+def _home_post(context):
+    client = _client_with_roster(context)
+
+    def operation():
+        name = context.name()
+        client.post('/', {
+            'action': 'update_grade', 'name': name,
+            'subject': context.subject_of(name), 'grade': context.rng.randint(0, 100),
+        })
+    return operation
+
+
+CASES = [
+    Case('core.add_student', False, _add_student),
+    Case('core.add_subject', False, _add_subject),
+    Case('core.update_grade', False, _update_grade),
+    Case('core.remove_student', False, _remove_student),
+    Case('core.calculate_average', False, _calculate_average),
+    Case('core.subject_average', False, _subject_average),
+    Case('core.students_taking', False, _students_taking),
+    Case('core.students_in_grade_range', False, _students_in_grade_range),
+    Case('core.page_of_100', False, _page),
+    Case('core.rank_of', False, _rank_of),
+    Case('core.top_10', False, _top_10),
+    Case('core.percentile', False, _percentile),
+    Case('core.search_prefix', False, _search_prefix),
+    Case('core.search_typo', False, _search_typo),
+    Case('core.list_students', False, _list_students),
+    Case('session.get_state', True, _session_get_state),
+    Case('session.round_trip', True, _session_round_trip),
+    Case('session.transact', True, _session_transact),
+    Case('views.home_get', True, _home_get),
+    Case('views.home_post', True, _home_post),
+]
+
+
+def select_cases(only=None):
+    """Returns the cases whose name starts with one of the given prefixes (all by default)"""
+    if not only:
+        return list(CASES)
+    return [case for case in CASES if any(case.name.startswith(prefix) for prefix in only)]
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def _throughput(operation, min_time, rounds):
+    """Returns the best operations per second over ``rounds`` timed rounds
+
+    Each round calls the operation until ``min_time`` seconds have passed.
+    """
+    best = 0.0
+    for _ in range(rounds):
+        calls = 0
+        start = time.perf_counter()
+        deadline = start + min_time
+        while True:
+            operation()
+            calls += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+        best = max(best, calls / (now - start))
+    return best
+
+
+def _allocated_kb(operation, samples):
+    """Returns the mean peak of memory allocated during one operation, in KB"""
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            operation()
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / samples / 1024
+
+
+def run_case(case, context, min_time=0.5, rounds=3, alloc_samples=20):
+    """Runs one case and returns its Result"""
+    operation = case.setup(context)
+    # Warm-up call, e.g. for the caches of the session and view cases
+    operation()
+    gc.collect()
+    ops_per_sec = _throughput(operation, min_time, rounds)
+    alloc_kb = _allocated_kb(operation, alloc_samples)
+    return Result(case.name, ops_per_sec, alloc_kb, peak_rss_mb())
+
+
+def save_baseline(path, context, results):
+    """Writes results as a baseline JSON file"""
+    with open(path, 'w') as file:
+        json.dump({
+            'params': context.params,
+            'python': platform.python_version(),
+            'results': {result.name: result._asdict() for result in results},
+        }, file, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(results, baseline, threshold):
+    """Compares results with a baseline
+
+    Args:
+        results: A list of Results
+        baseline: A baseline as read by ``load_baseline``
+        threshold: Largest accepted slowdown, as a fraction of the baseline
+            throughput (0.1 for 10%)
+
+    Returns:
+        A list of (name, baseline ops/sec, ops/sec, change) tuples, one per
+        case present in both, and the names of the cases that regressed
+    """
+    rows, regressions = [], []
+    for result in results:
+        previous = baseline['results'].get(result.name)
+        if previous is None:
+            continue
+        change = result.ops_per_sec / previous['ops_per_sec'] - 1
+        rows.append((result.name, previous['ops_per_sec'], result.ops_per_sec, change))
+        if change < -threshold:
+            regressions.append(result.name)
+    return rows, regressions
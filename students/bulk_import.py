@@ -0,0 +1,179 @@
+import csv
+import json
+from collections import namedtuple
+
+from .functional_core import add_student, parse_subjects, pipeline
+
+
+# Number of rows applied between two commits of the state
+DEFAULT_BATCH_SIZE = 1000
+
+# Supported input formats
+FORMATS = ('csv', 'jsonl')
+
+# One parsed input row: either name and subjects, or an error message
+Row = namedtuple('Row', ['line', 'name', 'subjects', 'error'])
+
+# Summary of an import
+ImportResult = namedtuple('ImportResult', ['imported', 'failed', 'batches'])
+
+
+def detect_format(filename):
+    """Guesses the input format from a file name (CSV unless it looks like JSON lines)"""
+    return 'jsonl' if str(filename).lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def parse_grade(value):
+    """Converts a grade given as an int or a string of digits
+
+    Raises:
+        ValueError: If the value is not a whole number
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'invalid grade {value!r}')
+    return int(value)
+
+
+def coerce_subjects(subjects):
+    """Converts subjects given as a "math:90, science:85" string or a dict
+
+    Raises:
+        ValueError: If the value has another type or a grade is not a whole number
+    """
+    if isinstance(subjects, str):
+        return parse_subjects(subjects)
+    if isinstance(subjects, dict):
+        return {str(subject).strip(): parse_grade(grade) for subject, grade in subjects.items()}
+    raise ValueError(f'invalid subjects {subjects!r}')
+
+
+def _read_csv(lines):
+    """Yields Rows from CSV text with a header line
+
+    The header must have a ``name`` column. Subjects are read either from a
+    ``subjects`` column in the form's "math:90, science:85" format, or from
+    one column per subject holding the grade (empty cells are skipped).
+    """
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or 'name' not in reader.fieldnames:
+        yield Row(1, None, None, 'the header must contain a "name" column')
+        return
+    subject_columns = [field for field in reader.fieldnames if field not in ('name', 'subjects')]
+
+    for record in reader:
+        line = reader.line_num
+        name = (record.get('name') or '').strip()
+        if not name:
+            yield Row(line, None, None, 'missing name')
+            continue
+        try:
+            if 'subjects' in record:
+                subjects = parse_subjects(record['subjects'] or '')
+            else:
+                subjects = {
+                    column.strip(): parse_grade(record[column].strip())
+                    for column in subject_columns if (record.get(column) or '').strip()
+                }
+        except ValueError:
+            yield Row(line, name, None, 'grades must be whole numbers')
+            continue
+        yield Row(line, name, subjects, None)
+
+
+def _read_jsonl(lines):
+    """Yields Rows from JSON lines
+
+    Each line is an object with a ``name`` and ``subjects``, given either as
+    a {subject: grade} object or as a "math:90, science:85" string.
+    """
+    for line, text in enumerate(lines, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError:
+            yield Row(line, None, None, 'invalid JSON')
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get('name'), str) or not record['name'].strip():
+            yield Row(line, None, None, 'missing name')
+            continue
+        name = record['name'].strip()
+        try:
+            subjects = coerce_subjects(record.get('subjects', {}))
+        except ValueError:
+            yield Row(line, name, None, 'grades must be whole numbers')
+            continue
+        yield Row(line, name, subjects, None)
+
+
+def read_rows(lines, fmt):
+    """Parses an input file lazily, one row at a time
+
+    Args:
+        lines: An iterable of text lines (e.g. an open text file)
+        fmt: 'csv' or 'jsonl'
+
+    Returns:
+        A generator of Row tuples
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown format {fmt!r}, expected one of {", ".join(FORMATS)}')
+    return _read_csv(lines) if fmt == 'csv' else _read_jsonl(lines)
+
+
+def _batch(rows):
+    """Returns a function adding the students of a batch of rows to a state lambda"""
+    def apply(state):
+        # The rows are recorded lazily and applied in one pass when the
+        # state is read
+        state = pipeline(state)
+        for row in rows:
+            state = add_student(state, row.name, row.subjects)
+        return state
+    return apply
+
+
+def import_rows(state, rows, commit, batch_size=DEFAULT_BATCH_SIZE, on_error=None):
+    """Adds the students of the rows to a roster, committing once per batch
+
+    Valid rows are added with ``add_student``; a student that already exists
+    is replaced, as with the form. Rows are consumed one at a time, so
+    memory does not depend on the size of the input.
+
+    A batch is handed to ``commit`` as a function rather than as a state, so
+    that it can be applied to the current roster when it is saved: students
+    changed by other writers while the import runs are kept, unless the
+    import replaces them.
+
+    Args:
+        state: A lambda function returning the state before the import
+        rows: An iterable of Row tuples (see ``read_rows``)
+        commit: Called after each batch with a function that takes a state
+            lambda and returns it with the batch applied; saves it (e.g.
+            with ``StudentSessionManager.transact``) and returns the saved
+            state lambda
+        batch_size: Number of rows per batch
+        on_error: Optional callback called with each invalid Row
+
+    Returns:
+        A (state, ImportResult) tuple with a lambda returning the state
+        saved by the last batch
+    """
+    imported = failed = batches = 0
+    batch = []
+    for row in rows:
+        if row.error:
+            failed += 1
+            if on_error:
+                on_error(row)
+            continue
+        batch.append(row)
+        imported += 1
+        if len(batch) >= batch_size:
+            state = commit(_batch(batch))
+            batches += 1
+            batch = []
+    if batch:
+        state = commit(_batch(batch))
+        batches += 1
+    return state, ImportResult(imported, failed, batches)
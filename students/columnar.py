@@ -0,0 +1,259 @@
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; only the columnar analytics need it
+    np = None
+
+from .roster import as_roster
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('Columnar gradebooks require NumPy: pip install numpy')
+
+
+class ColumnarGradebook:
+    """A read-only, column-oriented copy of a roster for analytics
+
+    Student and subject names are interned once into id tables, and every
+    grade becomes one row of three parallel arrays: ``student_idx`` (int32),
+    ``subject_idx`` (int32) and ``grades`` (int16 whenever the grades fit).
+    That is a few bytes per grade instead of the hundreds taken by nested
+    dictionaries of ints, and it lets roster-wide statistics run as NumPy
+    vector operations instead of Python loops.
+
+    Rows are kept grouped by student, so each student's grades are one
+    contiguous slice. Students without any grade keep their id and are
+    still listed (with an average of 0, as ``calculate_average`` reports).
+    The gradebook never changes, so derived arrays are computed on first
+    use and reused afterwards.
+    """
+
+    __slots__ = ('students', 'subjects', 'student_idx', 'subject_idx', 'grades', '_offsets', '_histogram')
+
+    # Widest grade range summarized with a histogram; wider ranges fall
+    # back to sorting
+    MAX_HISTOGRAM_SPAN = 1 << 16
+
+    def __init__(self, students, subjects, student_idx, subject_idx, grades):
+        """Creates a gradebook from id tables and grade columns
+
+        Args:
+            students: List of student names, indexed by student id
+            subjects: List of subject names, indexed by subject id
+            student_idx: Student id of each grade
+            subject_idx: Subject id of each grade
+            grades: The grades
+        """
+        _require_numpy()
+        student_idx = np.asarray(student_idx, dtype=np.int32)
+        if student_idx.size and np.any(student_idx[1:] < student_idx[:-1]):
+            # Group the rows by student
+            order = np.argsort(student_idx, kind='stable')
+            student_idx, subject_idx, grades = student_idx[order], np.asarray(subject_idx)[order], np.asarray(grades)[order]
+        # Id tables: position -> name
+        self.students = students
+        self.subjects = subjects
+        # Parallel columns, one entry per grade
+        self.student_idx = student_idx
+        self.subject_idx = np.asarray(subject_idx, dtype=np.int32)
+        self.grades = np.asarray(grades)
+        # Start of each student's slice of rows (plus the end), and the
+        # subject x grade histogram, both computed on demand
+        self._offsets = None
+        self._histogram = None
+
+    @classmethod
+    def from_mapping(cls, students):
+        """Builds a gradebook from a {name: {subject: grade}} mapping
+
+        Args:
+            students: A Roster, PersistentMap or dictionary of students
+
+        Returns:
+            A new ColumnarGradebook
+        """
+        _require_numpy()
+        names = []
+        subject_ids = {}
+        student_column, subject_column, grade_column = [], [], []
+        for student_id, (name, subjects) in enumerate(students.items()):
+            names.append(name)
+            for subject, grade in subjects.items():
+                subject_id = subject_ids.get(subject)
+                if subject_id is None:
+                    subject_id = subject_ids[subject] = len(subject_ids)
+                student_column.append(student_id)
+                subject_column.append(subject_id)
+                grade_column.append(grade)
+
+        grades = np.array(grade_column, dtype=np.int64)
+        # Store grades as int16 unless some grade does not fit
+        if not grades.size or (grades.min() >= np.iinfo(np.int16).min and grades.max() <= np.iinfo(np.int16).max):
+            grades = grades.astype(np.int16)
+        return cls(
+            names,
+            list(subject_ids),
+            np.array(student_column, dtype=np.int32),
+            np.array(subject_column, dtype=np.int32),
+            grades,
+        )
+
+    def to_dict(self):
+        """Converts the gradebook back to a {name: {subject: grade}} dictionary"""
+        result = {name: {} for name in self.students}
+        subjects = self.subjects
+        for student_id, subject_id, grade in zip(
+            self.student_idx.tolist(), self.subject_idx.tolist(), self.grades.tolist()
+        ):
+            result[self.students[student_id]][subjects[subject_id]] = grade
+        return result
+
+    def __len__(self):
+        return len(self.grades)
+
+    @property
+    def nbytes(self):
+        """Memory taken by the grade columns, in bytes"""
+        return self.student_idx.nbytes + self.subject_idx.nbytes + self.grades.nbytes
+
+    def _student_offsets(self):
+        if self._offsets is None:
+            counts = np.bincount(self.student_idx, minlength=len(self.students))
+            self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        return self._offsets
+
+    def _subject_histogram(self):
+        """Returns (histogram, lowest grade): grade counts per subject
+
+        ``histogram[subject_id, grade - lowest]`` is the number of such
+        grades, or None when the grades span too wide a range.
+        """
+        if self._histogram is None:
+            if not self.grades.size:
+                self._histogram = (np.zeros((len(self.subjects), 0), dtype=np.int64), 0)
+            else:
+                low, high = int(self.grades.min()), int(self.grades.max())
+                span = high - low + 1
+                if span > self.MAX_HISTOGRAM_SPAN:
+                    self._histogram = (None, low)
+                else:
+                    # One bincount over combined (subject, grade) keys
+                    keys = self.subject_idx.astype(np.int64) * span + (self.grades.astype(np.int64) - low)
+                    counts = np.bincount(keys, minlength=len(self.subjects) * span)
+                    self._histogram = (counts.reshape(len(self.subjects), span), low)
+        return self._histogram
+
+    def _subject_id(self, subject):
+        try:
+            return self.subjects.index(subject)
+        except ValueError:
+            return None
+
+    def student_averages(self):
+        """Returns an array with the average grade of every student, by student id"""
+        offsets = self._student_offsets()
+        counts = np.diff(offsets)
+        totals = np.zeros(len(self.students), dtype=np.int64)
+        graded = counts > 0
+        if self.grades.size:
+            # Each student's grades are a contiguous slice: sum them in one pass
+            totals[graded] = np.add.reduceat(self.grades, offsets[:-1][graded], dtype=np.int64)
+        return np.divide(totals, counts, out=np.zeros(len(self.students)), where=graded)
+
+    def subject_means(self):
+        """Returns a {subject: average grade} dictionary"""
+        histogram, low = self._subject_histogram()
+        if histogram is None:
+            counts = np.bincount(self.subject_idx, minlength=len(self.subjects))
+            totals = np.bincount(self.subject_idx, weights=self.grades, minlength=len(self.subjects))
+        else:
+            counts = histogram.sum(axis=1)
+            totals = histogram @ np.arange(low, low + histogram.shape[1])
+        means = np.divide(totals, counts, out=np.zeros(len(self.subjects)), where=counts > 0)
+        return dict(zip(self.subjects, means.tolist()))
+
+    def percentile(self, q, subject=None):
+        """Returns the q-th percentile(s) of the grades
+
+        Uses linear interpolation, like ``numpy.percentile``, but reads the
+        grade histogram instead of sorting the grades.
+
+        Args:
+            q: A percentile between 0 and 100, or a sequence of them
+            subject: Only consider the grades of this subject
+
+        Returns:
+            A float (or an array for several percentiles), NaN without grades
+        """
+        histogram, low = self._subject_histogram()
+        subject_id = None if subject is None else self._subject_id(subject)
+        if subject is not None and subject_id is None:
+            counts = np.zeros(0, dtype=np.int64)
+        elif histogram is None:
+            grades = self.grades if subject is None else self.grades[self.subject_idx == subject_id]
+            if grades.size:
+                result = np.percentile(grades, q)
+                return result if np.ndim(result) else float(result)
+            counts = np.zeros(0, dtype=np.int64)
+        else:
+            counts = histogram.sum(axis=0) if subject is None else histogram[subject_id]
+
+        total = int(counts.sum())
+        if not total:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float('nan')
+        # Positions in the sorted grades, mapped to values via the cumulative counts
+        cumulative = np.cumsum(counts)
+        position = np.asarray(q, dtype=np.float64) / 100 * (total - 1)
+        below = np.floor(position)
+        lower = np.searchsorted(cumulative, below, side='right') + low
+        upper = np.searchsorted(cumulative, np.ceil(position), side='right') + low
+        result = lower + (upper - lower) * (position - below)
+        return result if np.ndim(result) else float(result)
+
+    def top_k(self, k, subject=None):
+        """Returns the k best students, best first
+
+        Students are ranked by their average grade, or by their grade in a
+        subject when one is given. Only the k best are sorted.
+
+        Args:
+            k: Number of students to return
+            subject: Rank by this subject's grade instead of the average
+
+        Returns:
+            A list of (name, score) tuples
+        """
+        if subject is None:
+            ids = np.arange(len(self.students))
+            scores = self.student_averages()
+        else:
+            mask = self.subject_idx == self._subject_id(subject)
+            ids = self.student_idx[mask]
+            scores = self.grades[mask].astype(np.float64)
+        k = max(min(k, len(scores)), 0)
+        if not k:
+            return []
+        # Partition out the k best in O(n), then sort just those
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self.students[i], float(s)) for i, s in zip(ids[best].tolist(), scores[best].tolist())]
+
+
+# Function to convert a state into a columnar gradebook
+def to_columnar(students):
+    """Converts a state into a ColumnarGradebook
+    Returns:
+        A lambda function that, when called, returns the gradebook
+    """
+    gradebook = ColumnarGradebook.from_mapping(students())
+    return lambda: gradebook
+
+
+# Function to convert a columnar gradebook back into a state
+def from_columnar(gradebook):
+    """Converts a ColumnarGradebook back into a state
+    Returns:
+        A lambda function that, when called, returns a Roster
+    """
+    roster = as_roster(gradebook.to_dict())
+    return lambda: roster
@@ -0,0 +1,227 @@
+"""Class-wide exports of a roster: student transcripts and subject statistics
+
+An export is cut into chunks of rows in a stable order (students by name,
+subjects alphabetically). The chunks are formatted by a pool of worker
+processes and written out in order as they complete, at most a few chunks
+ahead of the writer, so the memory used besides the roster itself depends
+on the chunk size and the number of workers, not on the size of the roster.
+
+Workers read the roster they were started with rather than receiving the
+students of each chunk: where processes are forked, they share the parent's
+roster without copying it, so a task is just a range of rows to format.
+"""
+import csv
+import io
+import json
+import os
+from collections import deque, namedtuple
+
+from .roster import as_roster
+
+
+# What can be exported: a transcript per student, or statistics per subject
+EXPORTS = ('transcripts', 'subjects')
+
+# Supported output formats
+FORMATS = ('csv', 'jsonl')
+
+# Rows formatted by one task
+DEFAULT_CHUNK_SIZE = 10_000
+
+# Chunks queued per worker ahead of the writer; bounds the memory of an export
+CHUNKS_AHEAD = 2
+
+# Columns of each export, in order
+COLUMNS = {
+    'transcripts': ('name', 'subjects', 'count', 'average', 'stddev', 'lowest', 'highest'),
+    'subjects': ('subject', 'students', 'average', 'stddev', 'lowest', 'highest'),
+}
+
+# Summary of an export
+ExportResult = namedtuple('ExportResult', ['rows', 'bytes', 'chunks'])
+
+
+def _transcript(roster, name):
+    """Returns the transcript row of a student"""
+    subjects = roster[name]
+    stats = roster.aggregates.students[name]
+    grades = subjects.values()
+    return {
+        'name': name,
+        'subjects': dict(subjects),
+        'count': stats.count,
+        'average': round(stats.mean(), 2),
+        'stddev': round(stats.stddev(), 2),
+        'lowest': min(grades, default=None),
+        'highest': max(grades, default=None),
+    }
+
+
+def _subject_row(roster, subject):
+    """Returns the statistics row of a subject"""
+    stats = roster.aggregates.subjects[subject]
+    # The grade index is ordered by (grade, name): its ends are the extremes
+    by_grade = roster.subjects.by_grade[subject]
+    (lowest, _), _ = next(by_grade.items_from(0, 1))
+    (highest, _), _ = next(by_grade.items_from(len(by_grade) - 1))
+    return {
+        'subject': subject,
+        'students': stats.count,
+        'average': round(stats.mean(), 2),
+        'stddev': round(stats.stddev(), 2),
+        'lowest': lowest,
+        'highest': highest,
+    }
+
+
+def _keys(roster, kind):
+    """Returns the ordered row keys of an export, indexable by position"""
+    if kind == 'transcripts':
+        return roster.names
+    return sorted(roster.aggregates.subjects)
+
+
+def _rows(roster, kind, start, stop):
+    """Yields the rows of an export from position start to stop"""
+    if kind == 'transcripts':
+        for name, _ in roster.names.items_from(start, stop):
+            yield _transcript(roster, name)
+    else:
+        for subject in _keys(roster, kind)[start:stop]:
+            yield _subject_row(roster, subject)
+
+
+def _format(rows, kind, fmt):
+    """Formats rows as CSV lines (without header) or JSON lines"""
+    if fmt == 'jsonl':
+        return ''.join(json.dumps(row) + '\n' for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        if kind == 'transcripts':
+            # The form's "math:90, art:70" format, so the file can be imported again
+            row['subjects'] = ', '.join(f'{subject}:{grade}' for subject, grade in row['subjects'].items())
+        writer.writerow([row[column] for column in COLUMNS[kind]])
+    return buffer.getvalue()
+
+
+def format_chunk(roster, kind, fmt, start, stop):
+    """Formats the rows of an export from position start to stop
+
+    Returns:
+        The encoded chunk as bytes
+    """
+    return _format(_rows(roster, kind, start, stop), kind, fmt).encode()
+
+
+def header(kind, fmt):
+    """Returns the encoded header of an export (CSV only)"""
+    if fmt != 'csv':
+        return b''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(COLUMNS[kind])
+    return buffer.getvalue().encode()
+
+
+# The roster of a worker process, set by _init_worker
+_worker_roster = None
+
+
+def _init_worker(state):
+    global _worker_roster
+    _worker_roster = as_roster(state)
+
+
+def _format_worker_chunk(kind, fmt, start, stop):
+    return format_chunk(_worker_roster, kind, fmt, start, stop)
+
+
+def _pool(roster, workers):
+    """Starts a pool of workers holding the roster
+
+    Forked workers inherit the roster as it is; otherwise each one is sent
+    a plain dictionary, much cheaper to pickle than a Roster and its
+    indexes, and rebuilds the roster from it.
+    """
+    # Imported here rather than at startup: only parallel exports need them
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context, state = multiprocessing.get_context('fork'), roster
+    else:
+        context, state = multiprocessing.get_context(), roster.to_dict()
+    return ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(state,))
+
+
+def iter_export(state, kind, fmt, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    """Yields an export as encoded chunks, in order
+
+    Args:
+        state: A lambda function returning the roster to export
+        kind: One of EXPORTS
+        fmt: One of FORMATS
+        chunk_size: Rows formatted by one task
+        workers: Worker processes (the number of CPUs by default); with one
+            worker, or a single chunk, the export is formatted in-process
+
+    Yields:
+        The header, if any, then one bytes object per chunk
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f'unknown export {kind!r}')
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown format {fmt!r}')
+    roster = as_roster(state())
+    # Build the indexes the rows are read from once, before workers share them
+    roster.aggregates
+    if kind == 'subjects':
+        roster.subjects
+    total = len(_keys(roster, kind))
+    ranges = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    workers = workers or os.cpu_count() or 1
+
+    yield header(kind, fmt)
+    if workers == 1 or len(ranges) <= 1:
+        for start, stop in ranges:
+            yield format_chunk(roster, kind, fmt, start, stop)
+        return
+
+    pool = _pool(roster, min(workers, len(ranges)))
+    try:
+        # Submit chunks as earlier ones are written, a bounded window ahead
+        pending = deque()
+        for start, stop in ranges:
+            pending.append(pool.submit(_format_worker_chunk, kind, fmt, start, stop))
+            if len(pending) >= workers * CHUNKS_AHEAD:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # An abandoned export (e.g. a dropped download) cancels what is queued
+        pool.shutdown(cancel_futures=True)
+
+
+def export_roster(state, kind, fmt, output, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    """Writes an export to a binary file
+
+    Args:
+        state: A lambda function returning the roster to export
+        kind: One of EXPORTS
+        fmt: One of FORMATS
+        output: A file opened for writing in binary mode
+        chunk_size: Rows formatted by one task
+        workers: Worker processes (the number of CPUs by default)
+
+    Returns:
+        An ExportResult with the number of rows, bytes and chunks written
+    """
+    roster = as_roster(state())
+    rows = len(roster) if kind == 'transcripts' else len(roster.aggregates.subjects)
+    written = chunks = 0
+    for chunk in iter_export(lambda: roster, kind, fmt, chunk_size, workers):
+        output.write(chunk)
+        written += len(chunk)
+        chunks += 1
+    # The header is not a chunk of rows
+    return ExportResult(rows, written, chunks - 1)
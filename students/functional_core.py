@@ -1,67 +1,132 @@
+import math
 from functools import reduce  
 
+from .persistent import PersistentSortedMap
+from .pipeline import ADD_STUDENT, ADD_SUBJECT, REMOVE_STUDENT, UPDATE_GRADE, Pipeline, pipeline
+from .roster import AFTER_ALL, Roster, as_roster
+from .search import find
+from .shared_snapshot import SharedRoster
+
+
+# Function to parse the subjects of a student from text
+def parse_subjects(subjects_str):
+    """Parses a "math:90, science:85" string into a subjects dictionary
+    
+    Items without a colon are ignored.
+    Returns:
+        A dictionary mapping each subject to its grade as an int
+    Raises:
+        ValueError: If a grade is not a whole number
+    """
+    # Split the string into "subject:grade" items
+    subject_items = [item.strip() for item in subjects_str.split(',')]
+    subjects_dict = {}
+    
+    # Convert each item into a subject:grade pair
+    for item in subject_items:
+        if ':' in item:
+            subject, grade = item.split(':', 1)
+            subjects_dict[subject.strip()] = int(grade.strip())
+    
+    return subjects_dict
+
 
 # Function to add a new student to the students dictionary
 def add_student(students, name, subjects_grades):
     """Adds a new student with their subjects and grades
     Returns:
-        A lambda function that, when called, returns a new dictionary with the added student
+        A lambda function that, when called, returns a new state with the added student
     """
-    # Create a new dictionary with all existing students plus the new one
-    # The ** operator unpacks the existing students dictionary
-    # We then add a new key-value pair with the student name and their subjects/grades
-    return lambda: {**students(), name: subjects_grades}
+    # Pipelines record the operation instead of applying it (see pipeline.py)
+    if isinstance(students, Pipeline):
+        return students.then(ADD_STUDENT, name, subjects_grades)
+    
+    # Derive a new version of the state with the student added
+    # Only the trie nodes on the path to the new key are copied; everything
+    # else is shared with the previous version, which stays valid
+    updated = as_roster(students()).set_student(name, subjects_grades)
+    
+    # Return a lambda that gives access to the new version
+    return lambda: updated
 
 
 # Function to add a new subject to an existing student
 def add_subject(students, name, subject, grade):
     """Adds a new subject to an existing student
     Returns:
-        A lambda function that, when called, returns an updated dictionary
+        A lambda function that, when called, returns an updated state
     """
-    # Check if the student exists in the dictionary
-    if name not in students():
+    # Pipelines record the operation instead of applying it
+    if isinstance(students, Pipeline):
+        return students.then(ADD_SUBJECT, name, subject, grade)
+    
+    # Evaluate the current state once and look the student up
+    current = as_roster(students())
+    subjects = current.get(name)
+    
+    # Check if the student exists in the state
+    if subjects is None:
         # If not, return the original state unchanged
         return students
     
     # Create a new dictionary for the student's subjects by:
     # 1. Unpacking their existing subjects with **
     # 2. Adding the new subject:grade pair
-    updated_subjects = {**students()[name], subject: grade}
+    updated_subjects = {**subjects, subject: grade}
+    
+    # Derive a new version of the state sharing all other students
+    updated = current.set_student(name, updated_subjects)
     
-    # Return a lambda that creates a new dictionary with all students
-    # but with the specified student's subjects updated
-    return lambda: {**students(), name: updated_subjects}
+    # Return a lambda that gives access to the new version
+    return lambda: updated
 
 
 # Function to update a grade for an existing subject
 def update_grade(students, name, subject, new_grade):
     """Updates the grade for a specific subject
     Returns:
-        A lambda function that, when called, returns an updated dictionary
+        A lambda function that, when called, returns an updated state
     """
+    # Pipelines record the operation instead of applying it
+    if isinstance(students, Pipeline):
+        return students.then(UPDATE_GRADE, name, subject, new_grade)
+    
+    # Evaluate the current state once and look the student up
+    current = as_roster(students())
+    subjects = current.get(name)
+    
     # Check if the student exists and has the specified subject
-    if name not in students() or subject not in students()[name]:
+    if subjects is None or subject not in subjects:
         # If either condition is not met, return the original state unchanged
         return students
     
     # Create a new dictionary of subjects with the updated grade
     # This preserves immutability by not modifying the original dictionary
-    updated_subjects = {**students()[name], subject: new_grade}
+    updated_subjects = {**subjects, subject: new_grade}
+    
+    # Derive a new version of the state sharing all other students
+    updated = current.set_student(name, updated_subjects)
     
-    # Return a lambda that builds a new complete state with the update
-    return lambda: {**students(), name: updated_subjects}
+    # Return a lambda that gives access to the new version
+    return lambda: updated
 
 
 # Function to remove a student from the dictionary
 def remove_student(students, name):
     """Removes a student from the dictionary
     Returns:
-        A lambda function that, when called, returns a dictionary without the specified student
+        A lambda function that, when called, returns a state without the specified student
     """
-    # Use dictionary comprehension to create a new dictionary
-    # that includes all key-value pairs except for the specified student
-    return lambda: {k: v for k, v in students().items() if k != name}
+    # Pipelines record the operation instead of applying it
+    if isinstance(students, Pipeline):
+        return students.then(REMOVE_STUDENT, name)
+    
+    # Derive a new version of the state without the specified student
+    # Removing a missing student leaves the state unchanged
+    updated = as_roster(students()).remove_student(name)
+    
+    # Return a lambda that gives access to the new version
+    return lambda: updated
 
 
 # Function to calculate the average grade for a student
@@ -70,13 +135,25 @@ def calculate_average(students, name):
     Returns:
         A lambda function that, when called, returns the average grade as a float
     """
-    # Check if the student exists in the dictionary
-    if name not in students():
+    # Evaluate the state once
+    current = students()
+    
+    # Rosters keep running per-student statistics, so the average is
+    # available in constant time without looking at the grades
+    if isinstance(current, Roster):
+        stats = current.aggregates.students.get(name)
+        return lambda: stats.mean() if stats else 0
+    
+    # Look the student up in a plain dictionary state
+    subjects = current.get(name)
+    
+    # Check if the student exists in the state
+    if subjects is None:
         # If not, return zero as the average
         return lambda: 0
     
     # Get all grades for the student as a list
-    grades = list(students()[name].values())
+    grades = list(subjects.values())
     
     # Check if the student has any grades
     if not grades:
@@ -90,26 +167,294 @@ def calculate_average(students, name):
     return lambda: reduce(lambda acc, x: acc + x, grades, 0) / len(grades)
 
 
+# Function to evaluate a state for a query
+def _indexed(students):
+    """Evaluates a state for a query that reads the roster's indexes
+    
+    Shared snapshots carry the same indexes as a Roster, stored in their
+    file, and are read in place; other states are converted to a Roster.
+    Returns:
+        A Roster or a SharedRoster
+    """
+    current = students()
+    return current if isinstance(current, SharedRoster) else as_roster(current)
+
+
+# Function to calculate the standard deviation of a student's grades
+def calculate_stddev(students, name):
+    """Calculates the standard deviation of a student's grades
+    Returns:
+        A lambda function that, when called, returns the population
+        standard deviation as a float (0 for unknown students)
+    """
+    # Read the student's running statistics from the roster
+    stats = _indexed(students).aggregates.students.get(name)
+    
+    # Return a lambda that derives the deviation from them
+    return lambda: stats.stddev() if stats else 0
+
+
+# Function to calculate the class average for a subject
+def subject_average(students, subject):
+    """Calculates the average grade of all students in a subject
+    Returns:
+        A lambda function that, when called, returns the average as a float
+        (0 when nobody takes the subject)
+    """
+    # Read the subject's running statistics from the roster
+    stats = _indexed(students).aggregates.subjects.get(subject)
+    
+    # Return a lambda that derives the average from them
+    return lambda: stats.mean() if stats else 0
+
+
+# Function to calculate the standard deviation of a subject's grades
+def subject_stddev(students, subject):
+    """Calculates the standard deviation of all grades in a subject
+    Returns:
+        A lambda function that, when called, returns the population
+        standard deviation as a float (0 when nobody takes the subject)
+    """
+    # Read the subject's running statistics from the roster
+    stats = _indexed(students).aggregates.subjects.get(subject)
+    
+    # Return a lambda that derives the deviation from them
+    return lambda: stats.stddev() if stats else 0
+
+
+# Function to format one student as a line of text
+def format_student(name, subjects):
+    """Formats a student and their grades as "name: subject: grade, ..."
+    Returns:
+        The formatted line as a string
+    """
+    # Create a comma-separated string of "subject: grade" pairs
+    # using list comprehension and string formatting
+    subjects_str = ", ".join([f"{subject}: {grade}" for subject, grade in subjects.items()])
+    return f"{name}: {subjects_str}"
+
+
+# Function to list the students taking a subject
+def students_taking(students, subject, start=0, limit=None):
+    """Lists the students who take a subject, in name order
+    
+    Reads the subject's inverted index, so only the returned students are
+    visited: O(log N + k).
+    Returns:
+        A lambda function that, when called, returns a (total, page) tuple:
+        the number of students taking the subject and a list of at most
+        ``limit`` (name, grade) tuples from position ``start``
+    """
+    # Find the subject's name-ordered map of takers
+    takers = _indexed(students).subjects.takers.get(subject, PersistentSortedMap())
+    stop = None if limit is None else start + limit
+    page = list(takers.items_from(start, stop))
+    
+    # Return a lambda that gives the count and the page
+    return lambda: (len(takers), page)
+
+
+# Function to find the students whose grade in a subject is within a range
+def students_in_grade_range(students, subject, low=None, high=None, start=0, limit=None):
+    """Lists the students whose grade in a subject is between two bounds
+    
+    Both bounds are inclusive and optional. Results are ordered by grade,
+    then name, and located with the subject's sorted grade index in
+    O(log N + k).
+    Returns:
+        A lambda function that, when called, returns a (total, page) tuple:
+        the number of matching students and a list of at most ``limit``
+        (name, grade) tuples from position ``start``
+    """
+    # Find the subject's (grade, name)-ordered index
+    by_grade = _indexed(students).subjects.by_grade.get(subject, PersistentSortedMap())
+    
+    # Turn the grade bounds into positions in the index
+    # (grade,) sorts before every (grade, name) and (grade, AFTER_ALL) after
+    first = by_grade.rank((low,)) if low is not None else 0
+    end = by_grade.rank_right((high, AFTER_ALL)) if high is not None else len(by_grade)
+    total = max(end - first, 0)
+    stop = end if limit is None else min(end, first + start + limit)
+    page = [(name, grade) for (grade, name), _ in by_grade.items_from(first + start, stop)]
+    
+    # Return a lambda that gives the count and the page
+    return lambda: (total, page)
+
+
+# Function to find the ranking of the students by average or by a subject
+def _ranking(students, subject=None):
+    """Returns the (roster, ranking) of the overall or a subject's ranking"""
+    roster = _indexed(students)
+    ranks = roster.ranks
+    return roster, ranks.overall if subject is None else ranks.subjects.get(subject, PersistentSortedMap())
+
+
+# Function to find a student's rank
+def rank_of(students, name, subject=None):
+    """Finds a student's rank by average grade, or by grade in a subject
+    
+    Students with the same score share a rank (1, 2, 2, 4...). The rank is
+    read from the ranking index in O(log N).
+    Returns:
+        A lambda function that, when called, returns the rank (1 for the
+        best), or None when the student is not ranked (unknown, without
+        grades, or not taking the subject)
+    """
+    roster, ranking = _ranking(students, subject)
+    subjects = roster.get(name)
+    
+    # Find the student's score: their average, or their grade in the subject
+    if not subjects or (subject is not None and subject not in subjects):
+        return lambda: None
+    score = roster.aggregates.students[name].mean() if subject is None else subjects[subject]
+    
+    # (-score,) sorts before every (-score, name) key: count the better scores
+    rank = ranking.rank((-score,)) + 1
+    
+    # Return a lambda that gives the rank
+    return lambda: rank
+
+
+# Function to list the best students
+def top_k(students, k, subject=None):
+    """Lists the k best students by average grade, or by grade in a subject
+    
+    Reads the first k entries of the ranking index: O(log N + k).
+    Returns:
+        A lambda function that, when called, returns a list of at most k
+        (name, score) tuples, best first and ties in name order
+    """
+    _, ranking = _ranking(students, subject)
+    top = [(name, -score) for (score, name), _ in ranking.items_from(0, max(k, 0))]
+    
+    # Return a lambda that gives the list
+    return lambda: top
+
+
+# Function to find the score at a percentile
+def percentile(students, p, subject=None):
+    """Finds the average grade (or grade in a subject) at a percentile
+    
+    Uses the nearest-rank definition: the smallest score such that at least
+    p percent of the ranked students score at most that. The student at
+    that position is selected from the ranking index in O(log N).
+    Returns:
+        A lambda function that, when called, returns a (name, score) tuple,
+        or None when nobody is ranked
+    """
+    _, ranking = _ranking(students, subject)
+    count = len(ranking)
+    if not count:
+        return lambda: None
+    
+    # Position in ascending order, then in the best-first ranking
+    position = max(math.ceil(min(max(p, 0), 100) * count / 100), 1) - 1
+    (score, name), _ = ranking.select(count - 1 - position)
+    
+    # Return a lambda that gives the student and score
+    return lambda: (name, -score)
+
+
+# Function to find students from the start of their name
+def search_students(students, query, limit=10, max_distance=None):
+    """Finds the students whose name starts with a query, tolerating typos
+    
+    Case is ignored. Names are read from the roster's search index, so the
+    cost depends on the query and the matches, not on the roster size.
+    Returns:
+        A lambda function that, when called, returns a list of at most
+        ``limit`` (name, distance) tuples, where distance counts the typos
+        (see ``search.find``)
+    """
+    matches = find(_indexed(students).search.names, query, limit, max_distance)
+    
+    # Return a lambda that gives the matches
+    return lambda: matches
+
+
+# Function to find subjects from the start of their name
+def search_subjects(students, query, limit=10, max_distance=None):
+    """Finds the subjects whose name starts with a query, tolerating typos
+    Returns:
+        A lambda function that, when called, returns a list of at most
+        ``limit`` (subject, distance) tuples
+    """
+    matches = find(_indexed(students).search.subjects, query, limit, max_distance)
+    
+    # Return a lambda that gives the matches
+    return lambda: matches
+
+
+# Function to locate where a page of students starts
+def page_start(students, offset=0, after=None):
+    """Computes the position of the first student of a page
+    
+    Students are ordered by name. A page can start at a plain offset, or
+    right after the last name of the previous page (a cursor), in which
+    case the offset is counted from there.
+    Returns:
+        A lambda function that, when called, returns the position as an int
+    """
+    # Count the names up to and including the cursor in O(log N)
+    names = _indexed(students).names
+    start = names.rank_right(after) if after is not None else 0
+    
+    # Return a lambda that gives the final position
+    return lambda: start + max(offset, 0)
+
+
+# Function to find the name of the student at a position
+def student_at(students, position):
+    """Finds the name at a position of the name-ordered roster
+    
+    The name of the last student of a page is the cursor for the next one.
+    Returns:
+        A lambda function that, when called, returns the name, or None if
+        the position is out of range
+    """
+    # Look the position up in the sorted name index in O(log N)
+    names = _indexed(students).names
+    name = names.select(position)[0] if 0 <= position < len(names) else None
+    
+    # Return a lambda that gives the name
+    return lambda: name
+
+
+# Function to generate the formatted lines of a page of students lazily
+def iter_students(students, start=0, limit=None):
+    """Yields formatted lines for the students of a page, in name order
+    Returns:
+        A lambda function that, when called, returns a generator of lines
+        for at most ``limit`` students from position ``start``
+    """
+    # Evaluate the state once
+    current = students()
+    stop = None if limit is None else start + limit
+    
+    # Shared snapshots are stored in name order and read in place
+    if isinstance(current, SharedRoster):
+        return lambda: (format_student(name, subjects) for name, subjects in current.items_from(start, stop))
+    current = as_roster(current)
+    
+    # Only the names of the page are visited, each one looked up as it is
+    # produced, so the cost is O(log N + page size) for any page
+    return lambda: (
+        format_student(name, current[name])
+        for name, _ in current.names.items_from(start, stop)
+    )
+
+
 # Function to generate a formatted string listing all students and their grades
 def list_students(students):
     """Returns a formatted string with all students and their grades
     Returns:
         A lambda function that, when called, returns a formatted string
     """
-    # Initialize an empty list to store the formatted strings
-    result = []
-    
-    # Iterate through each student and their subjects
-    for name, subjects in students().items():
-        # Create a comma-separated string of "subject: grade" pairs
-        # using list comprehension and string formatting
-        subjects_str = ", ".join([f"{subject}: {grade}" for subject, grade in subjects.items()])
-        
-        # Add a formatted line for this student to the results list
-        result.append(f"{name}: {subjects_str}")
+    # Get a generator of formatted lines for every student
+    lines = iter_students(students)
     
     # Return a lambda that joins all the lines with newlines when called
-    return lambda: "\n".join(result)
+    return lambda: "\n".join(lines())
 
 
 # Function to provide an initial empty state
@@ -117,8 +462,8 @@ def initial_state():
     """Creates an initial empty state for the application
     
     Returns:
-        A lambda function that returns an empty dictionary
+        A lambda function that returns an empty Roster
     """
-    # Return a lambda that gives an empty dictionary
+    # Return a lambda that gives an empty roster
     # This serves as the starting point for the application
-    return lambda: {}
\ No newline at end of file
+    return lambda: Roster()
\ No newline at end of file
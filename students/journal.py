@@ -0,0 +1,399 @@
+import gc
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from . import metrics
+from .persistent import MISSING
+from .roster import Roster
+from .serializers import (
+    BinaryRosterSerializer, _read_varint, _unzigzag, _write_varint, _zigzag, load_serializer, serializer_path,
+)
+
+
+# Entry types of the journal, one per kind of change of the functional core:
+# a whole student (add_student), one grade (add_subject, update_grade) and a
+# removal (remove_student)
+PUT_STUDENT = 1
+SET_GRADE = 2
+REMOVE_STUDENT = 3
+
+# Each commit is one frame: payload length and CRC-32, then the payload (the
+# new version followed by its entries)
+_FRAME = struct.Struct('<II')
+
+# Snapshot header: magic, version of the roster, CRC-32 of the rest of the
+# file and length of the serializer tag. The tag, the dotted path of the
+# serializer that wrote the body, follows, so a snapshot stays readable after
+# STUDENT_STATE_SERIALIZER changes
+_SNAPSHOT_MAGIC = b'STJ3'
+_SNAPSHOT_HEADER = struct.Struct('<4sQIH')
+
+
+def _write_int(out, value):
+    # Zigzag encoding keeps small negative grades small too
+    _write_varint(out, _zigzag(value))
+
+
+def _read_int(data, pos):
+    value, pos = _read_varint(data, pos)
+    return _unzigzag(value), pos
+
+
+def _write_str(out, text):
+    encoded = text.encode()
+    _write_varint(out, len(encoded))
+    out += encoded
+
+
+def _read_str(data, pos):
+    length, pos = _read_varint(data, pos)
+    return data[pos:pos + length].decode(), pos + length
+
+
+def encode_changes(version, changes):
+    """Encodes the changes of one commit as a journal payload
+
+    A changed student is logged as the grades that differ, unless subjects
+    were dropped, in which case the student is logged whole.
+
+    Args:
+        version: The version the commit creates
+        changes: (name, old_subjects, new_subjects) tuples as produced by
+            ``Roster.diff``, with MISSING for an absent side
+
+    Returns:
+        The payload as bytes
+    """
+    out = bytearray()
+    _write_varint(out, version)
+    for name, old, new in changes:
+        if new is MISSING:
+            out.append(REMOVE_STUDENT)
+            _write_str(out, name)
+        elif old is MISSING or old.keys() - new.keys():
+            out.append(PUT_STUDENT)
+            _write_str(out, name)
+            _write_varint(out, len(new))
+            for subject, grade in new.items():
+                _write_str(out, subject)
+                _write_int(out, grade)
+        else:
+            for subject, grade in new.items():
+                if old.get(subject, MISSING) != grade:
+                    out.append(SET_GRADE)
+                    _write_str(out, name)
+                    _write_str(out, subject)
+                    _write_int(out, grade)
+    return bytes(out)
+
+
+def apply_payload(students, payload):
+    """Applies a journal payload to a {name: {subject: grade}} dictionary in place
+
+    Returns:
+        The version the payload created
+    """
+    version, pos = _read_varint(payload, 0)
+    end = len(payload)
+    while pos < end:
+        kind = payload[pos]
+        name, pos = _read_str(payload, pos + 1)
+        if kind == PUT_STUDENT:
+            count, pos = _read_varint(payload, pos)
+            subjects = {}
+            for _ in range(count):
+                subject, pos = _read_str(payload, pos)
+                subjects[subject], pos = _read_int(payload, pos)
+            students[name] = subjects
+        elif kind == SET_GRADE:
+            subject, pos = _read_str(payload, pos)
+            grade, pos = _read_int(payload, pos)
+            students.setdefault(name, {})[subject] = grade
+        elif kind == REMOVE_STUDENT:
+            students.pop(name, None)
+        else:
+            raise ValueError(f'unknown journal entry type {kind}')
+    return version
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JournalClosed(Exception):
+    """Raised by a commit to a journal that was closed"""
+
+
+def journal_exists(directory, key):
+    """Whether a roster has a journal (a log or a snapshot) in a directory"""
+    return any(os.path.exists(path) for path in _paths(directory, key))
+
+
+def _paths(directory, key):
+    """Returns the (log, snapshot) paths of a roster's journal"""
+    return os.path.join(directory, f'{key}.log'), os.path.join(directory, f'{key}.snapshot')
+
+
+class Journal:
+    """The durable history of one roster: a snapshot plus an append-only log
+
+    Every commit appends one checksummed frame with the changes to the log
+    and only returns once it is on disk. Commits arriving while the log is
+    being synced are written meanwhile and made durable together by the
+    next sync (group commit), so concurrent writers share fsync calls.
+
+    Once the log grows larger than the last snapshot, the current state is
+    written as a new snapshot and the log starts over, which keeps both the
+    disk usage and the recovery time proportional to the roster.
+
+    Recovery maps the snapshot and the log into memory, replays the frames
+    newer than the snapshot into a plain dictionary, and builds the roster
+    once. A torn frame at the end of the log (a crash during a write) fails
+    its checksum and is cut off.
+    """
+
+    # Smallest log size that triggers a snapshot
+    SNAPSHOT_MIN_BYTES = 1 << 20
+
+    def __init__(self, directory, key, fsync=True, serializer=None):
+        """Opens the journal of a roster, recovering its state
+
+        Args:
+            directory: Directory holding the journal files
+            key: The roster key
+            fsync: Whether commits wait for the data to reach the disk
+            serializer: Encoder of snapshots, a BinaryRosterSerializer by default
+        """
+        self.key = key
+        self.serializer = serializer or BinaryRosterSerializer()
+        self.directory = str(directory)
+        self.log_path, self.snapshot_path = _paths(self.directory, key)
+        self.fsync = fsync
+
+        # Current (version, state), replaced by each commit
+        self.version, self.state, self.snapshot_bytes = self._recover()
+
+        self._fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.log_bytes = os.fstat(self._fd).st_size
+        # Frames appended and frames known to be on disk, and whether a
+        # thread is currently syncing the log
+        self._cond = threading.Condition()
+        self._appended = self._durable = 0
+        self._syncing = False
+        self._snapshotting = False
+        # Number of fsync calls made for commits
+        self.syncs = 0
+
+    def _read_snapshot(self):
+        """Returns (version, students, size) from the snapshot, if there is one"""
+        try:
+            with open(self.snapshot_path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size < _SNAPSHOT_HEADER.size:
+                    return 0, {}, 0
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    magic, version, crc, tag_length = _SNAPSHOT_HEADER.unpack_from(mapped, 0)
+                    with memoryview(mapped) as view:
+                        rest = view[_SNAPSHOT_HEADER.size:]
+                        try:
+                            if magic != _SNAPSHOT_MAGIC or zlib.crc32(rest) != crc or tag_length > len(rest):
+                                raise ValueError(f'corrupt snapshot {self.snapshot_path}')
+                            return version, self._decoder(bytes(rest[:tag_length])).loads(rest[tag_length:]), size
+                        finally:
+                            rest.release()
+        except FileNotFoundError:
+            return 0, {}, 0
+
+    def _decoder(self, tag):
+        """Returns the serializer that reads a snapshot written with the given tag"""
+        if tag == serializer_path(self.serializer).encode():
+            return self.serializer
+        try:
+            return load_serializer(tag.decode())
+        except (ImportError, UnicodeDecodeError) as error:
+            raise ValueError(f'unknown serializer {tag!r} in snapshot {self.snapshot_path}') from error
+
+    def _recover(self):
+        """Rebuilds the state from the snapshot and the log
+
+        Returns:
+            A (version, Roster, snapshot size) tuple
+        """
+        # Recovery creates millions of objects without reference cycles;
+        # pausing the cycle collector meanwhile saves it from repeatedly
+        # scanning the growing heap, which would take most of the time
+        paused = gc.isenabled()
+        gc.disable()
+        try:
+            return self._replay()
+        finally:
+            if paused:
+                gc.enable()
+
+    def _replay(self):
+        version, students, snapshot_bytes = self._read_snapshot()
+        try:
+            file = open(self.log_path, 'r+b')
+        except FileNotFoundError:
+            return version, Roster(students), snapshot_bytes
+
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            pos = 0
+            if size:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    while pos + _FRAME.size <= size:
+                        length, crc = _FRAME.unpack_from(mapped, pos)
+                        start, stop = pos + _FRAME.size, pos + _FRAME.size + length
+                        if stop > size:
+                            break
+                        payload = mapped[start:stop]
+                        if zlib.crc32(payload) != crc:
+                            break
+                        # Frames up to the snapshot's version are already in it
+                        if _read_varint(payload, 0)[0] > version:
+                            version = apply_payload(students, payload)
+                        pos = stop
+            if pos < size:
+                # Drop the torn tail so new frames follow the last good one
+                file.truncate(pos)
+        return version, Roster(students), snapshot_bytes
+
+    def current(self):
+        """Returns the current (version, state) of the roster"""
+        with self._cond:
+            return self.version, self.state
+
+    def commit(self, state, expected_version=None):
+        """Appends the changes from the current state to a new one
+
+        Args:
+            state: The new Roster
+            expected_version: The version the state was derived from, if any
+
+        Returns:
+            The new version once the commit is durable, or None (writing
+            nothing) if the roster is not at expected_version
+
+        Raises:
+            JournalClosed: If the journal was closed, writing nothing
+        """
+        with self._cond:
+            if self._fd is None:
+                raise JournalClosed(self.key)
+            if expected_version is not None and expected_version != self.version:
+                return None
+            payload = encode_changes(self.version + 1, self.state.diff(state))
+            frame = _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+            _write_all(self._fd, frame)
+            metrics.observe_payload('journal', len(frame))
+            self.version += 1
+            self.state = state
+            self.log_bytes += len(frame)
+            self._appended += 1
+            version = self.version
+            if self.fsync:
+                self._wait_durable(self._appended)
+            snapshot_due = (
+                not self._snapshotting
+                and self.log_bytes > max(self.SNAPSHOT_MIN_BYTES, self.snapshot_bytes)
+            )
+            if snapshot_due:
+                self._snapshotting = True
+
+        if snapshot_due:
+            try:
+                self.snapshot(version, state)
+            finally:
+                with self._cond:
+                    self._snapshotting = False
+        return version
+
+    def _wait_durable(self, frame):
+        """Waits until the given frame is on disk; called holding the lock
+
+        The first waiter syncs on behalf of everyone who appended so far;
+        the others wait for it and only sync themselves if their frame came
+        in after that sync started.
+        """
+        while self._durable < frame:
+            if self._syncing:
+                self._cond.wait()
+                continue
+            self._syncing = True
+            target = self._appended
+            self._cond.release()
+            try:
+                os.fsync(self._fd)
+            finally:
+                self._cond.acquire()
+                self._syncing = False
+            self.syncs += 1
+            self._durable = max(self._durable, target)
+            self._cond.notify_all()
+
+    def snapshot(self, version, state):
+        """Writes a snapshot of a state and empties the log
+
+        Nothing happens if commits arrived after ``version``, in which case
+        a later commit will take the snapshot instead, or if the journal was
+        closed meanwhile.
+
+        Returns:
+            Whether the snapshot was taken
+        """
+        tag = serializer_path(self.serializer).encode()
+        body = self.serializer.dumps(state)
+        metrics.observe_payload('snapshot', len(body))
+        temporary = self.snapshot_path + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, version, zlib.crc32(body, zlib.crc32(tag)), len(tag)))
+            file.write(tag)
+            file.write(body)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+
+        with self._cond:
+            if self.version != version or self._fd is None:
+                os.remove(temporary)
+                return False
+            os.replace(temporary, self.snapshot_path)
+            if self.fsync:
+                _fsync_directory(self.directory)
+            # Every frame of the log is now part of the snapshot
+            os.ftruncate(self._fd, 0)
+            self.log_bytes = 0
+            self.snapshot_bytes = len(body)
+        return True
+
+    def close(self):
+        """Closes the log, once the commits already written are durable
+
+        Later commits raise JournalClosed; the state stays readable.
+        """
+        with self._cond:
+            if self._fd is None:
+                return
+            while self._syncing:
+                self._cond.wait()
+            if self.fsync and self._durable < self._appended:
+                os.fsync(self._fd)
+                self.syncs += 1
+                self._durable = self._appended
+                self._cond.notify_all()
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from students.benchmarks.suite import (
+    Context, compare, load_baseline, peak_rss_mb, run_case, save_baseline, select_cases
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the functional core, the session manager and the home view on a generated roster, '
+        'optionally against a saved baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=10_000, help='Students in the generated roster')
+        parser.add_argument('--subjects-per-student', type=int, default=4)
+        parser.add_argument('--subjects', type=int, default=8, help='Size of the pool of subjects')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--only', nargs='+', metavar='PREFIX',
+            help='Run only the cases whose name starts with one of these (e.g. core session.get_state)',
+        )
+        parser.add_argument('--min-time', type=float, default=0.5, help='Seconds per timed round')
+        parser.add_argument('--rounds', type=int, default=3, help='Timed rounds per case (the best is kept)')
+        parser.add_argument('--baseline', help='Baseline JSON file to compare with (or to write)')
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Write the results to --baseline instead of comparing with it',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.10,
+            help='Largest accepted throughput drop against the baseline, as a fraction (default 0.10)',
+        )
+
+    def handle(self, *args, **options):
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('--save-baseline needs --baseline')
+        cases = select_cases(options['only'])
+        if not cases:
+            raise CommandError('No benchmark matches --only')
+        try:
+            context = Context(
+                options['students'], options['subjects_per_student'], options['subjects'], options['seed']
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        baseline = None
+        if options['baseline'] and not options['save_baseline']:
+            try:
+                baseline = load_baseline(options['baseline'])
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Cannot read baseline {options["baseline"]}: {exc}')
+            if baseline.get('params') != context.params:
+                self.stderr.write(self.style.WARNING(
+                    f'The baseline was measured with {baseline.get("params")}, not {context.params}'
+                ))
+
+        self.stdout.write(
+            f"{context.params['students']} students, {context.params['subjects_per_student']} of "
+            f"{context.params['subjects']} subjects each, seed {context.params['seed']}"
+        )
+        self.stdout.write(f"{'case':<32} {'ops/s':>12} {'alloc KB/op':>12} {'peak RSS MB':>12}")
+        results = self._run(cases, context, options)
+
+        if options['save_baseline']:
+            save_baseline(options['baseline'], context, results)
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {options["baseline"]}'))
+        elif baseline is not None:
+            self._compare(results, baseline, options['threshold'])
+
+    def _run(self, cases, context, options):
+        """Runs the cases, in a throwaway database when some need one"""
+        needs_db = any(case.needs_db for case in cases)
+        if needs_db:
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            results = []
+            for case in cases:
+                result = run_case(case, context, options['min_time'], options['rounds'])
+                rss = f'{result.peak_rss_mb:>12.1f}' if result.peak_rss_mb is not None else f"{'-':>12}"
+                self.stdout.write(f'{result.name:<32} {result.ops_per_sec:>12.1f} {result.alloc_kb:>12.1f} {rss}')
+                results.append(result)
+            return results
+        finally:
+            if needs_db:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+    def _compare(self, results, baseline, threshold):
+        rows, regressions = compare(results, baseline, threshold)
+        self.stdout.write(f"\n{'case':<32} {'baseline ops/s':>14} {'ops/s':>12} {'change':>8}")
+        for name, before, after, change in rows:
+            line = f'{name:<32} {before:>14.1f} {after:>12.1f} {change:>+8.1%}'
+            self.stdout.write(self.style.ERROR(line) if name in regressions else line)
+        if regressions:
+            raise CommandError(
+                f'{len(regressions)} case(s) slower than the baseline by more than {threshold:.0%}: '
+                + ', '.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS(f'No case slower than the baseline by more than {threshold:.0%}'))
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from students.bulk_import import detect_format
+from students.export import DEFAULT_CHUNK_SIZE, EXPORTS, FORMATS, export_roster
+from students.state_store import get_store
+
+
+class Command(BaseCommand):
+    help = 'Exports the student transcripts or the subject statistics of a roster as CSV or JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help='Key of the roster to export')
+        parser.add_argument('path', help='File to write')
+        parser.add_argument('--kind', choices=EXPORTS, default='transcripts', help='What to export')
+        parser.add_argument('--format', choices=FORMATS, help='Output format (guessed from the file name by default)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows formatted per task')
+        parser.add_argument(
+            '--workers', type=int, default=settings.STUDENT_EXPORT_WORKERS,
+            help='Worker processes (the number of CPUs by default)',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        fmt = options['format'] or detect_format(options['path'])
+        state = get_store().load(options['roster'])
+
+        try:
+            with open(options['path'], 'wb') as output:
+                result = export_roster(
+                    lambda: state, options['kind'], fmt, output,
+                    chunk_size=options['chunk_size'], workers=options['workers'],
+                )
+        except OSError as exc:
+            raise CommandError(f'Cannot write {options["path"]}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {result.rows} rows of {options["kind"]} of roster {options["roster"]} to {options["path"]} '
+            f'({result.bytes} bytes in {result.chunks} chunks)'
+        ))
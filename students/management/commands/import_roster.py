@@ -0,0 +1,57 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from students.bulk_import import DEFAULT_BATCH_SIZE, FORMATS, detect_format, import_rows, read_rows
+from students.session_manager import StudentSessionManager
+from students.state_store import VersionConflict, get_store
+
+
+class Command(BaseCommand):
+    help = 'Imports students from a CSV or JSON lines file into a roster of the state store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON lines file to import')
+        parser.add_argument(
+            '--roster',
+            help='Key of the roster to import into (a new roster is created when omitted)',
+        )
+        parser.add_argument('--format', choices=FORMATS, help='Input format (guessed from the file name by default)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows applied per commit')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        store = get_store()
+        key = options['roster'] or uuid.uuid4().hex
+        fmt = options['format'] or detect_format(options['path'])
+
+        # Each batch is applied to the current roster and saved with a
+        # compare-and-swap, so concurrent changes to other students are kept
+        def commit(batch):
+            for _ in range(StudentSessionManager.MAX_ATTEMPTS):
+                version, state = store.load_versioned(key)
+                new_state = batch(lambda: state)()
+                try:
+                    store.save(key, new_state, expected_version=version)
+                except VersionConflict:
+                    continue
+                return lambda: new_state
+            raise CommandError(f'Roster {key} kept changing concurrently; the batches before this one were imported')
+
+        def report(row):
+            self.stderr.write(f'line {row.line}: {row.error}')
+
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                _, result = import_rows(
+                    lambda: store.load(key), read_rows(lines, fmt), commit,
+                    batch_size=options['batch_size'], on_error=report,
+                )
+        except OSError as exc:
+            raise CommandError(f'Cannot read {options["path"]}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.imported} students into roster {key} '
+            f'in {result.batches} batches ({result.failed} rows rejected)'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from students.shared_snapshot import publish, snapshot_path
+from students.state_store import get_store
+
+
+class Command(BaseCommand):
+    help = 'Publishes a read-only snapshot of a roster, shared by every worker process through mmap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help='Key of the roster to publish')
+
+    def handle(self, *args, **options):
+        key = options['roster']
+        version, state = get_store().load_versioned(key)
+        publish(key, state, version)
+        self.stdout.write(self.style.SUCCESS(
+            f'Published version {version} of roster {key} ({len(state)} students) to {snapshot_path(key)}'
+        ))
@@ -0,0 +1,323 @@
+"""Timing and size metrics of the student app, in the Prometheus text format
+
+``MetricsMiddleware`` times every request by view and form action; the
+session manager and the views time the phases of a request (roster load,
+functional core, save, formatting, template render) with ``phase``; the
+state stores and the journal report the size of the payloads they write.
+Everything is kept in memory per process and served by the ``metrics``
+view. The middleware can also run cProfile on a sample of the requests.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from inspect import iscoroutinefunction
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+
+logger = logging.getLogger(__name__)
+
+# Form actions used as labels: those of ``batch.OPERATIONS``, listed here so
+# that loading the middleware at startup does not import the roster code
+ACTIONS = frozenset({'add_student', 'add_subject', 'update_grade', 'remove_student', 'calculate_average'})
+
+# Upper bounds of the histogram buckets, in seconds and in bytes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = tuple(1 << shift for shift in range(8, 27, 2))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Cumulative histogram of observations, one series per label values"""
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # Label values -> [count per bucket (plus one past the last), sum]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        """Records one observation
+
+        Args:
+            value: The observed value
+            *labels: One value per label name
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels):
+        """Returns the number of observations of a series"""
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Gauge:
+    """A value that goes up and down, one per label values"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+
+    def set(self, value, *labels):
+        # A single dictionary store is atomic, no lock needed
+        self._values[labels] = value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_labels(self.labels, labels)} {value}')
+        return lines
+
+    def reset(self):
+        self._values.clear()
+
+
+REQUEST_SECONDS = Histogram(
+    'student_request_seconds', 'Time spent serving a request, by view and form action', ('view', 'action')
+)
+PHASE_SECONDS = Histogram(
+    'student_phase_seconds', 'Time spent in each phase of a request', ('phase',)
+)
+PAYLOAD_BYTES = Histogram(
+    'student_payload_bytes', 'Size of the serialized payloads written, by kind', ('kind',), SIZE_BUCKETS
+)
+ROSTER_STUDENTS = Gauge('student_roster_students', 'Students in the last roster loaded')
+ROSTER_GRADES = Gauge('student_roster_grades', 'Grades in the last roster loaded, when known')
+PROFILES = Gauge('student_profiles', 'Requests profiled by this process')
+
+METRICS = (REQUEST_SECONDS, PHASE_SECONDS, PAYLOAD_BYTES, ROSTER_STUDENTS, ROSTER_GRADES, PROFILES)
+
+
+class phase:
+    """Context manager timing a phase of the current request
+
+    Example:
+        with metrics.phase('load'):
+            state = store.load(key)
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        PHASE_SECONDS.observe(time.perf_counter() - self.start, self.name)
+
+
+def observe_roster(roster):
+    """Records the size of a roster that was loaded
+
+    The number of grades is only known once the roster's aggregates were
+    built (they are not built just for the gauge).
+    """
+    ROSTER_STUDENTS.set(len(roster))
+    aggregates = getattr(roster, 'indexes', {}).get('aggregates')
+    if aggregates is not None:
+        ROSTER_GRADES.set(sum(stats.count for _, stats in aggregates.subjects.items()))
+
+
+def observe_payload(kind, size):
+    """Records the size in bytes of a payload written by a store"""
+    PAYLOAD_BYTES.observe(size, kind)
+
+
+def render_metrics(extra=()):
+    """Returns every metric in the Prometheus text format
+
+    Args:
+        extra: More lines to include, already formatted
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra)
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Clears every metric (for tests)"""
+    for metric in METRICS:
+        metric.reset()
+    global _profiles
+    _profiles = 0
+
+
+# Only one cProfile profiler can run at a time in a process
+_profile_lock = threading.Lock()
+_profiles = 0
+
+
+def _start_profile(request):
+    """Starts profiling a request if it is sampled or asks for it
+
+    A request is profiled with probability ``STUDENT_PROFILE_SAMPLE_RATE``,
+    or when it carries ``?profile=1`` and ``DEBUG`` is on. Requests that
+    arrive while another one is profiled are not.
+
+    Returns:
+        The running profiler, or None
+    """
+    rate = settings.STUDENT_PROFILE_SAMPLE_RATE
+    asked = settings.DEBUG and request.GET.get('profile') == '1'
+    if not (asked or (rate and random.random() < rate)):
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    # Imported on the first profiled request rather than at startup
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _save_profile(profiler, request, response):
+    """Saves the stats of a stopped profiler to ``STUDENT_PROFILE_DIR``
+
+    The file name is reported in the ``X-Student-Profile`` response header;
+    load it with ``python -m pstats <file>``. A profile that cannot be
+    written is logged and the response goes out without the header.
+    """
+    global _profiles
+    try:
+        directory = settings.STUDENT_PROFILE_DIR
+        number = _profiles + 1
+        name = f'{_view_name(request)}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{number}.prof'
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, name))
+    except OSError:
+        logger.exception('Could not save the profile of %s', request.path)
+        return
+    else:
+        _profiles = number
+        PROFILES.set(_profiles)
+    finally:
+        _profile_lock.release()
+    response['X-Student-Profile'] = name
+
+
+def _discard_profile(profiler):
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name if match and match.url_name else 'unknown'
+
+
+def _action(request):
+    """Returns the form action of a request, if it is one of the known ones
+
+    Only the actions of the functional core are used as labels, so clients
+    cannot create new series.
+    """
+    if request.method != 'POST' or request.content_type not in (
+        'application/x-www-form-urlencoded', 'multipart/form-data'
+    ):
+        return ''
+    action = request.POST.get('action', '')
+    return action if action in ACTIONS else ''
+
+
+class MetricsMiddleware:
+    """Middleware timing every request and optionally profiling some
+
+    Works both as a sync and as an async middleware, so it never makes an
+    async view hop to a thread. Streamed responses are timed until the view
+    returns them, before any of their content is produced, and their size
+    is not recorded. Turned off by ``STUDENT_METRICS = False``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.STUDENT_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        profiler = _start_profile(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _discard_profile(profiler)
+            raise
+        return self._finish(request, response, start, profiler)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        profiler = _start_profile(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            _discard_profile(profiler)
+            raise
+        return self._finish(request, response, start, profiler)
+
+    def _finish(self, request, response, start, profiler):
+        if profiler is not None:
+            profiler.disable()
+            _save_profile(profiler, request, response)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, _view_name(request), _action(request))
+        if not response.streaming:
+            PAYLOAD_BYTES.observe(len(response.content), 'response')
+        return response
@@ -1,3 +1,46 @@
 from django.db import models
 
-# Create your models here.
+
+class RosterVersion(models.Model):
+    """Current version of a roster kept by the database state store
+
+    Each browser session owns one roster, identified by a random key stored
+    in its session. The version is bumped on every saved change so that
+    processes can tell whether their cached copy is still current.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+
+class StudentRecord(models.Model):
+    """One student of a roster, with their subjects and grades
+
+    Students are stored one row each so that a change only rewrites the
+    rows of the students it touched.
+    """
+    roster_key = models.CharField(max_length=64, db_index=True)
+    name = models.CharField(max_length=255)
+    subjects = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['roster_key', 'name'], name='unique_student_per_roster'),
+        ]
+
+
+class RosterChange(models.Model):
+    """The changes made by one version of a roster kept by the database state store
+
+    Lists the students the version touched as [name, old subjects, new
+    subjects] entries, null standing for an absent student, so that any
+    process can tell a client what changed since a recent version. Only
+    the last ``STUDENT_CHANGE_LOG_SIZE`` versions of a roster are kept.
+    """
+    roster_key = models.CharField(max_length=64)
+    version = models.PositiveBigIntegerField()
+    changes = models.JSONField(default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['roster_key', 'version'], name='unique_change_per_version'),
+        ]
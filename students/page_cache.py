@@ -0,0 +1,131 @@
+"""Conditional GET and cached student lists for the home page
+
+Every saved change bumps the version of a roster, so a (roster key,
+version) pair identifies the students a page shows. The home view uses it
+twice:
+
+- as the validator of the page: the ETag is derived from it, and a request
+  whose ``If-None-Match`` still matches is answered with 304 without
+  loading the template or formatting any student;
+- as the key of the rendered student list in the ``STUDENT_PAGE_CACHE``
+  cache, so that a page of an unchanged roster is only formatted once.
+
+Pages carry no ``Last-Modified``: HTTP dates have a resolution of one
+second, so two versions saved within the same second would share one and
+a client holding the older page could be told it is current.
+
+Stale entries are never invalidated: a new version simply misses the cache,
+and the cache backend evicts the old entries (the local-memory backend
+evicts the least recently used ones once ``MAX_ENTRIES`` is reached).
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from . import metrics
+
+
+# Query parameters that select the page of students
+PAGE_PARAMS = ('offset', 'after', 'limit')
+
+
+def _cache():
+    return caches[settings.STUDENT_PAGE_CACHE]
+
+
+def _digest(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def _list_key(key, version, params):
+    return 'students:list:' + _digest(key, version, [params.get(name) for name in PAGE_PARAMS])
+
+
+def page_etag(request, key, version):
+    """Returns the ETag of a home page
+
+    Besides the roster version, the page depends on the query and on the
+    CSRF secret its forms carry. The ETag is weak: each rendering masks the
+    CSRF token differently, so the bytes differ but the pages are equivalent.
+    """
+    query = sorted(request.GET.lists())
+    return 'W/' + quote_etag(_digest(key, version, request.META.get('CSRF_COOKIE', ''), query))
+
+
+def can_validate(request):
+    """Whether the page of a request may be answered with 304
+
+    A page with messages to show is only valid once, so it gets no validator.
+    """
+    return not len(messages.get_messages(request))
+
+
+def render_student_list(page):
+    """Renders the student list section from the context built by ``views.home_page``"""
+    return render_to_string('students/student_list.html', page)
+
+
+def not_modified(request, key, version):
+    """Returns a 304 response if the client's copy of the page is current, else None"""
+    etag = page_etag(request, key, version)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def finish(request, response, key, version, validate):
+    """Adds the validator to a rendered page
+
+    Args:
+        request: The HTTP request object
+        response: The rendered page
+        key: The roster key
+        version: The roster version the page shows
+        validate: Whether the page may be validated (see ``can_validate``)
+    """
+    if validate:
+        # Rendering may have created the CSRF secret, so compute it now
+        response['ETag'] = page_etag(request, key, version)
+    # The page belongs to one session and must be revalidated every time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def student_list(key, version, params, page):
+    """Returns the rendered student list of a page, from the cache when possible
+
+    Args:
+        key: The roster key
+        version: The roster version
+        params: The query parameters (e.g. request.GET)
+        page: A function returning the template context of the page
+    """
+    cache = _cache()
+    cache_key = _list_key(key, version, params)
+    fragment = cache.get(cache_key)
+    if fragment is None:
+        with metrics.phase('format'):
+            fragment = render_student_list(page())
+        cache.set(cache_key, fragment, timeout=None)
+    return fragment
+
+
+# Async versions, for the async views
+
+async def astudent_list(key, version, params, page):
+    """Async version of ``student_list``"""
+    cache = _cache()
+    cache_key = _list_key(key, version, params)
+    fragment = await cache.aget(cache_key)
+    if fragment is None:
+        with metrics.phase('format'):
+            fragment = render_student_list(page())
+        await cache.aset(cache_key, fragment, timeout=None)
+    return fragment
@@ -0,0 +1,678 @@
+import random
+from collections.abc import ItemsView, Mapping
+
+
+# Number of hash bits consumed at each level of the trie (32-way branching)
+_BITS = 5
+_WIDTH = 1 << _BITS
+_MASK = _WIDTH - 1
+
+# Hashes are folded into an unsigned 64-bit integer, so after 13 levels
+# every bit has been consumed and remaining keys share a full hash
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+
+def _hash(key):
+    """Returns the key's hash folded into an unsigned 64-bit integer"""
+    return hash(key) & _HASH_MASK
+
+
+def _bitpos(h, shift):
+    """Returns the bitmap bit selected by the hash at the given level"""
+    return 1 << ((h >> shift) & _MASK)
+
+
+def _is_leaf(slot):
+    """Leaves are stored as plain (hash, key, value) tuples"""
+    return type(slot) is tuple
+
+
+class _Node:
+    """A bitmap-indexed trie node
+
+    Only the occupied children are stored: bit ``i`` of ``bitmap`` is set
+    when the child for the 5-bit hash fragment ``i`` exists, and its position
+    in ``slots`` is the number of set bits below it. Each slot is either a
+    leaf tuple or another node. Nodes are never modified after creation,
+    which is what allows different map versions to share them.
+    """
+
+    __slots__ = ('bitmap', 'slots')
+
+    def __init__(self, bitmap, slots):
+        self.bitmap = bitmap
+        self.slots = slots
+
+    def get(self, shift, h, key, default):
+        bit = _bitpos(h, shift)
+        if not self.bitmap & bit:
+            return default
+        slot = self.slots[(self.bitmap & (bit - 1)).bit_count()]
+        if _is_leaf(slot):
+            if slot[0] == h and (slot[1] is key or slot[1] == key):
+                return slot[2]
+            return default
+        return slot.get(shift + _BITS, h, key, default)
+
+    def assoc(self, shift, h, key, value):
+        """Returns (node, added) with the key bound to the value
+
+        Only the nodes on the path to the key are copied. The same node is
+        returned when the key is already bound to this exact value.
+        """
+        bit = _bitpos(h, shift)
+        idx = (self.bitmap & (bit - 1)).bit_count()
+        leaf = (h, key, value)
+
+        # Empty position: insert the leaf directly into this node
+        if not self.bitmap & bit:
+            slots = self.slots[:idx] + (leaf,) + self.slots[idx:]
+            return _Node(self.bitmap | bit, slots), True
+
+        slot = self.slots[idx]
+        if _is_leaf(slot):
+            if slot[0] == h and (slot[1] is key or slot[1] == key):
+                # Same key: replace the value unless it is unchanged
+                if slot[2] is value:
+                    return self, False
+                new_slot, added = leaf, False
+            else:
+                # Different key in the same position: push both one level down
+                new_slot, added = _merge(shift + _BITS, slot, leaf), True
+        else:
+            new_slot, added = slot.assoc(shift + _BITS, h, key, value)
+            if new_slot is slot:
+                return self, False
+
+        slots = self.slots[:idx] + (new_slot,) + self.slots[idx + 1:]
+        return _Node(self.bitmap, slots), added
+
+    def dissoc(self, shift, h, key):
+        """Returns (slot, removed) without the key
+
+        The returned slot is None when the node became empty, or a bare leaf
+        when only one entry is left, so that parents can inline it.
+        """
+        bit = _bitpos(h, shift)
+        if not self.bitmap & bit:
+            return self, False
+        idx = (self.bitmap & (bit - 1)).bit_count()
+        slot = self.slots[idx]
+
+        if _is_leaf(slot):
+            if not (slot[0] == h and (slot[1] is key or slot[1] == key)):
+                return self, False
+            new_slot = None
+        else:
+            new_slot, removed = slot.dissoc(shift + _BITS, h, key)
+            if not removed:
+                return self, False
+
+        if new_slot is None:
+            bitmap = self.bitmap & ~bit
+            if not bitmap:
+                return None, True
+            slots = self.slots[:idx] + self.slots[idx + 1:]
+            # Collapse a node holding a single leaf into that leaf
+            if len(slots) == 1 and _is_leaf(slots[0]):
+                return slots[0], True
+            return _Node(bitmap, slots), True
+
+        if len(self.slots) == 1 and _is_leaf(new_slot):
+            return new_slot, True
+        slots = self.slots[:idx] + (new_slot,) + self.slots[idx + 1:]
+        return _Node(self.bitmap, slots), True
+
+    def leaves(self):
+        for slot in self.slots:
+            if _is_leaf(slot):
+                yield slot
+            else:
+                yield from slot.leaves()
+
+
+class _CollisionNode:
+    """Holds leaves whose full 64-bit hashes are identical"""
+
+    __slots__ = ('hash', 'slots')
+
+    def __init__(self, h, slots):
+        self.hash = h
+        self.slots = slots
+
+    def _find(self, key):
+        for i, slot in enumerate(self.slots):
+            if slot[1] is key or slot[1] == key:
+                return i
+        return -1
+
+    def get(self, shift, h, key, default):
+        if h != self.hash:
+            return default
+        idx = self._find(key)
+        return default if idx < 0 else self.slots[idx][2]
+
+    def assoc(self, shift, h, key, value):
+        if h != self.hash:
+            # A different hash reached this position: nest the collision
+            # node under a regular node so both can be told apart
+            node = _Node(_bitpos(self.hash, shift), (self,))
+            return node.assoc(shift, h, key, value)
+        idx = self._find(key)
+        if idx < 0:
+            return _CollisionNode(h, self.slots + ((h, key, value),)), True
+        if self.slots[idx][2] is value:
+            return self, False
+        slots = self.slots[:idx] + ((h, key, value),) + self.slots[idx + 1:]
+        return _CollisionNode(h, slots), False
+
+    def dissoc(self, shift, h, key):
+        idx = self._find(key) if h == self.hash else -1
+        if idx < 0:
+            return self, False
+        slots = self.slots[:idx] + self.slots[idx + 1:]
+        if len(slots) == 1:
+            return slots[0], True
+        return _CollisionNode(h, slots), True
+
+    def leaves(self):
+        return iter(self.slots)
+
+
+def _merge(shift, a, b):
+    """Builds the smallest subtree holding two leaves with different keys"""
+    if a[0] == b[0] or shift >= _HASH_BITS:
+        return _CollisionNode(a[0], (a, b))
+    bit_a, bit_b = _bitpos(a[0], shift), _bitpos(b[0], shift)
+    if bit_a == bit_b:
+        # Same fragment at this level: keep descending
+        return _Node(bit_a, (_merge(shift + _BITS, a, b),))
+    slots = (a, b) if bit_a < bit_b else (b, a)
+    return _Node(bit_a | bit_b, slots)
+
+
+def _build(leaves, shift):
+    """Builds a subtree bottom-up from leaves with distinct keys
+
+    Used for bulk construction, where grouping the leaves by hash fragment
+    is much cheaper than inserting them one path copy at a time.
+    """
+    if len(leaves) == 1:
+        return leaves[0]
+    if shift >= _HASH_BITS:
+        return _CollisionNode(leaves[0][0], tuple(leaves))
+    buckets = {}
+    for leaf in leaves:
+        fragment = (leaf[0] >> shift) & _MASK
+        bucket = buckets.get(fragment)
+        if bucket is None:
+            buckets[fragment] = [leaf]
+        else:
+            bucket.append(leaf)
+    bitmap = 0
+    slots = []
+    for fragment in sorted(buckets):
+        bitmap |= 1 << fragment
+        slots.append(_build(buckets[fragment], shift + _BITS))
+    return _Node(bitmap, tuple(slots))
+
+
+def _as_root(slot):
+    """Wraps whatever a root operation produced back into a root node"""
+    if slot is None:
+        return _EMPTY_NODE
+    if isinstance(slot, _Node):
+        return slot
+    # A bare leaf or collision node: give it a parent at the first level
+    return _Node(_bitpos(slot[0] if _is_leaf(slot) else slot.hash, 0), (slot,))
+
+
+_EMPTY_NODE = _Node(0, ())
+
+# Sentinel distinguishing a missing key from a stored None
+MISSING = object()
+_MISSING = MISSING
+
+
+def _diff_slots(shift, a, b):
+    """Yields (key, old, new) for every difference between two subtrees
+
+    Identical subtrees (the same object, as shared between versions) are
+    skipped without being visited, which keeps the cost proportional to the
+    number of changes rather than the size of the maps.
+    """
+    if a is b:
+        return
+    if type(a) is _Node and type(b) is _Node:
+        bitmap = a.bitmap | b.bitmap
+        while bitmap:
+            bit = bitmap & -bitmap
+            bitmap ^= bit
+            child_a = a.slots[(a.bitmap & (bit - 1)).bit_count()] if a.bitmap & bit else None
+            child_b = b.slots[(b.bitmap & (bit - 1)).bit_count()] if b.bitmap & bit else None
+            yield from _diff_slots(shift + _BITS, child_a, child_b)
+        return
+    # Mixed shapes (leaf against subtree, collisions, missing side): compare
+    # the leaves of both sides directly, these subtrees are small
+    old = {} if a is None else {leaf[1]: leaf[2] for leaf in _slot_leaves(a)}
+    new = {} if b is None else {leaf[1]: leaf[2] for leaf in _slot_leaves(b)}
+    for key, value in old.items():
+        new_value = new.get(key, MISSING)
+        if new_value is not value:
+            yield key, value, new_value
+    for key, value in new.items():
+        if key not in old:
+            yield key, MISSING, value
+
+
+def _slot_leaves(slot):
+    return (slot,) if _is_leaf(slot) else slot.leaves()
+
+
+class PersistentMap(Mapping):
+    """An immutable mapping backed by a hash array mapped trie (HAMT)
+
+    Updates never modify the map they are called on. ``set`` and ``delete``
+    return a new map that shares every untouched subtree with the original,
+    so each update only copies the O(log N) nodes on the path to the key and
+    every older version stays valid.
+
+    It implements the read-only ``Mapping`` interface, so code written for
+    plain dictionaries (``in``, ``[]``, ``get``, ``items``...) works unchanged.
+    """
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self, mapping=None):
+        """Creates a map from an optional mapping or iterable of pairs
+
+        Args:
+            mapping: A dictionary, a mapping or an iterable of (key, value) pairs
+        """
+        if mapping is None:
+            self._root, self._size = _EMPTY_NODE, 0
+            return
+        if isinstance(mapping, PersistentMap):
+            self._root, self._size = mapping._root, mapping._size
+            return
+        # Deduplicate through a dictionary first (last value wins), then
+        # build the whole trie in a single bottom-up pass
+        items = dict(mapping)
+        if not items:
+            self._root, self._size = _EMPTY_NODE, 0
+            return
+        mask = _HASH_MASK
+        leaves = [(hash(k) & mask, k, v) for k, v in items.items()]
+        self._root = _as_root(_build(leaves, 0))
+        self._size = len(leaves)
+
+    @classmethod
+    def _from_root(cls, root, size):
+        new_map = cls.__new__(cls)
+        new_map._root = root
+        new_map._size = size
+        return new_map
+
+    def __getitem__(self, key):
+        value = self._root.get(0, _hash(key), key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        return self._root.get(0, _hash(key), key, default)
+
+    def __contains__(self, key):
+        return self._root.get(0, _hash(key), key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return (leaf[1] for leaf in self._root.leaves())
+
+    def items(self):
+        return _ItemsView(self)
+
+    def set(self, key, value):
+        """Returns a new map with the key bound to the value
+
+        Args:
+            key: The key to add or replace
+            value: The value to store
+
+        Returns:
+            A new PersistentMap (or this one if nothing changed)
+        """
+        h = _hash(key)
+        root, added = self._root.assoc(0, h, key, value)
+        if root is self._root:
+            return self
+        return PersistentMap._from_root(root, self._size + added)
+
+    def delete(self, key):
+        """Returns a new map without the key
+
+        Deleting a missing key is not an error: the same map is returned.
+
+        Args:
+            key: The key to remove
+
+        Returns:
+            A new PersistentMap (or this one if the key was absent)
+        """
+        h = _hash(key)
+        root, removed = self._root.dissoc(0, h, key)
+        if not removed:
+            return self
+        return PersistentMap._from_root(_as_root(root), self._size - 1)
+
+    def diff(self, other):
+        """Yields the entries that differ between this map and another
+
+        Subtrees shared between the two versions are skipped, so comparing a
+        map with one derived from it costs O(changes * log N). Values are
+        compared by identity, which is how updates are detected in states
+        built by the functional core.
+
+        Args:
+            other: The newer PersistentMap
+
+        Returns:
+            An iterator of (key, old_value, new_value) tuples, where a missing
+            side is reported as ``MISSING``
+        """
+        return _diff_slots(0, self._root, other._root)
+
+    def to_dict(self):
+        """Returns a plain dictionary copy of the map"""
+        return {leaf[1]: leaf[2] for leaf in self._root.leaves()}
+
+    def __repr__(self):
+        return f'PersistentMap({self.to_dict()!r})'
+
+
+class _ItemsView(ItemsView):
+    """Items view that walks the trie leaves directly"""
+
+    __slots__ = ()
+
+    def __iter__(self):
+        return ((leaf[1], leaf[2]) for leaf in self._mapping._root.leaves())
+
+
+class _TreeNode:
+    """A node of the persistent treap behind PersistentSortedMap
+
+    Keys are in binary-search-tree order and priorities in heap order. Each
+    node also records the size of its subtree, which is what allows
+    positional lookups in O(log N).
+    """
+
+    __slots__ = ('key', 'value', 'priority', 'left', 'right', 'size')
+
+    def __init__(self, key, value, priority, left, right):
+        self.key = key
+        self.value = value
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = 1 + (left.size if left else 0) + (right.size if right else 0)
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _tree_get(node, key, default):
+    while node is not None:
+        if key < node.key:
+            node = node.left
+        elif node.key < key:
+            node = node.right
+        else:
+            return node.value
+    return default
+
+
+def _tree_split(node, key):
+    """Splits a tree into the keys below and above ``key`` (absent from it)"""
+    if node is None:
+        return None, None
+    if key < node.key:
+        left, right = _tree_split(node.left, key)
+        return left, _TreeNode(node.key, node.value, node.priority, right, node.right)
+    left, right = _tree_split(node.right, key)
+    return _TreeNode(node.key, node.value, node.priority, node.left, left), right
+
+
+def _tree_join(left, right):
+    """Joins two trees where every key of ``left`` is below those of ``right``"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        return _TreeNode(left.key, left.value, left.priority, left.left, _tree_join(left.right, right))
+    return _TreeNode(right.key, right.value, right.priority, _tree_join(left, right.left), right.right)
+
+
+def _tree_set(node, key, value, priority):
+    """Returns (node, added) with the key bound to the value, copying the path"""
+    if node is None:
+        return _TreeNode(key, value, priority, None, None), True
+    if key < node.key:
+        if priority > node.priority and _tree_get(node, key, MISSING) is MISSING:
+            # The new key belongs above this node: split the subtree around it
+            left, right = _tree_split(node, key)
+            return _TreeNode(key, value, priority, left, right), True
+        child, added = _tree_set(node.left, key, value, priority)
+        return _TreeNode(node.key, node.value, node.priority, child, node.right), added
+    if node.key < key:
+        if priority > node.priority and _tree_get(node, key, MISSING) is MISSING:
+            left, right = _tree_split(node, key)
+            return _TreeNode(key, value, priority, left, right), True
+        child, added = _tree_set(node.right, key, value, priority)
+        return _TreeNode(node.key, node.value, node.priority, node.left, child), added
+    if node.value is value:
+        return node, False
+    return _TreeNode(key, value, node.priority, node.left, node.right), False
+
+
+def _tree_delete(node, key):
+    """Returns the tree without the key (the same node when it is absent)"""
+    if node is None:
+        return None
+    if key < node.key:
+        child = _tree_delete(node.left, key)
+        if child is node.left:
+            return node
+        return _TreeNode(node.key, node.value, node.priority, child, node.right)
+    if node.key < key:
+        child = _tree_delete(node.right, key)
+        if child is node.right:
+            return node
+        return _TreeNode(node.key, node.value, node.priority, node.left, child)
+    return _tree_join(node.left, node.right)
+
+
+def _tree_build(items, lo, hi):
+    """Builds a perfectly balanced tree from sorted items[lo:hi]
+
+    Nodes get their height (plus one) as priority, which keeps heap order and
+    stays above the [0, 1) priorities of keys inserted later.
+    """
+    if lo >= hi:
+        return None
+    mid = (lo + hi) // 2
+    left = _tree_build(items, lo, mid)
+    right = _tree_build(items, mid + 1, hi)
+    height = max(left.priority if left else 1, right.priority if right else 1) + 1
+    key, value = items[mid]
+    return _TreeNode(key, value, height, left, right)
+
+
+def _tree_iter(node, index=0):
+    """Yields the nodes in key order, starting at the given position"""
+    stack = []
+    # Descend to the starting node, remembering the ancestors still to come
+    while node is not None:
+        left = _size(node.left)
+        if index <= left:
+            stack.append(node)
+            if index == left:
+                break
+            node = node.left
+        else:
+            index -= left + 1
+            node = node.right
+    while stack:
+        node = stack.pop()
+        yield node
+        child = node.right
+        while child is not None:
+            stack.append(child)
+            child = child.left
+
+
+class PersistentSortedMap(Mapping):
+    """An immutable mapping kept in key order, with positional access
+
+    Backed by a persistent treap whose nodes record their subtree sizes:
+    ``set``, ``delete``, ``rank`` and ``select`` cost O(log N) and iterating
+    a range of k items from any key or position costs O(log N + k). Updates
+    return a new map sharing all untouched nodes with the original.
+    Keys must be mutually comparable.
+    """
+
+    __slots__ = ('_root',)
+
+    def __init__(self, items=None):
+        """Creates a map from an optional mapping or iterable of pairs
+
+        Args:
+            items: A mapping or an iterable of (key, value) pairs
+        """
+        if isinstance(items, PersistentSortedMap):
+            self._root = items._root
+        elif items:
+            pairs = sorted(dict(items).items())
+            self._root = _tree_build(pairs, 0, len(pairs))
+        else:
+            self._root = None
+
+    @classmethod
+    def _from_root(cls, root):
+        new_map = cls.__new__(cls)
+        new_map._root = root
+        return new_map
+
+    def __getitem__(self, key):
+        value = _tree_get(self._root, key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        return _tree_get(self._root, key, default)
+
+    def __contains__(self, key):
+        return _tree_get(self._root, key, MISSING) is not MISSING
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __iter__(self):
+        return (node.key for node in _tree_iter(self._root))
+
+    def items(self):
+        return _SortedItemsView(self)
+
+    def set(self, key, value):
+        """Returns a new map with the key bound to the value"""
+        root, _ = _tree_set(self._root, key, value, _random())
+        return self if root is self._root else PersistentSortedMap._from_root(root)
+
+    def delete(self, key):
+        """Returns a new map without the key (the same map if it is absent)"""
+        root = _tree_delete(self._root, key)
+        return self if root is self._root else PersistentSortedMap._from_root(root)
+
+    def rank(self, key):
+        """Returns the number of keys strictly below the given key"""
+        node, rank = self._root, 0
+        while node is not None:
+            if node.key < key:
+                rank += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return rank
+
+    def rank_right(self, key):
+        """Returns the number of keys below or equal to the given key"""
+        node, rank = self._root, 0
+        while node is not None:
+            if key < node.key:
+                node = node.left
+            else:
+                rank += _size(node.left) + 1
+                node = node.right
+        return rank
+
+    def select(self, index):
+        """Returns the (key, value) pair at the given position
+
+        Raises:
+            IndexError: If the position is out of range
+        """
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        node = next(_tree_iter(self._root, index))
+        return node.key, node.value
+
+    def items_from(self, index=0, stop=None):
+        """Yields (key, value) pairs in key order from position index to stop
+
+        Args:
+            index: The position of the first item
+            stop: The position after the last item, or None for the end
+        """
+        count = len(self) if stop is None else min(stop, len(self))
+        nodes = _tree_iter(self._root, max(index, 0))
+        for _ in range(max(count - max(index, 0), 0)):
+            node = next(nodes)
+            yield node.key, node.value
+
+    def items_between(self, low=None, high=None, inclusive=(True, True)):
+        """Yields (key, value) pairs with keys between low and high
+
+        Args:
+            low: The lower bound, or None for no bound
+            high: The upper bound, or None for no bound
+            inclusive: Whether each bound itself is included
+        """
+        start = 0
+        if low is not None:
+            start = self.rank(low) if inclusive[0] else self.rank_right(low)
+        stop = None
+        if high is not None:
+            stop = self.rank_right(high) if inclusive[1] else self.rank(high)
+        return self.items_from(start, stop)
+
+    def __repr__(self):
+        return f'PersistentSortedMap({dict(self.items())!r})'
+
+
+class _SortedItemsView(ItemsView):
+    """Items view that walks the tree in key order"""
+
+    __slots__ = ()
+
+    def __iter__(self):
+        return ((node.key, node.value) for node in _tree_iter(self._mapping._root))
+
+
+# Priorities of inserted nodes; their exact values only affect tree shape
+_random = random.Random().random
@@ -0,0 +1,143 @@
+from .roster import Roster, as_roster
+
+
+# Operations a pipeline can record, named after the functional core
+# functions that record them
+ADD_STUDENT = 'add_student'
+ADD_SUBJECT = 'add_subject'
+UPDATE_GRADE = 'update_grade'
+REMOVE_STUDENT = 'remove_student'
+
+# Marks a pipeline that has not been evaluated yet
+_PENDING = object()
+
+
+class Pipeline:
+    """A lazy state: a state lambda plus the operations still to apply to it
+
+    A pipeline is called like any state lambda, so it can be handed to the
+    functional core and to the session manager unchanged. The mutations of
+    the functional core (``add_student``, ``add_subject``, ``update_grade``
+    and ``remove_student``) do not evaluate a pipeline: they return a new
+    one with the operation recorded. Calling a pipeline then applies all of
+    its pending operations in one pass (see ``_fuse``) and remembers the
+    result, so a chain of k operations costs one evaluation of the base
+    state, whatever the length of the chain, and no recursion.
+
+    Chains can be evaluated at any point; the next evaluation further down
+    the chain starts from the last evaluated state.
+    """
+
+    __slots__ = ('_parent', '_op', '_result')
+
+    def __init__(self, students):
+        """Starts a pipeline from a state lambda
+
+        Args:
+            students: A lambda function returning the initial state
+        """
+        # The base state lambda for the first pipeline of a chain, the
+        # previous pipeline for the others
+        self._parent = students
+        # The recorded (kind, name, *arguments) operation, None at the base
+        self._op = None
+        self._result = _PENDING
+
+    def then(self, kind, name, *args):
+        """Returns a new pipeline with one more pending operation
+
+        Args:
+            kind: ADD_STUDENT, ADD_SUBJECT, UPDATE_GRADE or REMOVE_STUDENT
+            name: The student's name
+            *args: The other arguments of the functional core function
+        """
+        pipeline = Pipeline.__new__(Pipeline)
+        pipeline._parent = self
+        pipeline._op = (kind, name) + args
+        pipeline._result = _PENDING
+        return pipeline
+
+    def __call__(self):
+        if self._result is _PENDING:
+            # Walk back to the last evaluated pipeline (or the base),
+            # collecting the operations recorded since
+            ops = []
+            node = self
+            while node._op is not None and node._result is _PENDING:
+                ops.append(node._op)
+                node = node._parent
+            if node._result is _PENDING:
+                node._result = as_roster(node._parent())
+                node._parent = None
+            ops.reverse()
+            self._result = _fuse(node._result, ops)
+            # The history is no longer needed once the result is known
+            self._parent = self._op = None
+        return self._result
+
+
+def _fuse(base, ops):
+    """Applies a sequence of operations to a roster in a single pass
+
+    The operations are first folded into the final subjects of each student
+    they touch, so that any number of operations on the same student become
+    one change of the roster. The changes are then applied one by one, or,
+    when they touch a large share of the roster, by building the new roster
+    in bulk.
+
+    Args:
+        base: A Roster
+        ops: A list of (kind, name, *arguments) operations
+
+    Returns:
+        A Roster (the base itself when nothing changed)
+    """
+    # Final subjects of each touched student (None for removed students),
+    # and the students whose subjects dictionary was created here and may
+    # therefore be updated in place
+    changes = {}
+    owned = set()
+    for kind, name, *args in ops:
+        if kind == ADD_STUDENT:
+            changes[name] = args[0]
+            owned.discard(name)
+            continue
+        subjects = changes[name] if name in changes else base.get(name)
+        if kind == REMOVE_STUDENT:
+            if subjects is not None:
+                changes[name] = None
+        elif subjects is not None and (kind == ADD_SUBJECT or args[0] in subjects):
+            # add_subject, or update_grade of a subject the student has
+            if name not in owned:
+                subjects = dict(subjects)
+                owned.add(name)
+            subjects[args[0]] = args[1]
+            changes[name] = subjects
+
+    if not changes:
+        return base
+
+    # Rebuilding the whole roster costs a few times less per student than
+    # updating students one at a time, so it wins for large changes
+    if len(changes) > len(base) // 4:
+        merged = base.to_dict()
+        for name, subjects in changes.items():
+            if subjects is None:
+                merged.pop(name, None)
+            else:
+                merged[name] = subjects
+        return Roster(merged)
+
+    roster = base
+    for name, subjects in changes.items():
+        roster = roster.remove_student(name) if subjects is None else roster.set_student(name, subjects)
+    return roster
+
+
+# Function to start a lazy pipeline from a state
+def pipeline(students):
+    """Wraps a state lambda so that the operations applied to it are deferred
+    Returns:
+        A Pipeline, itself a lambda returning the state once called
+    """
+    return students if isinstance(students, Pipeline) else Pipeline(students)
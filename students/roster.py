@@ -0,0 +1,488 @@
+import math
+from collections import namedtuple
+from collections.abc import Mapping
+
+from .persistent import MISSING, PersistentMap, PersistentSortedMap
+
+
+class Stats(namedtuple('Stats', ['count', 'total', 'squares'])):
+    """Running count, sum and sum of squares of a group of grades
+
+    Grades are added and removed incrementally, so the mean and standard
+    deviation of any group can be read in constant time.
+    """
+
+    __slots__ = ()
+
+    def add(self, grade):
+        return Stats(self.count + 1, self.total + grade, self.squares + grade * grade)
+
+    def remove(self, grade):
+        return Stats(self.count - 1, self.total - grade, self.squares - grade * grade)
+
+    def mean(self):
+        """Returns the average grade, 0 for an empty group"""
+        return self.total / self.count if self.count else 0
+
+    def stddev(self):
+        """Returns the population standard deviation, 0 for an empty group"""
+        if not self.count:
+            return 0
+        # n * sum(x^2) - sum(x)^2 is exact for integer grades
+        variance = (self.count * self.squares - self.total * self.total) / (self.count * self.count)
+        return math.sqrt(max(variance, 0))
+
+
+EMPTY_STATS = Stats(0, 0, 0)
+
+
+def _stats_of(subjects):
+    """Computes the stats of one student's grades from scratch"""
+    stats = EMPTY_STATS
+    for grade in subjects.values():
+        stats = stats.add(grade)
+    return stats
+
+
+class GradeAggregates:
+    """Grade statistics per student and per subject
+
+    Rebuilding them costs a full pass over the roster, but every mutation of
+    a Roster only adjusts the stats of the student and subjects it touched.
+    """
+
+    name = 'aggregates'
+
+    __slots__ = ('students', 'subjects')
+
+    def __init__(self, students, subjects):
+        # PersistentMaps of name -> Stats and subject -> Stats
+        self.students = students
+        self.subjects = subjects
+
+    @classmethod
+    def build(cls, students):
+        """Builds the aggregates of a whole roster
+
+        Args:
+            students: A mapping of names to {subject: grade} dictionaries
+
+        Returns:
+            A new GradeAggregates
+        """
+        per_student = {}
+        per_subject = {}
+        for name, subjects in students.items():
+            per_student[name] = _stats_of(subjects)
+            for subject, grade in subjects.items():
+                per_subject[subject] = per_subject.get(subject, EMPTY_STATS).add(grade)
+        return cls(PersistentMap(per_student), PersistentMap(per_subject))
+
+    def update(self, name, old_subjects, new_subjects):
+        """Returns the aggregates after a student's subjects changed
+
+        Args:
+            name: The student's name
+            old_subjects: The previous subjects, or None for a new student
+            new_subjects: The new subjects, or None for a removed student
+
+        Returns:
+            A new GradeAggregates
+        """
+        # A student's own stats are recomputed from their few subjects
+        if new_subjects is None:
+            per_student = self.students.delete(name)
+        else:
+            per_student = self.students.set(name, _stats_of(new_subjects))
+        old_subjects = old_subjects or {}
+        new_subjects = new_subjects or {}
+
+        # Subject stats only change for the grades that actually differ
+        per_subject = self.subjects
+        for subject in old_subjects.keys() | new_subjects.keys():
+            old = old_subjects.get(subject, MISSING)
+            new = new_subjects.get(subject, MISSING)
+            if old is new or old == new:
+                continue
+            stats = per_subject.get(subject, EMPTY_STATS)
+            if old is not MISSING:
+                stats = stats.remove(old)
+            if new is not MISSING:
+                stats = stats.add(new)
+            per_subject = per_subject.set(subject, stats) if stats.count else per_subject.delete(subject)
+
+        return GradeAggregates(per_student, per_subject)
+
+
+class NameIndex:
+    """Student names in sorted order
+
+    Gives the roster a stable, alphabetical order that is the same in every
+    process, and lets a page of students be located by position or by the
+    last name of the previous page in O(log N).
+    """
+
+    name = 'names'
+
+    __slots__ = ('names',)
+
+    def __init__(self, names):
+        # PersistentSortedMap of name -> None
+        self.names = names
+
+    @classmethod
+    def build(cls, students):
+        return cls(PersistentSortedMap((name, None) for name in students))
+
+    def update(self, name, old_subjects, new_subjects):
+        # Only additions and removals change the set of names
+        if old_subjects is None and new_subjects is not None:
+            return NameIndex(self.names.set(name, None))
+        if new_subjects is None:
+            return NameIndex(self.names.delete(name))
+        return self
+
+
+class _AfterAll:
+    """Compares above any other value; bounds the (grade, name) keys of a grade"""
+
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return other is not self
+
+    def __le__(self, other):
+        return other is self
+
+    def __ge__(self, other):
+        return True
+
+
+AFTER_ALL = _AfterAll()
+
+
+class SubjectIndex:
+    """Per-subject indexes of the students taking each subject
+
+    ``takers`` maps each subject to a name-ordered map of name -> grade (the
+    inverted subject -> students index), and ``by_grade`` maps it to a map
+    ordered by (grade, name), so both "who takes physics" and "who scored
+    between 0 and 59 in math" are answered in O(log N + k).
+    """
+
+    name = 'subjects'
+
+    __slots__ = ('takers', 'by_grade')
+
+    def __init__(self, takers, by_grade):
+        # PersistentMaps of subject -> PersistentSortedMap
+        self.takers = takers
+        self.by_grade = by_grade
+
+    @classmethod
+    def build(cls, students):
+        takers = {}
+        for name, subjects in students.items():
+            for subject, grade in subjects.items():
+                takers.setdefault(subject, []).append((name, grade))
+        return cls(
+            PersistentMap({subject: PersistentSortedMap(pairs) for subject, pairs in takers.items()}),
+            PersistentMap({
+                subject: PersistentSortedMap(((grade, name), None) for name, grade in pairs)
+                for subject, pairs in takers.items()
+            }),
+        )
+
+    def update(self, name, old_subjects, new_subjects):
+        old_subjects = old_subjects or {}
+        new_subjects = new_subjects or {}
+        takers, by_grade = self.takers, self.by_grade
+
+        # Only the subjects whose grade changed need new entries
+        for subject in old_subjects.keys() | new_subjects.keys():
+            old = old_subjects.get(subject, MISSING)
+            new = new_subjects.get(subject, MISSING)
+            if old is new or old == new:
+                continue
+            names = takers.get(subject, _EMPTY_SORTED)
+            grades = by_grade.get(subject, _EMPTY_SORTED)
+            if old is not MISSING:
+                names = names.delete(name)
+                grades = grades.delete((old, name))
+            if new is not MISSING:
+                names = names.set(name, new)
+                grades = grades.set((new, name), None)
+            if names:
+                takers, by_grade = takers.set(subject, names), by_grade.set(subject, grades)
+            else:
+                takers, by_grade = takers.delete(subject), by_grade.delete(subject)
+        return SubjectIndex(takers, by_grade)
+
+
+_EMPTY_SORTED = PersistentSortedMap()
+
+
+class RankIndex:
+    """Students ranked by average grade, and by grade in each subject
+
+    Each ranking is an order-statistics map keyed by (-score, name), so the
+    best students come first, ties in name order, and the rank of a score,
+    the k best students and the student at any position are found in
+    O(log N). Students without grades are not ranked.
+    """
+
+    name = 'ranks'
+
+    __slots__ = ('overall', 'subjects')
+
+    def __init__(self, overall, subjects):
+        # PersistentSortedMap of (-average, name) -> None, and PersistentMap
+        # of subject -> PersistentSortedMap of (-grade, name) -> None
+        self.overall = overall
+        self.subjects = subjects
+
+    @classmethod
+    def build(cls, students):
+        overall = []
+        per_subject = {}
+        for name, subjects in students.items():
+            if subjects:
+                overall.append(((-_stats_of(subjects).mean(), name), None))
+            for subject, grade in subjects.items():
+                per_subject.setdefault(subject, []).append(((-grade, name), None))
+        return cls(
+            PersistentSortedMap(overall),
+            PersistentMap({subject: PersistentSortedMap(pairs) for subject, pairs in per_subject.items()}),
+        )
+
+    def update(self, name, old_subjects, new_subjects):
+        old_subjects = old_subjects or {}
+        new_subjects = new_subjects or {}
+
+        # A student moves in the overall ranking when their average changes
+        overall = self.overall
+        old_average = _stats_of(old_subjects).mean() if old_subjects else None
+        new_average = _stats_of(new_subjects).mean() if new_subjects else None
+        if old_average != new_average:
+            if old_average is not None:
+                overall = overall.delete((-old_average, name))
+            if new_average is not None:
+                overall = overall.set((-new_average, name), None)
+
+        # and in the ranking of each subject whose grade changed
+        subjects = self.subjects
+        for subject in old_subjects.keys() | new_subjects.keys():
+            old = old_subjects.get(subject, MISSING)
+            new = new_subjects.get(subject, MISSING)
+            if old is new or old == new:
+                continue
+            ranking = subjects.get(subject, _EMPTY_SORTED)
+            if old is not MISSING:
+                ranking = ranking.delete((-old, name))
+            if new is not MISSING:
+                ranking = ranking.set((-new, name), None)
+            subjects = subjects.set(subject, ranking) if ranking else subjects.delete(subject)
+
+        if overall is self.overall and subjects is self.subjects:
+            return self
+        return RankIndex(overall, subjects)
+
+
+class SearchIndex:
+    """Student and subject names in case-insensitive order, for search
+
+    ``names`` maps (folded name, name) -> None and ``subjects`` maps
+    (folded subject, subject) -> the number of students taking it, where
+    folded is the casefolded text. A sorted map is a trie laid out in
+    order: the names starting with a prefix form one range of positions,
+    found in O(log N), and a trie node's children are found by seeking
+    past each one (see ``search``).
+    """
+
+    name = 'search'
+
+    __slots__ = ('names', 'subjects')
+
+    def __init__(self, names, subjects):
+        # PersistentSortedMaps, see above
+        self.names = names
+        self.subjects = subjects
+
+    @classmethod
+    def build(cls, students):
+        takers = {}
+        for subjects in students.values():
+            for subject in subjects:
+                takers[subject] = takers.get(subject, 0) + 1
+        return cls(
+            PersistentSortedMap(((name.casefold(), name), None) for name in students),
+            PersistentSortedMap(((subject.casefold(), subject), count) for subject, count in takers.items()),
+        )
+
+    def update(self, name, old_subjects, new_subjects):
+        names = self.names
+        if old_subjects is None and new_subjects is not None:
+            names = names.set((name.casefold(), name), None)
+        elif new_subjects is None:
+            names = names.delete((name.casefold(), name))
+
+        # Subjects only change when a student starts or stops taking them
+        old_subjects = old_subjects or {}
+        new_subjects = new_subjects or {}
+        subjects = self.subjects
+        for subject in old_subjects.keys() ^ new_subjects.keys():
+            key = (subject.casefold(), subject)
+            count = subjects.get(key, 0) + (1 if subject in new_subjects else -1)
+            subjects = subjects.set(key, count) if count else subjects.delete(key)
+
+        if names is self.names and subjects is self.subjects:
+            return self
+        return SearchIndex(names, subjects)
+
+
+class Roster(Mapping):
+    """The immutable student state shared by the functional core
+
+    It reads like the plain ``{name: {subject: grade}}`` dictionary the app
+    has always used, but the students are held in a PersistentMap and the
+    derived indexes listed in ``INDEXES`` are kept up to date by every
+    change, so queries over them never need to scan the roster.
+
+    An index is only built the first time it is used, so that loading a
+    roster costs no more than building its map of students; from then on,
+    the rosters derived from it update it incrementally.
+    """
+
+    # Index types maintained alongside the students. Each one provides a
+    # ``name``, a ``build(students)`` classmethod and an
+    # ``update(name, old_subjects, new_subjects)`` method returning a new index.
+    INDEXES = (GradeAggregates, NameIndex, SubjectIndex, RankIndex, SearchIndex)
+
+    __slots__ = ('students', 'indexes')
+
+    def __init__(self, students=None):
+        """Creates a roster; its indexes are built when first used
+
+        Args:
+            students: An optional mapping of names to {subject: grade} dictionaries
+        """
+        self.students = PersistentMap(students)
+        # The indexes built so far, by name
+        self.indexes = {}
+
+    @classmethod
+    def _derive(cls, students, indexes):
+        roster = cls.__new__(cls)
+        roster.students = students
+        roster.indexes = indexes
+        return roster
+
+    def _index(self, index_type):
+        """Returns one of the indexes, building it on first use"""
+        index = self.indexes.get(index_type.name)
+        if index is None:
+            # Two threads may race to build it; both build the same index
+            index = self.indexes[index_type.name] = index_type.build(self.students)
+        return index
+
+    def build_indexes(self):
+        """Builds every index in ``INDEXES`` that is not built yet
+
+        Returns:
+            The roster itself
+        """
+        for index_type in self.INDEXES:
+            self._index(index_type)
+        return self
+
+    @property
+    def aggregates(self):
+        return self._index(GradeAggregates)
+
+    @property
+    def names(self):
+        return self._index(NameIndex).names
+
+    @property
+    def subjects(self):
+        return self._index(SubjectIndex)
+
+    @property
+    def ranks(self):
+        return self._index(RankIndex)
+
+    @property
+    def search(self):
+        return self._index(SearchIndex)
+
+    def __getitem__(self, name):
+        return self.students[name]
+
+    def get(self, name, default=None):
+        return self.students.get(name, default)
+
+    def __contains__(self, name):
+        return name in self.students
+
+    def __len__(self):
+        return len(self.students)
+
+    def __iter__(self):
+        return iter(self.students)
+
+    def items(self):
+        return self.students.items()
+
+    def set_student(self, name, subjects):
+        """Returns a new roster with the student's subjects replaced
+
+        Args:
+            name: The student's name
+            subjects: The student's new {subject: grade} dictionary
+
+        Returns:
+            A new Roster sharing everything else with this one
+        """
+        old = self.students.get(name)
+        indexes = {key: index.update(name, old, subjects) for key, index in self.indexes.items()}
+        return Roster._derive(self.students.set(name, subjects), indexes)
+
+    def remove_student(self, name):
+        """Returns a new roster without the student (the same one if absent)"""
+        old = self.students.get(name)
+        if old is None:
+            return self
+        indexes = {key: index.update(name, old, None) for key, index in self.indexes.items()}
+        return Roster._derive(self.students.delete(name), indexes)
+
+    def diff(self, other):
+        """Yields (name, old_subjects, new_subjects) for changed students
+
+        See ``PersistentMap.diff``; absent sides are reported as ``MISSING``.
+        """
+        return self.students.diff(other.students)
+
+    def to_dict(self):
+        """Returns a plain {name: {subject: grade}} dictionary"""
+        return self.students.to_dict()
+
+    def __repr__(self):
+        return f'Roster({self.to_dict()!r})'
+
+
+def as_roster(state):
+    """Returns the given state as a Roster
+
+    Rosters are returned unchanged; dictionaries and PersistentMaps (e.g. a
+    legacy session state) are converted.
+
+    Args:
+        state: A Roster or mapping of students
+
+    Returns:
+        A Roster
+    """
+    return state if isinstance(state, Roster) else Roster(state)
@@ -0,0 +1,123 @@
+"""Prefix and typo-tolerant search over the sorted maps of ``SearchIndex``
+
+Both searches work on a map keyed by (folded text, text), read as a trie:
+the keys under a prefix are the range of positions between the prefix and
+its successor, so a node's children are found by seeking to the first key
+past the previous child, in O(log N) each.
+
+The fuzzy search walks that trie depth first while computing the edit
+distance (optimal string alignment: insertions, deletions, substitutions
+and swaps of two adjacent characters) between the query and each prefix,
+one row of the distance matrix per node. A branch is abandoned as soon as
+every entry of its row exceeds the allowed distance, so only the few
+prefixes close to the query are visited, whatever the number of names.
+A prefix within the distance matches every name under it, like an exact
+prefix does for autocompletion.
+"""
+from .roster import AFTER_ALL
+
+
+# Largest code point; the successor of a prefix ending with it is unbounded
+_MAX_CHAR = 0x10FFFF
+
+
+def default_distance(query):
+    """Returns the typos tolerated in a query: none below 3 characters, then 1, and 2 from 6"""
+    return 0 if len(query) < 3 else 1 if len(query) < 6 else 2
+
+
+def _span(index, prefix):
+    """Returns the [start, end) positions of the keys whose folded text starts with prefix"""
+    start = index.rank((prefix,))
+    if not prefix or ord(prefix[-1]) == _MAX_CHAR:
+        return start, len(index)
+    return start, index.rank((prefix[:-1] + chr(ord(prefix[-1]) + 1),))
+
+
+def _next_row(query, row, previous, last_char, char):
+    """Returns the distances between the prefixes of the query and a trie prefix extended by char
+
+    Args:
+        query: The folded query
+        row: The distances for the trie prefix
+        previous: The distances for the trie prefix without its last
+            character, or None at the root
+        last_char: The last character of the trie prefix, or None
+        char: The added character
+    """
+    new = [row[0] + 1]
+    for i, query_char in enumerate(query, 1):
+        value = min(new[i - 1] + 1, row[i] + 1, row[i - 1] + (query_char != char))
+        # Two adjacent characters swapped count as one edit
+        if previous is not None and i > 1 and query_char == last_char and query[i - 2] == char:
+            value = min(value, previous[i - 2] + 1)
+        new.append(value)
+    return new
+
+
+def _fuzzy_spans(index, query, max_distance):
+    """Returns (distance, start, end) for every trie node within max_distance of the query"""
+    spans = []
+    stack = [('', list(range(len(query) + 1)), None, 0, len(index))]
+    while stack:
+        prefix, row, previous, start, end = stack.pop()
+        if row[-1] <= max_distance:
+            spans.append((row[-1], start, end))
+        # Going deeper can only bring a prefix closer if some entry is lower
+        if min(row) >= min(row[-1], max_distance + 1):
+            continue
+
+        # Seek from one child to the next, past the names equal to the prefix
+        position = index.rank_right((prefix, AFTER_ALL))
+        while position < end:
+            (folded, _), _ = index.select(position)
+            char = folded[len(prefix)]
+            child = prefix + char
+            child_end = _span(index, child)[1]
+            child_row = _next_row(query, row, previous, prefix[-1] if prefix else None, char)
+            if min(child_row) <= max_distance:
+                stack.append((child, child_row, row, position, child_end))
+            position = child_end
+    return spans
+
+
+def find(index, query, limit=10, max_distance=None):
+    """Finds the names starting with a query, tolerating typos
+
+    Args:
+        index: ``SearchIndex.names`` or ``SearchIndex.subjects``
+        query: The text typed so far; case is ignored
+        limit: The most names returned
+        max_distance: The edits tolerated between the query and the start
+            of a name (``default_distance`` by default)
+
+    Returns:
+        A list of at most ``limit`` (name, distance) tuples, exact prefix
+        matches (distance 0) first, then by distance and name. Names two or
+        more typos away are only returned when no closer name matched.
+    """
+    query = query.casefold()
+    if max_distance is None:
+        max_distance = default_distance(query)
+
+    # Plain prefix matches are a single range; enough of them end the search
+    start, end = _span(index, query)
+    matches = [(name, 0) for (_, name), _ in index.items_from(start, min(end, start + limit))]
+
+    # Fill up with names one typo away. The walk grows quickly with the
+    # distance, so more typos are only allowed when nothing matched at all.
+    distance = 1
+    while distance <= max_distance and (len(matches) < limit if distance == 1 else not matches):
+        # Nested spans overlap: take the names of the closest ones first
+        matches, seen = [], set()
+        for found, start, end in sorted(_fuzzy_spans(index, query, distance)):
+            for (_, name), _ in index.items_from(start, end):
+                if len(matches) == limit:
+                    break
+                if name not in seen:
+                    seen.add(name)
+                    matches.append((name, found))
+            if len(matches) == limit:
+                break
+        distance += 1
+    return matches
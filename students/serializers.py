@@ -0,0 +1,221 @@
+import json
+import zlib
+from functools import lru_cache
+from itertools import accumulate, islice
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def _write_varint(out, value):
+    """Appends an unsigned integer to a bytearray, 7 bits per byte"""
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    """Reads an unsigned integer written by _write_varint; returns (value, new position)"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _pack_column(values):
+    """Packs non-negative integers as varints
+
+    Columns whose values all fit in 7 bits (the usual case for subject ids,
+    counts and offset grades) are a single bytes() call.
+    """
+    if not values or max(values) < 0x80:
+        return bytes(values)
+    out = bytearray()
+    for value in values:
+        _write_varint(out, value)
+    return bytes(out)
+
+
+def _unpack_column(data):
+    """Unpacks a column written by _pack_column into a list of integers"""
+    if data.isascii():
+        # No byte has its continuation bit set: one value per byte
+        return list(data)
+    values = []
+    pos, end = 0, len(data)
+    while pos < end:
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def _pack_strings(strings):
+    """Packs strings as a column of lengths (in characters) and one UTF-8 blob"""
+    return _pack_column([len(text) for text in strings]), ''.join(strings).encode()
+
+
+def _unpack_strings(lengths, blob):
+    text = blob.decode()
+    ends = list(accumulate(_unpack_column(lengths)))
+    return [text[start:end] for start, end in zip([0] + ends, ends)]
+
+
+class BinaryRosterSerializer:
+    """Compact binary encoding of a {name: {subject: grade}} roster
+
+    Every name is written once and every subject once, in a string table;
+    students then refer to subjects by their index. The roster is laid out
+    in columns, all varint-packed: the number of subjects of each student,
+    the subject index of each grade, and the grades themselves, stored as
+    offsets from the lowest grade so that the usual 0-100 range takes one
+    byte per grade. The result is optionally compressed with zlib.
+
+    Column-wise layout also keeps decoding fast: columns whose values fit
+    in a byte are unpacked by a single C-level call.
+    """
+
+    MAGIC = b'SRB1'
+
+    # Flag bits of the header
+    COMPRESSED = 1
+
+    def __init__(self, compress=True, level=6):
+        """Creates a serializer
+
+        Args:
+            compress: Whether to compress the payload with zlib
+            level: The zlib compression level (1-9)
+        """
+        self.compress = compress
+        self.level = level
+
+    def dumps(self, students):
+        """Encodes a roster
+
+        Args:
+            students: A Roster, PersistentMap or dictionary of students
+
+        Returns:
+            The payload as bytes
+        """
+        names = []
+        counts = []
+        subject_ids = {}
+        subject_column = []
+        grades = []
+        for name, subjects in students.items():
+            names.append(name)
+            counts.append(len(subjects))
+            for subject, grade in subjects.items():
+                subject_id = subject_ids.get(subject)
+                if subject_id is None:
+                    subject_id = subject_ids[subject] = len(subject_ids)
+                subject_column.append(subject_id)
+                grades.append(grade)
+
+        low = min(grades, default=0)
+        sections = [
+            *_pack_strings(names),
+            *_pack_strings(list(subject_ids)),
+            _pack_column(counts),
+            _pack_column(subject_column),
+            _pack_column([grade - low for grade in grades]),
+        ]
+        body = bytearray()
+        _write_varint(body, _zigzag(low))
+        for section in sections:
+            _write_varint(body, len(section))
+            body += section
+
+        flags = 0
+        if self.compress:
+            body = zlib.compress(body, self.level)
+            flags |= self.COMPRESSED
+        return self.MAGIC + bytes([flags]) + bytes(body)
+
+    def loads(self, data):
+        """Decodes a payload written by ``dumps``
+
+        Args:
+            data: A bytes-like payload
+
+        Returns:
+            A {name: {subject: grade}} dictionary
+
+        Raises:
+            ValueError: If the payload is not in this format
+        """
+        data = memoryview(data)
+        if bytes(data[:4]) != self.MAGIC or len(data) < 5:
+            raise ValueError('not a binary roster payload')
+        flags = data[4]
+        body = zlib.decompress(data[5:]) if flags & self.COMPRESSED else bytes(data[5:])
+
+        low, pos = _read_varint(body, 0)
+        low = _unzigzag(low)
+        sections = []
+        for _ in range(7):
+            length, pos = _read_varint(body, pos)
+            sections.append(body[pos:pos + length])
+            pos += length
+        names = _unpack_strings(sections[0], sections[1])
+        subjects = _unpack_strings(sections[2], sections[3])
+        counts = _unpack_column(sections[4])
+        subject_column = map(subjects.__getitem__, _unpack_column(sections[5]))
+        grades = _unpack_column(sections[6])
+        if low:
+            grades = [grade + low for grade in grades]
+
+        # Each student takes the next ``count`` (subject, grade) pairs
+        pairs = zip(subject_column, grades)
+        students = {name: dict(islice(pairs, count)) for name, count in zip(names, counts)}
+        return students
+
+
+class JSONRosterSerializer:
+    """Encodes a roster as compact JSON, like Django's session serializer"""
+
+    def dumps(self, students):
+        return json.dumps(dict(students.items()), separators=(',', ':')).encode('latin-1')
+
+    def loads(self, data):
+        return json.loads(bytes(data).decode('latin-1'))
+
+
+def serializer_path(serializer):
+    """Returns the dotted path of a serializer's class, as accepted by load_serializer"""
+    cls = type(serializer)
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+@lru_cache(maxsize=None)
+def load_serializer(path):
+    """Returns an instance of the serializer class at a dotted path
+
+    Raises:
+        ImportError: If there is no such class
+    """
+    return import_string(path)()
+
+
+@lru_cache(maxsize=None)
+def get_serializer():
+    """Returns the serializer configured by ``settings.STUDENT_STATE_SERIALIZER``
+
+    The setting is the dotted path of a class with ``dumps(students)`` and
+    ``loads(data)`` methods, such as BinaryRosterSerializer.
+    """
+    return load_serializer(settings.STUDENT_STATE_SERIALIZER)
@@ -1,57 +1,368 @@
+import threading
+import uuid
+
+from django.conf import settings
 from django.contrib.sessions.backends.base import SessionBase
 
+from . import metrics
+from .roster import as_roster
+from .shared_snapshot import shared_roster
+from .state_store import VersionConflict, get_store
+
+
+class TransactionStats:
+    """Counters of the optimistic roster transactions of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # Transactions run, states saved, saves rejected by a
+            # compare-and-swap, and transactions given up after too many
+            self.transactions = self.commits = self.conflicts = self.failures = 0
+
+    def record(self, conflicts, committed=False, failed=False):
+        with self._lock:
+            self.transactions += 1
+            self.conflicts += conflicts
+            self.commits += committed
+            self.failures += failed
+
+    def snapshot(self):
+        """Returns the counters, plus the share of saves that hit a conflict
+        and the share of transactions that had to be retried"""
+        with self._lock:
+            attempts = self.commits + self.conflicts
+            return {
+                'transactions': self.transactions,
+                'commits': self.commits,
+                'conflicts': self.conflicts,
+                'failures': self.failures,
+                'conflict_rate': self.conflicts / attempts if attempts else 0.0,
+                'retries_per_transaction': self.conflicts / self.transactions if self.transactions else 0.0,
+            }
+
+
 class StudentSessionManager:
-    """Manages the student data in the Django session
-    
+    """Manages the student data of a Django session
+
     This class serves as a bridge between the functional programming paradigm
     and Django's session management system. It provides methods to retrieve
     and update state in a way that's compatible with our functional core.
+
+    The roster itself lives in the configured state store (see
+    ``state_store.get_store``); the session only holds the key of its roster,
+    so it is written once when the roster is created and never re-serialized
+    when grades change.
     """
-    
-    # Key used to store student data in the Django session
+
+    # Key of the roster identifier in the Django session
+    ROSTER_KEY = 'student_roster'
+
+    # Key under which older versions stored the whole roster in the session
     SESSION_KEY = 'student_data'
-    
+
+    # Most times a transaction is attempted before giving up
+    MAX_ATTEMPTS = 5
+
+    # Retry and conflict counters of the transactions
+    stats = TransactionStats()
+
+    @staticmethod
+    def get_roster_key(session):
+        """Get the key of the session's roster, creating one if needed
+
+        Sessions that still hold a roster in the old in-session format have
+        it moved to the state store the first time they are seen.
+
+        Args:
+            session: The Django session object
+
+        Returns:
+            The roster key as a string
+        """
+        key = session.get(StudentSessionManager.ROSTER_KEY)
+        if key is None:
+            # Assign a new random roster key to this session
+            key = uuid.uuid4().hex
+            session[StudentSessionManager.ROSTER_KEY] = key
+
+            # Carry over a roster stored by an older version, if any
+            legacy = session.pop(StudentSessionManager.SESSION_KEY, None)
+            if legacy:
+                get_store().save(key, as_roster(legacy))
+        return key
+
     @staticmethod
     def get_state(session):
-        """Get the current state from the session
-        
-        This method retrieves the current state from the Django session.
-        If no state exists yet, it initializes an empty dictionary.
-        
+        """Get the current state of the session's roster
+
+        This method loads the roster from the state store. A roster that
+        does not exist yet is an empty state.
+
         Args:
             session: The Django session object
-        
+
         Returns:
             A lambda function that, when called, returns the current state
         """
-        # Check if our session key exists
-        if StudentSessionManager.SESSION_KEY not in session:
-            # If not, initialize an empty dictionary
-            session[StudentSessionManager.SESSION_KEY] = {}
-        
-        # Return a lambda function that gives access to the session data
+        # Load the state once; it is immutable so the lambda can share it
+        # (the version comes with it at no extra cost)
+        return StudentSessionManager.get_versioned_state(session)[1]
+
+    @staticmethod
+    def get_versioned_state(session):
+        """Get the current state of the session's roster along with its version
+
+        The version changes with every saved change of the roster, so it
+        tells whether anything derived from the state is still current.
+
+        With ``STUDENT_SHARED_SNAPSHOTS`` on, a snapshot of the roster
+        published at its current version is returned as the state (a
+        ``SharedRoster``, read in place), and the store only reads the
+        version.
+
+        Args:
+            session: The Django session object
+
+        Returns:
+            A (version, state) tuple, where state is a lambda function that,
+            when called, returns the current state
+        """
+        store = get_store()
+        key = StudentSessionManager.get_roster_key(session)
+        with metrics.phase('load'):
+            # A current shared snapshot is read in place, without loading
+            # the roster into this process
+            if settings.STUDENT_SHARED_SNAPSHOTS:
+                version = store.version(key)
+                snapshot = StudentSessionManager._current_snapshot(key, version)
+                if snapshot is not None:
+                    return version, lambda: snapshot
+            version, state = store.load_versioned(key)
+        metrics.observe_roster(state)
+
+        # Return a lambda function that gives access to the state
         # This maintains compatibility with our functional core
-        return lambda: session[StudentSessionManager.SESSION_KEY]
-    
+        return version, lambda: state
+
+    @staticmethod
+    def _current_snapshot(key, version):
+        """Returns the published snapshot of a roster if it is at version, else None
+
+        Reads fall back to the store as soon as the roster changes, until a
+        snapshot of the new version is published.
+        """
+        snapshot = shared_roster(key)
+        return snapshot if snapshot is not None and snapshot.version == version else None
+
+    @staticmethod
+    def get_changes(session, since, wait=0):
+        """Get the changes of the session's roster since one of its versions
+
+        Args:
+            session: The Django session object
+            since: The version of the roster the client already has
+            wait: Seconds to wait for a change when the roster is still at
+                ``since`` (long polling); 0 answers right away
+
+        Returns:
+            A (version, state, changes) tuple: the current version, a lambda
+            function returning the current state, and the changes as a list
+            of (name, old_subjects, new_subjects) tuples, or None when
+            ``since`` is too old (or unknown) to compute them
+        """
+        store = get_store()
+        key = StudentSessionManager.get_roster_key(session)
+        if wait:
+            store.wait_for_change(key, since, wait)
+        with metrics.phase('load'):
+            version, state, changes = store.changes_since(key, since)
+        return version, lambda: state, changes
+
     @staticmethod
     def update_session(session, new_state_func):
-        """Update the session with a new state
-        
-        This method updates the Django session with a new state produced
-        by one of our functional operations.
-        
+        """Update the session's roster with a new state
+
+        This method saves a new state produced by one of our functional
+        operations. Only the students that changed are written to the store.
+
         Args:
             session: The Django session object
             new_state_func: A lambda function that returns the new state
-        
+
         Returns:
             A lambda function that, when called, returns the updated state
         """
         # Execute the lambda function to get the new state
-        session[StudentSessionManager.SESSION_KEY] = new_state_func()
-        
-        # Mark the session as modified so Django saves it
-        session.modified = True
-        
-        # Return a lambda function that gives access to the updated session data
-        return lambda: session[StudentSessionManager.SESSION_KEY]
\ No newline at end of file
+        new_state = as_roster(new_state_func())
+
+        # Save it under the session's roster key
+        with metrics.phase('save'):
+            get_store().save(StudentSessionManager.get_roster_key(session), new_state)
+
+        # Return a lambda function that gives access to the updated state
+        return lambda: new_state
+
+    @staticmethod
+    def transact(session, operation):
+        """Applies an operation to the session's roster without losing concurrent updates
+
+        The roster is loaded with its version, the operation computes the new
+        state, and the save is a compare-and-swap against that version. If
+        another request saved the roster in the meantime, the save is
+        rejected and the operation is applied again to the fresh state, so
+        the operation must be pure (like the functional core).
+
+        Args:
+            session: The Django session object
+            operation: A function taking a state lambda and returning a
+                (new_state, result) tuple, where new_state is a lambda
+                returning the state to save, or None to save nothing
+
+        Returns:
+            A (state, result) tuple: a lambda returning the resulting state
+            and the result of the operation
+
+        Raises:
+            VersionConflict: If every attempt conflicted
+        """
+        store = get_store()
+        key = StudentSessionManager.get_roster_key(session)
+        for attempt in range(StudentSessionManager.MAX_ATTEMPTS):
+            with metrics.phase('load'):
+                version, state = store.load_versioned(key)
+            metrics.observe_roster(state)
+
+            # Evaluating the new state runs the functional core (pipelines
+            # are only applied here)
+            with metrics.phase('core'):
+                new_state, result = operation(lambda: state)
+                new_state = None if new_state is None else new_state()
+
+            # Nothing to save: the operation only read the state
+            if new_state is None or new_state is state:
+                StudentSessionManager.stats.record(attempt)
+                return lambda: state, result
+
+            new_state = as_roster(new_state)
+            try:
+                with metrics.phase('save'):
+                    store.save(key, new_state, expected_version=version)
+            except VersionConflict:
+                continue
+            StudentSessionManager.stats.record(attempt, committed=True)
+            return lambda: new_state, result
+
+        StudentSessionManager.stats.record(StudentSessionManager.MAX_ATTEMPTS, failed=True)
+        raise VersionConflict(key, version)
+
+    # Async versions of the methods above, for async views. They use the
+    # session's async API (``aget``/``aset``/``apop``) and the store's
+    # ``aload``/``asave``, so no blocking call runs on the event loop.
+
+    @staticmethod
+    async def aget_roster_key(session):
+        """Async version of ``get_roster_key``"""
+        key = await session.aget(StudentSessionManager.ROSTER_KEY)
+        if key is None:
+            key = uuid.uuid4().hex
+            await session.aset(StudentSessionManager.ROSTER_KEY, key)
+
+            legacy = await session.apop(StudentSessionManager.SESSION_KEY, None)
+            if legacy:
+                await get_store().asave(key, as_roster(legacy))
+        return key
+
+    @staticmethod
+    async def aget_state(session):
+        """Async version of ``get_state``
+
+        Returns:
+            A lambda function that, when called, returns the current state
+        """
+        return (await StudentSessionManager.aget_versioned_state(session))[1]
+
+    @staticmethod
+    async def aget_versioned_state(session):
+        """Async version of ``get_versioned_state``
+
+        Returns:
+            A (version, state) tuple
+        """
+        store = get_store()
+        key = await StudentSessionManager.aget_roster_key(session)
+        with metrics.phase('load'):
+            if settings.STUDENT_SHARED_SNAPSHOTS:
+                version = await store.aversion(key)
+                snapshot = StudentSessionManager._current_snapshot(key, version)
+                if snapshot is not None:
+                    return version, lambda: snapshot
+            version, state = await store.aload_versioned(key)
+        metrics.observe_roster(state)
+        return version, lambda: state
+
+    @staticmethod
+    async def aget_changes(session, since, wait=0):
+        """Async version of ``get_changes``
+
+        Returns:
+            A (version, state, changes) tuple
+        """
+        store = get_store()
+        key = await StudentSessionManager.aget_roster_key(session)
+        if wait:
+            await store.await_change(key, since, wait)
+        with metrics.phase('load'):
+            version, state, changes = await store.achanges_since(key, since)
+        return version, lambda: state, changes
+
+    @staticmethod
+    async def aupdate_session(session, new_state_func):
+        """Async version of ``update_session``
+
+        Returns:
+            A lambda function that, when called, returns the updated state
+        """
+        new_state = as_roster(new_state_func())
+        key = await StudentSessionManager.aget_roster_key(session)
+        with metrics.phase('save'):
+            await get_store().asave(key, new_state)
+        return lambda: new_state
+
+    @staticmethod
+    async def atransact(session, operation):
+        """Async version of ``transact``
+
+        Returns:
+            A (state, result) tuple: a lambda returning the resulting state
+            and the result of the operation
+        """
+        store = get_store()
+        key = await StudentSessionManager.aget_roster_key(session)
+        for attempt in range(StudentSessionManager.MAX_ATTEMPTS):
+            with metrics.phase('load'):
+                version, state = await store.aload_versioned(key)
+            metrics.observe_roster(state)
+
+            with metrics.phase('core'):
+                new_state, result = operation(lambda: state)
+                new_state = None if new_state is None else new_state()
+
+            if new_state is None or new_state is state:
+                StudentSessionManager.stats.record(attempt)
+                return lambda: state, result
+
+            new_state = as_roster(new_state)
+            try:
+                with metrics.phase('save'):
+                    await store.asave(key, new_state, expected_version=version)
+            except VersionConflict:
+                continue
+            StudentSessionManager.stats.record(attempt, committed=True)
+            return lambda: new_state, result
+
+        StudentSessionManager.stats.record(StudentSessionManager.MAX_ATTEMPTS, failed=True)
+        raise VersionConflict(key, version)
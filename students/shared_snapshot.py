@@ -0,0 +1,525 @@
+"""Read-only roster snapshots shared by every worker process through mmap
+
+A snapshot is an immutable file laid out for lookups in place: the names
+in sorted order with a table of their offsets, so that a worker finds a
+student by binary search over the mapped file and only decodes the
+students it reads. The indexes the queries of the functional core read
+(grade statistics, subject takers and grade order, rankings, search
+order) are stored along with it as sorted arrays, so a ``SharedRoster``
+answers them in place too, in the same O(log N) as a Roster, without
+building anything per process. Every worker maps the same file, so the
+roster sits once in the OS page cache however many workers read it,
+instead of once per worker as unpickled Python objects.
+
+The writer publishes a new snapshot by writing it to a temporary file and
+renaming it over the old one, which is atomic: a reader sees either the
+old or the new snapshot, and readers that still map the old one keep
+reading it until they pick up the new one (see ``shared_roster``). With
+``STUDENT_SHARED_SNAPSHOTS`` on, ``StudentSessionManager`` serves reads
+from the published snapshot of a roster while it is at the roster's
+current version.
+
+File layout (little-endian). Students and subjects are numbered in name
+order; "student" and "subject" below are these numbers::
+
+    header     magic b'SRS2', roster version (u64), students (u32),
+               subjects (u32), students with grades (u32), then the
+               offsets (u64) of the sections below
+    names      the UTF-8 subject names, back to back
+    subjects   per subject: name offset (u64) and length (u32), students
+               (u32), sum of grades (i128), sum of squares (i256), and the
+               offsets (u64) of its takers, by-grade and ranking arrays
+    per subject
+      takers   (student u32, grade i64), in name order
+      by-grade (grade i64, student u32), by grade then name
+      ranking  (grade i64, student u32), best grade first, then by name
+    overall    (-average f64, student u32), best average first, then by name
+    search     students (u32) by casefolded name then name, and subjects
+               (u32) by casefolded subject then subject
+    padding    to a multiple of 8 bytes
+    offsets    students + 1 u64 offsets of the records, from the file start
+    records    per student, in name order: name length (u32), UTF-8 name,
+               subject count (u32), then (subject u32, grade i64) pairs
+"""
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+from pathlib import Path
+
+from django.conf import settings
+
+from .roster import EMPTY_STATS, Stats
+
+
+MAGIC = b'SRS2'
+
+_HEADER = struct.Struct('<4sQIII6Q')
+_SUBJECT = struct.Struct('<QII16s32s3Q')
+_U32 = struct.Struct('<I')
+# (subject, grade) in records and (student, grade) in takers
+_ID_GRADE = struct.Struct('<Iq')
+# (grade, student) in the by-grade and ranking arrays
+_GRADE_ID = struct.Struct('<qI')
+_AVERAGE_ID = struct.Struct('<dI')
+
+# Students and subjects are numbered with u32
+MAX_COUNT = (1 << 32) - 1
+
+
+def _pack_stats(stats):
+    """Encodes the sums of a Stats; they outgrow 64 bits long before the count does"""
+    return stats.total.to_bytes(16, 'little', signed=True), stats.squares.to_bytes(32, 'little', signed=True)
+
+
+def write_snapshot(path, roster, version=0):
+    """Writes a snapshot of a roster and atomically replaces the file at path
+
+    Args:
+        path: The snapshot file
+        roster: A Roster or mapping of names to {subject: grade} dictionaries
+        version: The version of the roster the snapshot holds
+
+    Raises:
+        ValueError: If the roster has more than MAX_COUNT students or
+            subjects, or a grade does not fit in 64 bits
+    """
+    names = sorted(roster)
+    subjects = sorted({subject for name in names for subject in roster[name]})
+    if len(names) > MAX_COUNT or len(subjects) > MAX_COUNT:
+        raise ValueError(f'a snapshot holds at most {MAX_COUNT} students and subjects')
+    subject_ids = {subject: index for index, subject in enumerate(subjects)}
+
+    # The records, and the takers, statistics and averages gathered on the way
+    records = bytearray()
+    offsets = []
+    takers = [[] for _ in subjects]
+    stats = [EMPTY_STATS] * len(subjects)
+    overall = []
+    for student, name in enumerate(names):
+        offsets.append(len(records))
+        encoded = name.encode()
+        grades = roster[name]
+        records += _U32.pack(len(encoded)) + encoded + _U32.pack(len(grades))
+        own = EMPTY_STATS
+        for subject, grade in grades.items():
+            subject = subject_ids[subject]
+            try:
+                records += _ID_GRADE.pack(subject, grade)
+            except struct.error:
+                raise ValueError(f'grade {grade!r} of {name} does not fit in 64 bits')
+            takers[subject].append((student, grade))
+            stats[subject] = stats[subject].add(grade)
+            own = own.add(grade)
+        if own.count:
+            # The same average as Stats.mean(), so ranks agree with a Roster
+            overall.append((-own.mean(), student))
+    offsets.append(len(records))
+    overall.sort()
+
+    data = bytearray(_HEADER.size)
+
+    def place(section):
+        start = len(data)
+        data.extend(section)
+        return start
+
+    # Subject names, then the arrays of each subject and the subject table
+    names_at = len(data)
+    name_spans = []
+    for subject in subjects:
+        encoded = subject.encode()
+        name_spans.append((len(data), len(encoded)))
+        data += encoded
+    arrays = []
+    for graded in takers:
+        arrays.append((
+            place(b''.join(_ID_GRADE.pack(student, grade) for student, grade in graded)),
+            place(b''.join(_GRADE_ID.pack(grade, student) for student, grade in sorted(graded, key=_by_grade))),
+            place(b''.join(_GRADE_ID.pack(grade, student) for student, grade in sorted(graded, key=_by_rank))),
+        ))
+    table_at = place(b''.join(
+        _SUBJECT.pack(offset, length, stats[subject].count, *_pack_stats(stats[subject]), *arrays[subject])
+        for subject, (offset, length) in enumerate(name_spans)
+    ))
+    overall_at = place(b''.join(_AVERAGE_ID.pack(average, student) for average, student in overall))
+    search_names_at = place(b''.join(
+        _U32.pack(student) for student in sorted(range(len(names)), key=lambda i: (names[i].casefold(), names[i]))
+    ))
+    search_subjects_at = place(b''.join(
+        _U32.pack(subject) for subject in sorted(range(len(subjects)), key=lambda i: (subjects[i].casefold(), subjects[i]))
+    ))
+
+    data += bytes(-len(data) % 8)
+    offsets_at = len(data)
+    base = offsets_at + 8 * len(offsets)
+    data += struct.pack(f'<{len(offsets)}Q', *(base + offset for offset in offsets))
+    _HEADER.pack_into(
+        data, 0, MAGIC, version, len(names), len(subjects), len(overall),
+        names_at, table_at, offsets_at, overall_at, search_names_at, search_subjects_at,
+    )
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}')
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(data)
+            file.write(records)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+
+
+def _by_grade(taker):
+    return taker[1], taker[0]
+
+
+def _by_rank(taker):
+    return -taker[1], taker[0]
+
+
+class _Keys:
+    """The keys of a _SortedView as a sequence, for bisect"""
+
+    __slots__ = ('_length', '_key_at')
+
+    def __init__(self, length, key_at):
+        self._length = length
+        self._key_at = key_at
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        return self._key_at(index)
+
+
+class _SortedView:
+    """A sorted array of a snapshot, read in place
+
+    Offers the reads of PersistentSortedMap that the queries use, with the
+    same keys and values as the matching Roster index. Positions are found
+    by binary search, decoding O(log N) keys.
+    """
+
+    __slots__ = ('_keys', '_key_at', '_value_at')
+
+    def __init__(self, length, key_at, value_at=None):
+        self._keys = _Keys(length, key_at)
+        self._key_at = key_at
+        self._value_at = value_at
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rank(self, key):
+        """Returns the number of keys strictly below the given key"""
+        return bisect_left(self._keys, key)
+
+    def rank_right(self, key):
+        """Returns the number of keys below or equal to the given key"""
+        return bisect_right(self._keys, key)
+
+    def select(self, index):
+        """Returns the (key, value) pair at the given position
+
+        Raises:
+            IndexError: If the position is out of range
+        """
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._key_at(index), self._value_at(index) if self._value_at else None
+
+    def items_from(self, index=0, stop=None):
+        """Yields (key, value) pairs in key order from position index to stop"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for position in range(max(index, 0), stop):
+            yield self._key_at(position), self._value_at(position) if self._value_at else None
+
+    def items(self):
+        return self.items_from()
+
+
+class _Lookup(Mapping):
+    """A read-only mapping computed from a snapshot on each lookup"""
+
+    def __init__(self, keys, find):
+        # keys: a function returning the keys; find: key -> value or None
+        self._keys = keys
+        self._find = find
+
+    def __getitem__(self, key):
+        value = self._find(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+
+class _Index:
+    """A group of lookups, standing for one of the indexes of a Roster"""
+
+    def __init__(self, **lookups):
+        self.__dict__.update(lookups)
+
+
+class SharedRoster(Mapping):
+    """A roster read in place from a mapped snapshot file
+
+    It reads like the plain ``{name: {subject: grade}}`` dictionary the
+    functional core accepts, iterating in name order, but only decodes the
+    students that are looked up. Its ``aggregates``, ``names``,
+    ``subjects``, ``ranks`` and ``search`` attributes answer the same reads
+    as the indexes of a Roster, from the arrays stored in the file. It is
+    immutable: a newer snapshot is a new SharedRoster.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            # The mapping stays valid after the file is replaced or closed
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Identifies the file, to notice when a new snapshot replaced it
+        self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+        (
+            magic, self.version, self._count, subjects, ranked,
+            _, self._table_at, offsets_at, overall_at, search_names_at, search_subjects_at,
+        ) = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a roster snapshot')
+        # A view of the offsets table, read without copying it
+        self._offsets = memoryview(self._map)[offsets_at:offsets_at + 8 * (self._count + 1)].cast('Q')
+
+        # The subject names are few; decode them once
+        self._subjects = []
+        for subject in range(subjects):
+            offset, length = _SUBJECT.unpack_from(self._map, self._table_at + subject * _SUBJECT.size)[:2]
+            self._subjects.append(self._map[offset:offset + length].decode())
+        self._subject_ids = {subject: index for index, subject in enumerate(self._subjects)}
+
+        self._ranked = ranked
+        self._overall_at = overall_at
+        self._search_names_at = search_names_at
+        self._search_subjects_at = search_subjects_at
+
+    # The indexes, built on access so that they do not keep the roster alive
+
+    @property
+    def names(self):
+        return _SortedView(self._count, self._name_at)
+
+    @property
+    def aggregates(self):
+        return _Index(
+            students=_Lookup(lambda: self, self._student_stats),
+            subjects=_Lookup(lambda: self._subjects, self._subject_stats),
+        )
+
+    @property
+    def subjects(self):
+        return _Index(
+            takers=_Lookup(lambda: self._subjects, lambda subject: self._subject_array(subject, 0)),
+            by_grade=_Lookup(lambda: self._subjects, lambda subject: self._subject_array(subject, 1)),
+        )
+
+    @property
+    def ranks(self):
+        return _Index(
+            overall=_SortedView(self._ranked, self._average_at),
+            subjects=_Lookup(lambda: self._subjects, lambda subject: self._subject_array(subject, 2)),
+        )
+
+    @property
+    def search(self):
+        names_at, subjects_at = self._search_names_at, self._search_subjects_at
+        return _Index(
+            names=_SortedView(self._count, lambda i: self._folded(self._name_at(self._u32(names_at, i)))),
+            subjects=_SortedView(
+                len(self._subjects),
+                lambda i: self._folded(self._subjects[self._u32(subjects_at, i)]),
+                lambda i: self._subject_entry(self._u32(subjects_at, i))[2],
+            ),
+        )
+
+    # Decoding of the file
+
+    def _u32(self, at, index):
+        return _U32.unpack_from(self._map, at + 4 * index)[0]
+
+    def _name_bytes(self, index):
+        offset = self._offsets[index]
+        (length,) = _U32.unpack_from(self._map, offset)
+        return self._map[offset + 4:offset + 4 + length]
+
+    def _name_at(self, index):
+        return self._name_bytes(index).decode()
+
+    @staticmethod
+    def _folded(text):
+        return text.casefold(), text
+
+    def _average_at(self, index):
+        average, student = _AVERAGE_ID.unpack_from(self._map, self._overall_at + index * _AVERAGE_ID.size)
+        return average, self._name_at(student)
+
+    def _subject_entry(self, subject):
+        return _SUBJECT.unpack_from(self._map, self._table_at + subject * _SUBJECT.size)
+
+    def _subject_stats(self, subject):
+        index = self._subject_ids.get(subject)
+        if index is None:
+            return None
+        _, _, count, total, squares, *_ = self._subject_entry(index)
+        return Stats(count, int.from_bytes(total, 'little', signed=True), int.from_bytes(squares, 'little', signed=True))
+
+    def _subject_array(self, subject, which):
+        """Returns the takers (0), by-grade (1) or ranking (2) view of a subject, or None"""
+        index = self._subject_ids.get(subject)
+        if index is None:
+            return None
+        entry = self._subject_entry(index)
+        count, at = entry[2], entry[5 + which]
+        if which == 0:
+            return _SortedView(
+                count,
+                lambda i: self._name_at(_ID_GRADE.unpack_from(self._map, at + i * _ID_GRADE.size)[0]),
+                lambda i: _ID_GRADE.unpack_from(self._map, at + i * _ID_GRADE.size)[1],
+            )
+        sign = 1 if which == 1 else -1
+
+        def key_at(i):
+            grade, student = _GRADE_ID.unpack_from(self._map, at + i * _GRADE_ID.size)
+            return sign * grade, self._name_at(student)
+        return _SortedView(count, key_at)
+
+    def _find(self, name):
+        """Returns the position of a name by binary search, or -1"""
+        # UTF-8 bytes sort like the code points of the names
+        key = name.encode()
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self._count and self._name_bytes(low) == key else -1
+
+    def _grades_at(self, index):
+        """Yields the (subject, grade) pairs of the student at a position"""
+        offset = self._offsets[index]
+        (length,) = _U32.unpack_from(self._map, offset)
+        position = offset + 4 + length
+        (count,) = _U32.unpack_from(self._map, position)
+        subjects = self._subjects
+        for subject, grade in _ID_GRADE.iter_unpack(self._map[position + 4:position + 4 + count * _ID_GRADE.size]):
+            yield subjects[subject], grade
+
+    def _subjects_at(self, index):
+        return dict(self._grades_at(index))
+
+    def _student_stats(self, name):
+        index = self._find(name)
+        if index < 0:
+            return None
+        stats = EMPTY_STATS
+        for _, grade in self._grades_at(index):
+            stats = stats.add(grade)
+        return stats
+
+    # The mapping
+
+    def __getitem__(self, name):
+        index = self._find(name)
+        if index < 0:
+            raise KeyError(name)
+        return self._subjects_at(index)
+
+    def get(self, name, default=None):
+        index = self._find(name)
+        return self._subjects_at(index) if index >= 0 else default
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self._name_at(index)
+
+    def items_from(self, start=0, stop=None):
+        """Yields (name, subjects) pairs in name order from position start to stop"""
+        stop = self._count if stop is None else min(stop, self._count)
+        for index in range(max(start, 0), stop):
+            yield self._name_at(index), self._subjects_at(index)
+
+    def items(self):
+        """Yields the (name, subjects) pairs in name order, decoding one at a time"""
+        return self.items_from()
+
+    def to_dict(self):
+        """Returns the whole roster as a plain dictionary"""
+        return dict(self.items_from())
+
+    def close(self):
+        """Unmaps the snapshot; only when no other reader holds it"""
+        self._offsets.release()
+        self._map.close()
+
+    def __repr__(self):
+        return f'<SharedRoster of {self._count} students at version {self.version}>'
+
+
+def snapshot_path(key):
+    """Returns the path of the snapshot of a roster in STUDENT_SNAPSHOT_DIR"""
+    return Path(settings.STUDENT_SNAPSHOT_DIR) / f'{key}.snapshot'
+
+
+def publish(key, roster, version=0):
+    """Publishes a snapshot of a roster to every worker
+
+    Args:
+        key: The roster key
+        roster: The roster to publish
+        version: Its version in the state store
+    """
+    write_snapshot(snapshot_path(key), roster, version)
+
+
+# The snapshots mapped by this process, by path
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def shared_roster(key):
+    """Returns the latest published snapshot of a roster, or None
+
+    The file is checked on every call (one stat), and remapped when a new
+    snapshot replaced it. The previous SharedRoster stays readable by whoever
+    still holds it and is unmapped once it is no longer referenced.
+    """
+    path = snapshot_path(key)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+    with _readers_lock:
+        reader = _readers.get(path)
+        if reader is None or reader.identity != identity:
+            reader = _readers[path] = SharedRoster(path)
+    return reader
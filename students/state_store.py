@@ -0,0 +1,706 @@
+import asyncio
+import dbm
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .journal import Journal, JournalClosed, journal_exists
+from .models import RosterChange, RosterVersion, StudentRecord
+from .persistent import MISSING
+from .roster import Roster, as_roster
+from .serializers import get_serializer
+
+
+class VersionConflict(Exception):
+    """Raised when a roster changed since the version a save was based on"""
+
+    def __init__(self, key, expected, actual=None):
+        super().__init__(f'Roster {key} is not at version {expected}' + (f' but {actual}' if actual is not None else ''))
+        self.key = key
+        self.expected = expected
+        self.actual = actual
+
+
+class StateStore:
+    """Base class for the server-side stores holding student rosters
+
+    A store keeps one roster per key (the session only remembers the key) and
+    persists each student as its own record. Saving a new state only writes
+    the students that differ from the last state this process loaded or saved
+    for that key, so the cost of a write is proportional to the change rather
+    than to the size of the roster.
+
+    Every roster has a version, bumped by each save. A save may name the
+    version its state was derived from, in which case it is a compare-and-swap:
+    it fails with VersionConflict, writing nothing, if the roster moved on in
+    the meantime. This lets concurrent requests update a roster without a
+    lock and without losing each other's changes.
+
+    The store also keeps the last few versions of each roster
+    (``STUDENT_CHANGE_LOG_SIZE``), so that clients can fetch just the changes
+    since the version they have (see ``changes_since``). By default they are
+    the versions this process saw, kept in memory for the most recently
+    used rosters; DatabaseStore keeps change records in the database
+    instead, so that every process can serve them.
+
+    Subclasses implement the three storage primitives:
+    ``_read_version``, ``_read_records`` and ``_write_changes``.
+    """
+
+    # Seconds between two checks of the stored version while waiting for a
+    # change; saves made by this process wake sync waiters up immediately
+    POLL_INTERVAL = 1.0
+    ASYNC_POLL_INTERVAL = 0.5
+
+    def __init__(self):
+        # Last known (version, state) per roster key, least recently used
+        # first and at most ``STUDENT_CACHED_ROSTERS`` of them. They double
+        # as the base that new states are diffed against; a roster that was
+        # evicted is simply read again.
+        self._cache = OrderedDict()
+        self.cache_size = settings.STUDENT_CACHED_ROSTERS
+        self._lock = threading.Lock()
+        # Recent versions of each roster, an OrderedDict of version -> state
+        # per key, oldest first, for the ``cache_size`` most recently used
+        # keys. Successive versions share their structure, so they cost
+        # little memory and diffing them costs O(changes).
+        self._history = OrderedDict()
+        self.history_size = settings.STUDENT_CHANGE_LOG_SIZE
+        # Notified whenever a version is added to a history
+        self._changed = threading.Condition(self._lock)
+
+    def load(self, key):
+        """Loads the current state of a roster
+
+        The records are only read when another process changed the roster
+        since this process last saw it; otherwise the cached state is reused.
+
+        Args:
+            key: The roster key
+
+        Returns:
+            A Roster (empty for an unknown key)
+        """
+        return self.load_versioned(key)[1]
+
+    def load_versioned(self, key):
+        """Loads the current state of a roster along with its version
+
+        Args:
+            key: The roster key
+
+        Returns:
+            A (version, Roster) tuple; version 0 is an empty, unsaved roster
+        """
+        version = self._read_version(key)
+        state = self._cached(key, version)
+        if state is None:
+            state = self._remember(key, version, Roster(self._read_records(key) if version else None))
+        return version, state
+
+    def version(self, key):
+        """Returns the current version of a roster without loading it"""
+        return self._read_version(key)
+
+    async def aversion(self, key):
+        """Async version of ``version``"""
+        return await self._aread_version(key)
+
+    async def aload(self, key):
+        """Async version of ``load``, for use from async views"""
+        return (await self.aload_versioned(key))[1]
+
+    async def aload_versioned(self, key):
+        """Async version of ``load_versioned``"""
+        version = await self._aread_version(key)
+        state = self._cached(key, version)
+        if state is None:
+            records = await self._aread_records(key) if version else None
+            state = self._remember(key, version, Roster(records))
+        return version, state
+
+    def save(self, key, state, expected_version=None):
+        """Persists a new state for a roster
+
+        Args:
+            key: The roster key
+            state: The new state, preferably derived from the loaded one
+            expected_version: The version the state was derived from. When
+                given, the save only happens if the roster is still at it.
+
+        Returns:
+            The new version number of the roster
+
+        Raises:
+            VersionConflict: If the roster is no longer at expected_version
+        """
+        base = self._base(key) or self.load_versioned(key)
+        state, upserts, deletes, base_version = self._changes(key, state, base, expected_version)
+        version = self._write_changes(key, upserts, deletes, expected_version)
+        self._saved(key, version, state, base_version)
+        return version
+
+    async def asave(self, key, state, expected_version=None):
+        """Async version of ``save``, for use from async views"""
+        base = self._base(key) or await self.aload_versioned(key)
+        state, upserts, deletes, base_version = self._changes(key, state, base, expected_version)
+        version = await self._awrite_changes(key, upserts, deletes, expected_version)
+        self._saved(key, version, state, base_version)
+        return version
+
+    def changes_since(self, key, version):
+        """Returns the changes of a roster since one of its versions
+
+        Args:
+            key: The roster key
+            version: A version of the roster the caller already has
+
+        Returns:
+            A (current version, current state, changes) tuple. changes is a
+            list of (name, old_subjects, new_subjects) tuples as produced by
+            ``Roster.diff``, or None when the version is not among the recent
+            versions this process knows, in which case the caller has to
+            start over from the current state.
+        """
+        current, state = self.load_versioned(key)
+        return current, state, self._changes_between(key, version, current)
+
+    async def achanges_since(self, key, version):
+        """Async version of ``changes_since``"""
+        current, state = await self.aload_versioned(key)
+        return current, state, await self._achanges_between(key, version, current)
+
+    def wait_for_change(self, key, version, timeout):
+        """Blocks until a roster is no longer at a version, or for at most timeout seconds
+
+        Returns:
+            The current version of the roster
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.load_versioned(key)[0]
+            remaining = deadline - time.monotonic()
+            if current != version or remaining <= 0:
+                return current
+            # Woken up by saves of this process; changes made by other
+            # processes are noticed at the next check
+            with self._changed:
+                self._changed.wait(min(remaining, self.POLL_INTERVAL))
+
+    async def await_change(self, key, version, timeout):
+        """Async version of ``wait_for_change``, which checks the version periodically"""
+        deadline = time.monotonic() + timeout
+        while True:
+            current = (await self.aload_versioned(key))[0]
+            remaining = deadline - time.monotonic()
+            if current != version or remaining <= 0:
+                return current
+            await asyncio.sleep(min(remaining, self.ASYNC_POLL_INTERVAL))
+
+    def _changes_between(self, key, version, current):
+        if version == current:
+            return []
+        with self._lock:
+            history = self._history.get(key) or {}
+            old, new = history.get(version), history.get(current)
+        if old is None or new is None:
+            return None
+        # Values are compared by identity by the diff; drop equal ones
+        return [(name, before, after) for name, before, after in old.diff(new) if before != after]
+
+    async def _achanges_between(self, key, version, current):
+        return self._changes_between(key, version, current)
+
+    def _record(self, key, version, state, previous=None):
+        """Adds a version to the history of a roster; called holding the lock
+
+        Args:
+            key: The roster key
+            version: The new version
+            state: The roster at that version
+            previous: The version the state was derived from, when it was
+                saved by this process. The history only goes on when that
+                is its last version and nothing was saved in between;
+                otherwise (a load of another process's change, or a save
+                over unseen versions) it starts over from this version.
+        """
+        history = self._history.get(key)
+        if history is not None:
+            self._history.move_to_end(key)
+        if history:
+            last = next(reversed(history))
+            if last >= version:
+                return
+            if previous is None or previous != last or version != previous + 1:
+                history = None
+        if history is None:
+            history = self._history[key] = OrderedDict()
+            while len(self._history) > self.cache_size:
+                self._history.popitem(last=False)
+        history[version] = state
+        while len(history) > self.history_size:
+            history.popitem(last=False)
+        self._changed.notify_all()
+
+    def _cached(self, key, version):
+        """Returns the cached state of a roster if it is at the given version"""
+        cached = self._base(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        return None
+
+    def _base(self, key):
+        """Returns the cached (version, state) of a roster, or None"""
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        return cached
+
+    def _saved(self, key, version, state, base_version):
+        """Caches the state written by a save, if it is the whole stored roster
+
+        That is only known when the save directly followed the version its
+        changes were computed from. Otherwise an unconditional save went
+        over versions written by other processes, whose changes the stored
+        roster has and the state has not, so the cache entry is dropped and
+        the next load reads the records again.
+        """
+        if version == base_version + 1:
+            self._remember(key, version, state, base_version)
+            return
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] < version:
+                del self._cache[key]
+
+    def _remember(self, key, version, state, previous=None):
+        with self._lock:
+            cached = self._cache.get(key)
+            # Never replace a newer state saved concurrently by another thread
+            if cached is None or cached[0] <= version:
+                self._cache[key] = (version, state)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self._record(key, version, state, previous)
+        return state
+
+    def _changes(self, key, state, base, expected_version=None):
+        """Returns (state, upserts, deletes, base version) needed to go from a known state to a new one
+
+        Args:
+            key: The roster key
+            state: The new state
+            base: The (version, state) of the roster known to this process
+            expected_version: The version the new state was derived from, if any
+        """
+        state = as_roster(state)
+        version, base = base
+
+        # A state derived from another version than the cached one cannot be
+        # diffed against it, and cannot be saved either
+        if expected_version is not None and expected_version != version:
+            raise VersionConflict(key, expected_version, version)
+
+        # Split the differences into records to write and records to drop
+        upserts, deletes = {}, []
+        for name, _, subjects in base.diff(state):
+            if subjects is MISSING:
+                deletes.append(name)
+            else:
+                upserts[name] = subjects
+        return state, upserts, deletes, version
+
+    def _read_version(self, key):
+        """Returns the stored version of a roster, 0 when it does not exist"""
+        raise NotImplementedError
+
+    def _read_records(self, key):
+        """Returns a {name: subjects} dictionary with every stored student"""
+        raise NotImplementedError
+
+    def _write_changes(self, key, upserts, deletes, expected_version=None):
+        """Writes changed students, removes deleted ones and bumps the version
+
+        All of it happens atomically, and only if the stored version is
+        expected_version (when given).
+
+        Args:
+            key: The roster key
+            upserts: A {name: subjects} dictionary of new or changed students
+            deletes: A list of names of removed students
+            expected_version: The version the roster must be at, or None
+
+        Returns:
+            The new version number
+
+        Raises:
+            VersionConflict: If the roster is not at expected_version
+        """
+        raise NotImplementedError
+
+    # Async primitives. By default they run the blocking ones in Django's
+    # thread pool; subclasses with native async I/O override them.
+    async def _aread_version(self, key):
+        return await sync_to_async(self._read_version)(key)
+
+    async def _aread_records(self, key):
+        return await sync_to_async(self._read_records)(key)
+
+    async def _awrite_changes(self, key, upserts, deletes, expected_version=None):
+        return await sync_to_async(self._write_changes)(key, upserts, deletes, expected_version)
+
+
+class MemoryStore(StateStore):
+    """Keeps rosters in the memory of the current process
+
+    Nothing is serialized at all, but the data is neither shared between
+    worker processes nor kept across restarts. The cache is the storage
+    here, so its rosters are never evicted.
+    """
+
+    def load_versioned(self, key):
+        with self._lock:
+            return self._cache.get(key, (0, Roster()))
+
+    def version(self, key):
+        with self._lock:
+            return self._cache.get(key, (0, None))[0]
+
+    def save(self, key, state, expected_version=None):
+        state = as_roster(state)
+        with self._lock:
+            version = self._cache.get(key, (0, None))[0]
+            if expected_version is not None and expected_version != version:
+                raise VersionConflict(key, expected_version, version)
+            self._cache[key] = (version + 1, state)
+            self._record(key, version + 1, state, version)
+        return version + 1
+
+    # Nothing blocks, so the async versions need no thread handoff
+    async def aload_versioned(self, key):
+        return self.load_versioned(key)
+
+    async def aversion(self, key):
+        return self.version(key)
+
+    async def asave(self, key, state, expected_version=None):
+        return self.save(key, state, expected_version)
+
+
+class DatabaseStore(StateStore):
+    """Keeps rosters in the project database (db.sqlite3 by default)
+
+    Uses the ``RosterVersion`` and ``StudentRecord`` models, with one row per
+    student, so run ``python manage.py migrate`` before using it. Each save
+    also writes a ``RosterChange`` with the students it touched, which
+    serves the changes between recent versions to every process.
+    """
+
+    # Names per query when reading the previous subjects of changed students
+    READ_BATCH = 500
+
+    def _read_version(self, key):
+        return RosterVersion.objects.filter(key=key).values_list('version', flat=True).first() or 0
+
+    def _read_records(self, key):
+        return dict(StudentRecord.objects.filter(roster_key=key).values_list('name', 'subjects').iterator())
+
+    async def _aread_version(self, key):
+        return await RosterVersion.objects.filter(key=key).values_list('version', flat=True).afirst() or 0
+
+    async def _aread_records(self, key):
+        return {name: subjects async for name, subjects in
+                StudentRecord.objects.filter(roster_key=key).values_list('name', 'subjects')}
+
+    def _write_changes(self, key, upserts, deletes, expected_version=None):
+        with transaction.atomic():
+            # Claim the next version first. With an expected version this
+            # update is the compare-and-swap; either way it locks the roster's
+            # row until the transaction commits.
+            if expected_version is None:
+                claimed = RosterVersion.objects.filter(key=key).update(version=F('version') + 1)
+            else:
+                claimed = RosterVersion.objects.filter(key=key, version=expected_version).update(
+                    version=expected_version + 1
+                )
+            if not claimed:
+                if expected_version:
+                    raise VersionConflict(key, expected_version)
+                try:
+                    # A new roster: another request may be creating it too
+                    with transaction.atomic():
+                        RosterVersion.objects.create(key=key, version=1)
+                except IntegrityError:
+                    raise VersionConflict(key, expected_version)
+                version = 1
+            elif expected_version is not None:
+                version = expected_version + 1
+            else:
+                version = RosterVersion.objects.get(key=key).version
+
+            # The rows as the previous version left them, for the change record
+            names = [*upserts, *deletes]
+            previous = self._read_subjects(key, names) if version > 1 else {}
+
+            if deletes:
+                StudentRecord.objects.filter(roster_key=key, name__in=deletes).delete()
+            if upserts:
+                # Insert new students and overwrite changed ones in one statement per batch
+                StudentRecord.objects.bulk_create(
+                    [StudentRecord(roster_key=key, name=name, subjects=subjects)
+                     for name, subjects in upserts.items()],
+                    batch_size=500,
+                    update_conflicts=True,
+                    unique_fields=['roster_key', 'name'],
+                    update_fields=['subjects'],
+                )
+            RosterChange.objects.create(
+                roster_key=key, version=version,
+                changes=[[name, previous.get(name), upserts.get(name)] for name in names],
+            )
+            RosterChange.objects.filter(roster_key=key, version__lte=version - self.history_size).delete()
+            # The records as the JSON field stores them
+            metrics.observe_payload('database', sum(len(json.dumps(subjects)) for subjects in upserts.values()))
+            return version
+
+    def _read_subjects(self, key, names):
+        subjects = {}
+        for start in range(0, len(names), self.READ_BATCH):
+            subjects.update(StudentRecord.objects.filter(
+                roster_key=key, name__in=names[start:start + self.READ_BATCH],
+            ).values_list('name', 'subjects'))
+        return subjects
+
+    def _record(self, key, version, state, previous=None):
+        # The change log is in the database; only wake up the waiters
+        self._changed.notify_all()
+
+    def _change_records(self, key, version, current):
+        return RosterChange.objects.filter(
+            roster_key=key, version__gt=version, version__lte=current,
+        ).order_by('version').values_list('changes', flat=True)
+
+    def _changes_between(self, key, version, current):
+        if version == current:
+            return []
+        if not 0 <= version < current:
+            return None
+        return _net_changes(list(self._change_records(key, version, current)), current - version)
+
+    async def _achanges_between(self, key, version, current):
+        if version == current:
+            return []
+        if not 0 <= version < current:
+            return None
+        records = [changes async for changes in self._change_records(key, version, current)]
+        return _net_changes(records, current - version)
+
+
+def _net_changes(records, count):
+    """Folds consecutive change records into (name, old_subjects, new_subjects) tuples
+
+    Returns:
+        The changes, or None when some of the ``count`` records are missing
+    """
+    if len(records) != count:
+        return None
+    net = {}
+    for changes in records:
+        for name, old, new in changes:
+            net[name] = (net[name][0] if name in net else old, new)
+    return [
+        (name, MISSING if old is None else old, MISSING if new is None else new)
+        for name, (old, new) in net.items() if old != new
+    ]
+
+
+class FileStore(StateStore):
+    """Keeps each roster in its own ``dbm`` key-value file
+
+    Files live in ``settings.STUDENT_STATE_DIR``. Each student is one entry
+    holding its subjects as JSON, so only changed entries are rewritten.
+    Only one process should write to a given directory at a time.
+    """
+
+    # Entry holding the roster version; student names never contain NUL
+    VERSION_ENTRY = b'\0version'
+
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = Path(directory or settings.STUDENT_STATE_DIR)
+        self._file_lock = threading.Lock()
+
+    def _path(self, key):
+        return str(self.directory / key)
+
+    def _read_version(self, key):
+        with self._file_lock:
+            try:
+                with dbm.open(self._path(key), 'r') as db:
+                    return int(db.get(self.VERSION_ENTRY, b'0'))
+            except dbm.error:
+                return 0
+
+    def _read_records(self, key):
+        with self._file_lock, dbm.open(self._path(key), 'r') as db:
+            return {
+                entry.decode(): json.loads(db[entry])
+                for entry in db.keys() if entry != self.VERSION_ENTRY
+            }
+
+    def _write_changes(self, key, upserts, deletes, expected_version=None):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._file_lock, dbm.open(self._path(key), 'c') as db:
+            version = int(db.get(self.VERSION_ENTRY, b'0'))
+            if expected_version is not None and expected_version != version:
+                raise VersionConflict(key, expected_version, version)
+            for name in deletes:
+                if name.encode() in db:
+                    del db[name.encode()]
+            size = 0
+            for name, subjects in upserts.items():
+                record = json.dumps(subjects)
+                db[name.encode()] = record
+                size += len(record)
+            db[self.VERSION_ENTRY] = str(version + 1)
+            metrics.observe_payload('file', size)
+            return version + 1
+
+
+class JournalStore(StateStore):
+    """Keeps rosters in memory, made durable by an append-only journal
+
+    Every save appends just the changed grades and students to the roster's
+    journal in ``settings.STUDENT_STATE_DIR`` and waits for them to reach
+    the disk, sharing fsync calls between concurrent saves. Snapshots, written
+    by ``settings.STUDENT_STATE_SERIALIZER``, keep the journal short, so a
+    new process recovers a roster by loading the last snapshot and replaying
+    the changes made since (see ``Journal``).
+    Like FileStore, only one process should write to a given directory.
+
+    At most ``STUDENT_OPEN_JOURNALS`` journals stay open, each holding its
+    log's file descriptor and its roster; the least recently used one is
+    closed to make room. Reading a roster that has no journal opens and
+    creates nothing.
+    """
+
+    def __init__(self, directory=None, fsync=True, max_journals=None):
+        super().__init__()
+        self.directory = Path(directory or settings.STUDENT_STATE_DIR)
+        self.fsync = fsync
+        self.max_journals = max_journals or settings.STUDENT_OPEN_JOURNALS
+        # Open journals by roster key, least recently used first;
+        # recoveries are serialized
+        self._journals = OrderedDict()
+        self._open_lock = threading.Lock()
+
+    def journal(self, key, create=True):
+        """Returns the open journal of a roster, recovering it on first use
+
+        Args:
+            key: The roster key
+            create: Whether to create the journal of a roster that has none
+
+        Returns:
+            The Journal, or None if the roster has none and create is false
+        """
+        with self._lock:
+            journal = self._journals.get(key)
+            if journal is not None:
+                self._journals.move_to_end(key)
+        if journal is None:
+            with self._open_lock:
+                with self._lock:
+                    journal = self._journals.get(key)
+                if journal is None:
+                    if not create and not journal_exists(self.directory, key):
+                        return None
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    journal = Journal(self.directory, key, fsync=self.fsync, serializer=get_serializer())
+                    with self._lock:
+                        self._journals[key] = journal
+                        evicted = [
+                            self._journals.popitem(last=False)[1]
+                            for _ in range(len(self._journals) - self.max_journals)
+                        ]
+                    for old in evicted:
+                        old.close()
+        return journal
+
+    def load_versioned(self, key):
+        journal = self.journal(key, create=False)
+        if journal is None:
+            return 0, Roster()
+        version, state = journal.current()
+        with self._lock:
+            self._record(key, version, state)
+        return version, state
+
+    def version(self, key):
+        journal = self.journal(key, create=False)
+        return journal.current()[0] if journal is not None else 0
+
+    def save(self, key, state, expected_version=None):
+        state = as_roster(state)
+        while True:
+            journal = self.journal(key)
+            previous = journal.current()[0]
+            try:
+                version = journal.commit(state, expected_version)
+                break
+            except JournalClosed:
+                # Evicted meanwhile; its commits are all in the files that
+                # the next journal of the roster recovers from
+                continue
+        if version is None:
+            raise VersionConflict(key, expected_version, journal.version)
+        with self._lock:
+            self._record(key, version, state, previous)
+        return version
+
+    # Recoveries and commits block on the disk, so the async versions run
+    # them in worker threads, outside the single thread used for the ORM,
+    # where concurrent commits can share a sync
+    async def aload_versioned(self, key):
+        with self._lock:
+            journal = self._journals.get(key)
+            if journal is not None:
+                self._journals.move_to_end(key)
+        if journal is not None:
+            return journal.current()
+        return await sync_to_async(self.load_versioned, thread_sensitive=False)(key)
+
+    async def aversion(self, key):
+        return (await self.aload_versioned(key))[0]
+
+    async def asave(self, key, state, expected_version=None):
+        return await sync_to_async(self.save, thread_sensitive=False)(key, state, expected_version)
+
+    def close(self):
+        """Closes the journal files"""
+        with self._lock:
+            journals, self._journals = list(self._journals.values()), OrderedDict()
+        for journal in journals:
+            journal.close()
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    """Returns the store configured by ``settings.STUDENT_STATE_STORE``
+
+    The setting is the dotted path of a StateStore subclass. The instance is
+    created once per process so that its cache is shared by all requests.
+    """
+    return import_string(settings.STUDENT_STATE_STORE)()
@@ -1,3 +1,990 @@
-from django.test import TestCase
+import io
+import json
+import os
+import pstats
+import random
+import statistics
+import tempfile
+import threading
+from types import ModuleType
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import async_views, columnar, metrics
+from .batch import OPERATIONS
+from .benchmarks.cold_start import by_package, over_budget, parse_importtime
+from .benchmarks.generator import generate_roster
+from .benchmarks.suite import Context
+from .bulk_import import Row, read_rows
+from .export import export_roster, iter_export
+from .functional_core import (
+    add_student, add_subject, update_grade, remove_student, initial_state,
+    calculate_average, calculate_stddev, subject_average, subject_stddev,
+    students_taking, students_in_grade_range, rank_of, top_k, percentile, iter_students,
+    search_students, search_subjects, page_start, student_at
+)
+from .journal import Journal, JournalClosed
+from .models import RosterChange, StudentRecord
+from .persistent import MISSING, PersistentMap, PersistentSortedMap
+from .pipeline import pipeline
+from .roster import Roster
+from .serializers import BinaryRosterSerializer, JSONRosterSerializer
+from .shared_snapshot import publish, shared_roster
+from .session_manager import StudentSessionManager
+from .state_store import DatabaseStore, FileStore, JournalStore, MemoryStore, VersionConflict, get_store
+from .urls import student_urlpatterns
+
+
+class PersistentMapTests(SimpleTestCase):
+    """Checks the persistent map against a plain dictionary"""
+
+    def test_random_operations_match_dict(self):
+        rng = random.Random(42)
+        expected = {}
+        current = PersistentMap()
+        versions = []
+        for _ in range(2000):
+            key = f'student{rng.randint(0, 300)}'
+            if rng.random() < 0.7:
+                value = rng.randint(0, 100)
+                expected[key] = value
+                current = current.set(key, value)
+            else:
+                expected.pop(key, None)
+                current = current.delete(key)
+            versions.append((dict(expected), current))
+
+        # Every older version must still hold exactly its own contents
+        for snapshot, version in versions:
+            self.assertEqual(len(version), len(snapshot))
+            self.assertEqual(version.to_dict(), snapshot)
+
+    def test_bulk_construction(self):
+        data = {f'student{i}': i for i in range(5000)}
+        self.assertEqual(PersistentMap(data).to_dict(), data)
+
+    def test_delete_missing_key_returns_same_map(self):
+        current = PersistentMap({'ana': 1})
+        self.assertIs(current.delete('bob'), current)
+
+    def test_sorted_map_order_and_positions(self):
+        rng = random.Random(7)
+        expected = {}
+        current = PersistentSortedMap({i: i for i in range(0, 200, 2)})
+        expected.update({i: i for i in range(0, 200, 2)})
+        for _ in range(500):
+            key = rng.randint(0, 250)
+            if rng.random() < 0.6:
+                expected[key] = key
+                current = current.set(key, key)
+            else:
+                expected.pop(key, None)
+                current = current.delete(key)
+
+        keys = sorted(expected)
+        self.assertEqual(list(current), keys)
+        self.assertEqual(current.rank(100), len([k for k in keys if k < 100]))
+        self.assertEqual(current.select(10)[0], keys[10])
+        self.assertEqual([k for k, _ in current.items_from(5, 15)], keys[5:15])
+        self.assertEqual([k for k, _ in current.items_between(50, 60)], [k for k in keys if 50 <= k <= 60])
+
+
+class FunctionalCoreTests(SimpleTestCase):
+    """Checks that operations keep previous states intact"""
+
+    def test_operations_do_not_modify_previous_state(self):
+        start = add_student(initial_state(), 'ana', {'math': 90})
+        with_subject = add_subject(start, 'ana', 'art', 70)
+        updated = update_grade(with_subject, 'ana', 'math', 60)
+        removed = remove_student(updated, 'ana')
+
+        self.assertEqual(start()['ana'], {'math': 90})
+        self.assertEqual(with_subject()['ana'], {'math': 90, 'art': 70})
+        self.assertEqual(updated()['ana'], {'math': 60, 'art': 70})
+        self.assertNotIn('ana', removed())
+
+    def test_operations_accept_plain_dict_state(self):
+        state = lambda: {'ana': {'math': 90}}
+        self.assertEqual(update_grade(state, 'ana', 'math', 50)()['ana'], {'math': 50})
+        self.assertIs(add_subject(state, 'bob', 'art', 70), state)
+
+
+class PipelineTests(SimpleTestCase):
+    """Checks that lazy pipelines match the eager functional core"""
+
+    def test_long_chain_evaluates_base_once(self):
+        calls = []
+
+        def base():
+            calls.append(1)
+            return {'ana': {'math': 0}}
+
+        state = pipeline(base)
+        # Deeper than the recursion limit
+        for grade in range(20000):
+            state = update_grade(state, 'ana', 'math', grade)
+        state = add_subject(state, 'ana', 'art', 5)
+        self.assertEqual(state()['ana'], {'math': 19999, 'art': 5})
+        self.assertIs(state(), state())
+        self.assertEqual(len(calls), 1)
+
+    def test_random_chains_match_eager_operations(self):
+        rng = random.Random(7)
+        eager = initial_state()
+        lazy = pipeline(initial_state())
+        for step in range(3000):
+            name, subject, grade = f'student{rng.randint(0, 40)}', rng.choice('abc'), rng.randint(0, 100)
+            operation = rng.choice([
+                lambda s: add_student(s, name, {subject: grade}),
+                lambda s: add_subject(s, name, subject, grade),
+                lambda s: update_grade(s, name, subject, grade),
+                lambda s: remove_student(s, name),
+            ])
+            eager, lazy = operation(eager), operation(lazy)
+            if step % 97 == 0:
+                self.assertEqual(lazy().to_dict(), eager().to_dict())
+        self.assertEqual(lazy().to_dict(), eager().to_dict())
+        self.assertEqual(calculate_average(lazy, 'student1')(), calculate_average(eager, 'student1')())
+
+
+class SerializerTests(SimpleTestCase):
+    """Checks that the roster serializers round-trip any roster"""
+
+    def test_round_trip(self):
+        rosters = [
+            {},
+            {'ana': {}},
+            {'ana': {'math': 90, 'art': -3}, 'bob': {'art': 70}, 'zoë ✓': {'música': 100}},
+            # Values past one byte take the multi-byte varint path
+            {f'student{i}': {f'subject{i % 300}': i * 37 - 5000} for i in range(1000)},
+        ]
+        for serializer in (BinaryRosterSerializer(), BinaryRosterSerializer(compress=False), JSONRosterSerializer()):
+            for students in rosters:
+                payload = serializer.dumps(Roster(students))
+                self.assertEqual(serializer.loads(payload), students)
+        with self.assertRaises(ValueError):
+            BinaryRosterSerializer().loads(b'{}')
+
+    def test_binary_is_smaller_than_json(self):
+        students = {f'student{i}': {'math': i % 101, 'art': 100 - i % 101} for i in range(2000)}
+        binary = BinaryRosterSerializer(compress=False).dumps(students)
+        self.assertLess(len(binary) * 2, len(JSONRosterSerializer().dumps(students)))
+
+
+class SharedSnapshotTests(TestCase):
+    """Checks lookups in mapped snapshots and their atomic replacement"""
+
+    def test_lookups_and_replacement(self):
+        data = {'bob': {'math': -3}, 'ana': {'math': 90, 'art': 70}, 'émile': {}, 'zoe': {'art': 1}}
+        with tempfile.TemporaryDirectory() as directory, override_settings(STUDENT_SNAPSHOT_DIR=directory):
+            self.assertIsNone(shared_roster('roster'))
+            publish('roster', data, version=3)
+            shared = shared_roster('roster')
+            self.assertIs(shared_roster('roster'), shared)
+            self.assertEqual((shared.version, list(shared)), (3, sorted(data)))
+            self.assertEqual(dict(shared.items()), data)
+            self.assertNotIn('carl', shared)
+            self.assertEqual(calculate_average(lambda: shared, 'ana')(), 80)
+            self.assertEqual(list(iter_students(lambda: shared, 1, 1)()), ['bob: math: -3'])
+
+            # Readers of the old snapshot keep reading it after a new one is published
+            publish('roster', {'carl': {'math': 50}}, version=4)
+            self.assertEqual(dict(shared_roster('roster').items()), {'carl': {'math': 50}})
+            self.assertEqual(shared['ana'], {'math': 90, 'art': 70})
+
+    def test_queries_read_the_snapshot_in_place(self):
+        data = generate_roster(300, subjects_per_student=3, subjects=6, seed=2)
+        data['Ana'] = {'subject0': 100}
+        roster = Roster(data)
+        queries = [
+            lambda state: calculate_stddev(state, 'Ana')(),
+            lambda state: [subject_average(state, subject)() for subject in ('subject1', 'nope')],
+            lambda state: [subject_stddev(state, subject)() for subject in ('subject1', 'nope')],
+            lambda state: students_taking(state, 'subject2', 5, 10)(),
+            lambda state: students_in_grade_range(state, 'subject3', 20, 60, 3, 10)(),
+            lambda state: [rank_of(state, name, subject)() for name in ('Ana', 'nobody') for subject in (None, 'subject0')],
+            lambda state: [top_k(state, 5, subject)() for subject in (None, 'subject4', 'nope')],
+            lambda state: [percentile(state, p, 'subject5')() for p in (0, 37, 100)],
+            lambda state: [search_students(state, query)() for query in ('an', 'studnt1', 'x')],
+            lambda state: search_subjects(state, 'subjetc')(),
+            lambda state: (page_start(state, 2, 'student5')(), student_at(state, 42)()),
+        ]
+        with tempfile.TemporaryDirectory() as directory, override_settings(STUDENT_SNAPSHOT_DIR=directory):
+            publish('roster', roster)
+            shared = shared_roster('roster')
+            expected = [query(lambda: roster) for query in queries]
+            # Nothing is copied into a Roster
+            with mock.patch('students.functional_core.as_roster', side_effect=AssertionError):
+                self.assertEqual([query(lambda: shared) for query in queries], expected)
+
+    def test_reads_are_served_from_a_current_snapshot(self):
+        self.client.post('/', {'action': 'add_student', 'name': 'ana', 'subjects': 'math:90'})
+        key = self.client.session[StudentSessionManager.ROSTER_KEY]
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(STUDENT_SNAPSHOT_DIR=directory, STUDENT_SHARED_SNAPSHOTS=True):
+            call_command('publish_snapshot', key, stdout=io.StringIO())
+            with mock.patch.object(DatabaseStore, 'load_versioned', side_effect=AssertionError):
+                response = self.client.get('/filter/', {'subject': 'math'})
+                self.assertContains(self.client.get('/'), 'ana: math: 90')
+                self.assertEqual(self.client.get('/ranking/', {'name': 'ana'}).json()['rank']['rank'], 1)
+            self.assertEqual(response.json()['results'], [{'name': 'ana', 'grade': 90}])
+
+            # Once the roster changed, reads go back to the store
+            self.client.post('/', {'action': 'add_student', 'name': 'bob', 'subjects': 'math:70'})
+            self.assertEqual(self.client.get('/filter/', {'subject': 'math'}).json()['total'], 2)
+
+    def test_subject_ids_are_not_limited_to_16_bits(self):
+        data = {'ana': {f's{i}': i for i in range(70_000)}}
+        with tempfile.TemporaryDirectory() as directory, override_settings(STUDENT_SNAPSHOT_DIR=directory):
+            publish('roster', data)
+            self.assertEqual(shared_roster('roster')['ana'], data['ana'])
+
+
+class StateStoreTests(TestCase):
+    """Checks that every store round-trips a roster and writes only changes"""
+
+    def _round_trip(self, store):
+        state = store.load('roster')
+        self.assertEqual(len(state), 0)
+
+        state = add_student(lambda: state, 'ana', {'math': 90})()
+        state = add_student(lambda: state, 'bob', {'art': 70})()
+        store.save('roster', state)
+        state = remove_student(lambda: update_grade(lambda: state, 'ana', 'math', 50)(), 'bob')()
+        store.save('roster', state)
+
+        # A fresh store instance has to read the records back
+        fresh = type(store)(*self._store_args(store))
+        self.assertEqual(fresh.load('roster').to_dict(), {'ana': {'math': 50}})
+
+    def _store_args(self, store):
+        return (store.directory,) if isinstance(store, (FileStore, JournalStore)) else ()
+
+    def test_database_store(self):
+        self._round_trip(DatabaseStore())
+
+    def test_file_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self._round_trip(FileStore(directory))
+
+    def test_journal_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self._round_trip(JournalStore(directory))
+
+    def test_journal_recovers_from_snapshot_and_torn_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = JournalStore(directory)
+            state = Roster()
+            for i in range(300):
+                state = add_student(lambda: state, f'student{i}', {'math': i, 'art': -i})()
+                if i == 150:
+                    # Snapshot halfway, then keep logging on top of it
+                    store.journal('roster').SNAPSHOT_MIN_BYTES = 0
+                store.save('roster', state)
+                store.journal('roster').SNAPSHOT_MIN_BYTES = 1 << 20
+            state = update_grade(lambda: remove_student(lambda: state, 'student7')(), 'student8', 'art', 99)()
+            store.save('roster', state)
+            journal = store.journal('roster')
+            self.assertEqual(journal.snapshot(0, Roster()), False)
+            self.assertGreater(journal.snapshot_bytes, 0)
+            store.close()
+
+            # A crash in the middle of a write leaves a partial frame behind
+            with open(journal.log_path, 'ab') as log:
+                log.write(b'\x40\x00\x00\x00garbage')
+            version, recovered = JournalStore(directory).load_versioned('roster')
+            self.assertEqual(version, 301)
+            self.assertEqual(recovered.to_dict(), state.to_dict())
+
+    def test_journal_store_bounds_its_open_journals(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = JournalStore(directory, fsync=False, max_journals=4)
+            descriptors = len(os.listdir('/proc/self/fd'))
+            # Reading rosters that were never saved creates nothing
+            for i in range(50):
+                self.assertEqual(store.load_versioned(f'visitor{i}'), (0, Roster()))
+                self.assertEqual(store.version(f'visitor{i}'), 0)
+            self.assertEqual(os.listdir(directory), [])
+
+            evicted = store.journal('roster0')
+            for i in range(20):
+                store.save(f'roster{i}', Roster({'ana': {'math': i}}))
+                store.load_versioned(f'roster{i}')
+            self.assertEqual(len(store._journals), 4)
+            self.assertLessEqual(len(os.listdir('/proc/self/fd')), descriptors + 4)
+            self.assertEqual(len(os.listdir(directory)), 20)
+
+            # Evicted journals are closed, and their rosters recovered on the next use
+            with self.assertRaises(JournalClosed):
+                evicted.commit(Roster())
+            self.assertEqual(store.load_versioned('roster0'), (1, Roster({'ana': {'math': 0}})))
+            self.assertEqual(store.save('roster0', Roster(), expected_version=1), 2)
+            store.close()
+
+    def test_journal_snapshot_outlives_a_serializer_change(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state = Roster({'ana': {'math': 90}, 'bo': {'art': -3}})
+            journal = Journal(directory, 'roster', fsync=False, serializer=JSONRosterSerializer())
+            journal.commit(state)
+            self.assertTrue(journal.snapshot(1, state))
+            journal.close()
+
+            # The snapshot names its serializer, whatever the journal is opened with
+            journal = Journal(directory, 'roster', fsync=False)
+            self.assertEqual((journal.version, journal.state.to_dict()), (1, state.to_dict()))
+            journal.close()
+
+            # A serializer that cannot be imported makes the snapshot unreadable
+            class LocalSerializer(JSONRosterSerializer):
+                pass
+
+            journal = Journal(directory, 'roster', fsync=False, serializer=LocalSerializer())
+            self.assertTrue(journal.snapshot(1, state))
+            journal.close()
+            with self.assertRaisesMessage(ValueError, 'unknown serializer'):
+                Journal(directory, 'roster', fsync=False)
+
+    def test_memory_store(self):
+        store = MemoryStore()
+        store.save('roster', {'ana': {'math': 90}})
+        self.assertEqual(store.load('roster').to_dict(), {'ana': {'math': 90}})
+
+    def test_database_store_only_writes_changed_students(self):
+        store = DatabaseStore()
+        state = PersistentMap({f'student{i}': {'math': i} for i in range(100)})
+        store.save('roster', state)
+        with mock.patch.object(store, '_write_changes', wraps=store._write_changes) as write:
+            store.save('roster', update_grade(lambda: state, 'student5', 'math', 1)())
+        write.assert_called_once_with('roster', {'student5': {'math': 1}}, [], None)
+
+        # A cached load only needs to check the version
+        with self.assertNumQueries(1):
+            store.load('roster')
+        record = StudentRecord.objects.get(roster_key='roster', name='student5')
+        self.assertEqual(record.subjects, {'math': 1})
+        self.assertEqual(StudentRecord.objects.filter(roster_key='roster').count(), 100)
+
+
+    def _compare_and_swap(self, first, second):
+        version, state = first.load_versioned('roster')
+        second.load_versioned('roster')
+        first.save('roster', add_student(lambda: state, 'ana', {'math': 90})(), expected_version=version)
+
+        # The second store saves a state derived from the old version
+        with self.assertRaises(VersionConflict):
+            second.save('roster', add_student(lambda: state, 'bob', {'art': 70})(), expected_version=version)
+        version, state = second.load_versioned('roster')
+        self.assertEqual(state.to_dict(), {'ana': {'math': 90}})
+        self.assertEqual(second.save('roster', remove_student(lambda: state, 'ana')(), expected_version=version), 2)
+
+    def test_database_store_compare_and_swap(self):
+        self._compare_and_swap(DatabaseStore(), DatabaseStore())
+
+    def test_blind_save_over_unseen_versions_is_not_cached(self):
+        first, second = DatabaseStore(), DatabaseStore()
+        original = Roster({'x': {'math': 1}})
+        first.save('roster', original)
+        version, state = second.load_versioned('roster')
+        second.save('roster', add_student(lambda: state, 'y', {'math': 2})(), expected_version=version)
+
+        # The first store saves over version 2 without having seen it
+        first.save('roster', add_student(lambda: original, 'z', {'math': 3})())
+        self.assertEqual(first.load('roster').to_dict(), {'x': {'math': 1}, 'y': {'math': 2}, 'z': {'math': 3}})
+
+    @override_settings(STUDENT_CACHED_ROSTERS=3)
+    def test_cache_keeps_the_most_recent_rosters(self):
+        store = DatabaseStore()
+        for i in range(10):
+            store.save(f'roster{i}', {'ana': {'math': i}, 'bob': {'art': i}})
+            store.load(f'roster{i % 2}')
+        self.assertLessEqual(len(store._cache), 3)
+        self.assertEqual(set(store._cache), {'roster0', 'roster1', 'roster9'})
+
+        # An evicted roster is read again, also as the base of a save
+        self.assertNotIn('roster5', store._cache)
+        self.assertEqual(store.save('roster5', {'ana': {'math': 6}}, expected_version=1), 2)
+        self.assertEqual(DatabaseStore().load('roster5').to_dict(), {'ana': {'math': 6}})
+
+    def test_file_store_compare_and_swap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self._compare_and_swap(FileStore(directory), FileStore(directory))
+
+    async def test_database_store_async_round_trip(self):
+        store = DatabaseStore()
+        await store.asave('roster', {'ana': {'math': 90}, 'bob': {'art': 70}})
+        self.assertEqual((await DatabaseStore().aload('roster')).to_dict(), {'ana': {'math': 90}, 'bob': {'art': 70}})
+        self.assertEqual(await store.asave('roster', {'ana': {'math': 90}}), 2)
+        self.assertEqual(await StudentRecord.objects.acount(), 1)
+
+
+class TransactionTests(TestCase):
+    """Checks that conflicting updates are retried instead of lost"""
+
+    def test_conflicting_update_is_reapplied(self):
+        session = {}
+        StudentSessionManager.update_session(session, lambda: {'ana': {'math': 90}})
+        key = StudentSessionManager.get_roster_key(session)
+        seen = []
+
+        def operation(state):
+            if not seen:
+                # Another process adds a student after this one read the roster
+                other = DatabaseStore()
+                version, current = other.load_versioned(key)
+                other.save(key, add_student(lambda: current, 'bob', {'art': 70})(), expected_version=version)
+            seen.append(sorted(state()))
+            return add_subject(state, 'ana', 'art', 80), 'done'
+
+        StudentSessionManager.stats.reset()
+        state, result = StudentSessionManager.transact(session, operation)
+        self.assertEqual(result, 'done')
+        self.assertEqual(seen, [['ana'], ['ana', 'bob']])
+        self.assertEqual(state().to_dict(), {'ana': {'math': 90, 'art': 80}, 'bob': {'art': 70}})
+        self.assertEqual(StudentSessionManager.get_state(session)().to_dict(), state().to_dict())
+        stats = self.client.get('/stats/').json()
+        self.assertEqual((stats['transactions'], stats['commits'], stats['conflicts']), (1, 1, 1))
+        self.assertEqual(stats['conflict_rate'], 0.5)
+
+
+class AggregateCacheTests(SimpleTestCase):
+    """Property tests: cached statistics always match a brute-force recompute"""
+
+    SUBJECTS = ['math', 'science', 'history', 'art', 'music']
+
+    def _random_operation(self, rng, state):
+        name = f'student{rng.randint(0, 40)}'
+        subject = rng.choice(self.SUBJECTS)
+        grade = rng.randint(0, 100)
+        operation = rng.randrange(4)
+        if operation == 0:
+            subjects = {s: rng.randint(0, 100) for s in rng.sample(self.SUBJECTS, rng.randint(0, 3))}
+            return add_student(state, name, subjects)
+        if operation == 1:
+            return add_subject(state, name, subject, grade)
+        if operation == 2:
+            return update_grade(state, name, subject, grade)
+        return remove_student(state, name)
+
+    def _assert_matches_brute_force(self, state):
+        data = state().to_dict()
+        for name, subjects in data.items():
+            grades = list(subjects.values())
+            expected = sum(grades) / len(grades) if grades else 0
+            self.assertAlmostEqual(calculate_average(state, name)(), expected)
+            self.assertAlmostEqual(calculate_average(lambda: data, name)(), expected)
+            self.assertAlmostEqual(calculate_stddev(state, name)(), statistics.pstdev(grades) if grades else 0)
+
+        for subject in self.SUBJECTS:
+            grades = [subjects[subject] for subjects in data.values() if subject in subjects]
+            self.assertAlmostEqual(subject_average(state, subject)(), statistics.mean(grades) if grades else 0)
+            self.assertAlmostEqual(subject_stddev(state, subject)(), statistics.pstdev(grades) if grades else 0)
+
+        # The ranking index follows the averages computed from scratch
+        ranking = sorted((-statistics.fmean(subjects.values()), name) for name, subjects in data.items() if subjects)
+        self.assertEqual(top_k(state, 5)(), [(name, -score) for score, name in ranking[:5]])
+        for score, name in ranking:
+            self.assertEqual(rank_of(state, name)(), 1 + sum(other < score for other, _ in ranking))
+
+        # Rebuilding the indexes from scratch gives exactly the same counters
+        rebuilt = Roster(data).aggregates
+        self.assertEqual(state().aggregates.students.to_dict(), rebuilt.students.to_dict())
+        self.assertEqual(state().aggregates.subjects.to_dict(), rebuilt.subjects.to_dict())
+
+    def test_random_operation_sequences(self):
+        for seed in range(20):
+            rng = random.Random(seed)
+            state = initial_state()
+            for _ in range(150):
+                state = self._random_operation(rng, state)
+                self._assert_matches_brute_force(state)
+
+    def test_unknown_names_average_to_zero(self):
+        state = initial_state()
+        self.assertEqual(calculate_average(state, 'nobody')(), 0)
+        self.assertEqual(subject_average(state, 'nothing')(), 0)
+
+
+class HomeViewTests(TestCase):
+    """Checks pagination and streaming of the student list"""
+
+    def setUp(self):
+        for i in range(5):
+            self.client.post('/', {'action': 'add_student', 'name': f'student{i}', 'subjects': f'math:{i}'})
+
+    def test_pages_follow_name_order(self):
+        first = self.client.get('/', {'limit': 2})
+        self.assertContains(first, 'student0: math: 0\nstudent1: math: 1</pre>')
+        self.assertEqual(first.context['next_cursor'], 'student1')
+
+        second = self.client.get('/', {'limit': 2, 'after': 'student1'})
+        self.assertContains(second, 'student2: math: 2\nstudent3: math: 3</pre>')
+        self.assertEqual(second.context['prev_offset'], 0)
+
+        last = self.client.get('/', {'limit': 2, 'offset': 4})
+        self.assertContains(last, 'student4: math: 4</pre>')
+        self.assertIsNone(last.context['next_cursor'])
+
+    def test_streaming_sends_every_row(self):
+        response = self.client.get('/', {'stream': '1'})
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        for i in range(5):
+            self.assertIn(f'student{i}: math: {i}\n', content)
+        self.assertTrue(content.rstrip().endswith('</html>'))
+
+    def test_unchanged_page_is_not_modified(self):
+        # The redirect after the setUp posts shows messages: no validator
+        self.assertFalse(self.client.get('/').has_header('ETag'))
+
+        page = self.client.get('/', {'limit': 2})
+        etag = page['ETag']
+        self.assertEqual(self.client.get('/', {'limit': 2}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Dates cannot tell apart versions saved within the same second
+        self.assertFalse(page.has_header('Last-Modified'))
+        self.assertEqual(
+            self.client.get('/', {'limit': 2}, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT').status_code, 200,
+        )
+        # Another page of the same roster has its own ETag
+        self.assertNotEqual(self.client.get('/', {'limit': 3})['ETag'], etag)
+
+        self.client.post('/', {'action': 'update_grade', 'name': 'student0', 'subject': 'math', 'grade': '9'})
+        self.client.get('/')
+        changed = self.client.get('/', {'limit': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'student0: math: 9')
+
+    def test_student_list_is_formatted_once_per_version(self):
+        metrics.reset()
+        self.client.get('/', {'offset': 1})
+        self.client.get('/', {'offset': 1})
+        self.assertEqual(metrics.PHASE_SECONDS.count('format'), 1)
+
+
+class MetricsTests(TestCase):
+    """Checks the request timings and the Prometheus endpoint"""
+
+    def setUp(self):
+        metrics.reset()
+        StudentSessionManager.stats.reset()
+
+    def test_requests_and_phases_are_reported(self):
+        self.client.post('/', {'action': 'add_student', 'name': 'ana', 'subjects': 'math:90'})
+        self.client.post('/', {'action': 'made_up', 'name': 'ana'})
+        self.client.get('/')
+        self.assertEqual(metrics.REQUEST_SECONDS.count('home', 'add_student'), 1)
+        self.assertEqual(metrics.REQUEST_SECONDS.count('home', ''), 2)
+        for phase in ('load', 'core', 'save', 'format', 'render'):
+            self.assertGreater(metrics.PHASE_SECONDS.count(phase), 0, phase)
+
+        response = self.client.get('/metrics/')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode()
+        self.assertIn('student_request_seconds_count{view="home",action="add_student"} 1', content)
+        self.assertIn('student_request_seconds_bucket{view="home",action="add_student",le="+Inf"} 1', content)
+        self.assertIn('student_roster_students 1', content)
+        self.assertIn('student_commits_total 1', content)
+        self.assertEqual(metrics.PAYLOAD_BYTES.count('database'), 1)
+
+    def test_action_labels_match_the_batch_operations(self):
+        self.assertEqual(metrics.ACTIONS, set(OPERATIONS))
+
+    def test_profile_on_request(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(DEBUG=True, STUDENT_PROFILE_DIR=directory):
+            response = self.client.get('/', {'profile': '1'})
+            self.assertTrue(response['X-Student-Profile'].startswith('home-'))
+            stats = pstats.Stats(f"{directory}/{response['X-Student-Profile']}")
+            self.assertGreater(stats.total_calls, 0)
+        self.assertNotIn('X-Student-Profile', self.client.get('/', {'profile': '1'}))
+
+    def test_profile_that_cannot_be_saved_is_logged(self):
+        with tempfile.NamedTemporaryFile() as file, override_settings(DEBUG=True, STUDENT_PROFILE_DIR=file.name):
+            with self.assertLogs('students.metrics', 'ERROR'):
+                response = self.client.get('/', {'profile': '1'})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-Student-Profile', response)
+        # The profiler was released for the next request
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(DEBUG=True, STUDENT_PROFILE_DIR=directory):
+            self.assertIn('X-Student-Profile', self.client.get('/', {'profile': '1'}))
+
+
+# URL configuration routing the app to its async views
+async_urlconf = ModuleType('async_urlconf')
+async_urlconf.urlpatterns = student_urlpatterns(async_views)
+
+
+@override_settings(ROOT_URLCONF=async_urlconf)
+class AsyncViewTests(TestCase):
+    """Checks the async views against the behaviour of the sync ones"""
+
+    async def test_forms_batch_and_filter(self):
+        response = await self.async_client.post('/', {'action': 'add_student', 'name': 'ana', 'subjects': 'math:90'})
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        response = await self.async_client.post('/batch/', {'operations': [
+            {'action': 'add_student', 'name': 'bob', 'subjects': {'math': 70}},
+        ]}, content_type='application/json')
+        self.assertTrue(response.json()['applied'])
+
+        response = await self.async_client.get('/filter/', {'subject': 'math', 'min': 80})
+        self.assertEqual(response.json()['results'], [{'name': 'ana', 'grade': 90}])
+        response = await self.async_client.get('/')
+        self.assertContains(response, 'ana: math: 90\nbob: math: 70</pre>')
+
+        state = await StudentSessionManager.aget_state(await self.async_client.asession())
+        self.assertEqual(state().to_dict(), {'ana': {'math': 90}, 'bob': {'math': 70}})
+
+        # The first page showed the messages of the posts; the next one can be validated
+        etag = (await self.async_client.get('/'))['ETag']
+        response = await self.async_client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Two versions: one per request that changed the roster
+        response = await self.async_client.get('/changes/', {'since': 1, 'wait': 5})
+        self.assertEqual(response.json()['added'], {'bob': {'math': 70}})
+
+
+class BulkImportTests(TestCase):
+    """Checks the bulk import endpoint and its per-row error report"""
+
+    def test_csv_import_reports_bad_rows(self):
+        upload = SimpleUploadedFile(
+            'roster.csv', b'name,subjects\nana,"math:90, art:80"\nbob,math:x\ncarl,science:70\n'
+        )
+        response = self.client.post(
+            '/import/', {'file': upload, 'batch_size': 1}, HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response.json(), {
+            'imported': 2, 'failed': 1, 'batches': 2,
+            'errors': [{'line': 3, 'error': 'grades must be whole numbers'}],
+        })
+        state = StudentSessionManager.get_state(self.client.session)()
+        self.assertEqual(state.to_dict(), {'ana': {'math': 90, 'art': 80}, 'carl': {'science': 70}})
+
+    def test_concurrent_changes_survive_the_import(self):
+        DatabaseStore().save('shared', Roster({'alice': {'math': 50}}))
+
+        def rows(lines, fmt):
+            yield Row(1, 'bob', {'math': 70}, None)
+            # Another request of this process changes alice between the batches
+            store = get_store()
+            version, state = store.load_versioned('shared')
+            store.save('shared', update_grade(lambda: state, 'alice', 'math', 99)(), expected_version=version)
+            yield Row(2, 'carl', {'art': 80}, None)
+
+        with tempfile.NamedTemporaryFile(suffix='.csv') as file, \
+                mock.patch('students.management.commands.import_roster.read_rows', rows):
+            call_command('import_roster', file.name, roster='shared', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(DatabaseStore().load('shared').to_dict(), {
+            'alice': {'math': 99}, 'bob': {'math': 70}, 'carl': {'art': 80},
+        })
+
+    def test_jsonl_rows(self):
+        lines = ['{"name": "ana", "subjects": {"math": 90}}', '', '{"name": "bob", "subjects": "art:70"}']
+        rows = list(read_rows(lines, 'jsonl'))
+        self.assertEqual([(row.name, row.subjects) for row in rows], [('ana', {'math': 90}), ('bob', {'art': 70})])
+
+
+class ExportTests(TestCase):
+    """Checks that exports come out in order from the worker processes"""
+
+    def test_parallel_export_matches_serial_one(self):
+        roster = Roster(generate_roster(50, subjects_per_student=2, seed=3))
+        outputs = []
+        for workers in (1, 3):
+            output = io.BytesIO()
+            result = export_roster(lambda: roster, 'transcripts', 'csv', output, chunk_size=7, workers=workers)
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual((result.rows, result.chunks), (50, 8))
+
+        # The transcripts can be imported back
+        rows = list(read_rows(io.StringIO(outputs[1].decode()), 'csv'))
+        self.assertEqual({row.name: row.subjects for row in rows}, roster.to_dict())
+
+    def test_subject_statistics_endpoint(self):
+        self.client.post('/batch/', {'operations': [
+            {'action': 'add_student', 'name': 'ana', 'subjects': {'math': 50, 'art': 90}},
+            {'action': 'add_student', 'name': 'bob', 'subjects': {'math': 70}},
+        ]}, content_type='application/json')
+        response = self.client.get('/export/', {'kind': 'subjects', 'format': 'jsonl'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'subject': 'art', 'students': 1, 'average': 90.0, 'stddev': 0.0, 'lowest': 90, 'highest': 90},
+            {'subject': 'math', 'students': 2, 'average': 60.0, 'stddev': 10.0, 'lowest': 50, 'highest': 70},
+        ])
+        self.assertEqual(self.client.get('/export/', {'format': 'xml'}).status_code, 400)
+
+        # Requests never start worker processes, whatever the setting
+        with override_settings(STUDENT_EXPORT_WORKERS=4), \
+                mock.patch('students.views.iter_export', wraps=iter_export) as export:
+            response = self.client.get('/export/')
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+        self.assertEqual(export.call_args.kwargs['workers'], 1)
+
+
+class BatchTests(TestCase):
+    """Checks that batches are applied atomically with per-operation results"""
+
+    def _post(self, operations):
+        return self.client.post('/batch/', {'operations': operations}, content_type='application/json')
+
+    def test_batch_applies_all_operations(self):
+        response = self._post([
+            {'action': 'add_student', 'name': 'ana', 'subjects': {'math': 90}},
+            {'action': 'add_subject', 'name': 'ana', 'subject': 'art', 'grade': '70'},
+            {'action': 'update_grade', 'name': 'ana', 'subject': 'math', 'grade': 50},
+            {'action': 'calculate_average', 'name': 'ana'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][3]['average'], 60)
+        state = StudentSessionManager.get_state(self.client.session)()
+        self.assertEqual(state.to_dict(), {'ana': {'math': 50, 'art': 70}})
+
+    def test_failing_operation_rejects_whole_batch(self):
+        response = self._post([
+            {'action': 'add_student', 'name': 'ana', 'subjects': 'math:90'},
+            {'action': 'update_grade', 'name': 'bob', 'subject': 'math', 'grade': 50},
+            {'action': 'add_subject', 'name': 'ana', 'subject': 'art', 'grade': 'x'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['applied'])
+        self.assertEqual([r['status'] for r in response.json()['results']], ['ok', 'error', 'error'])
+        self.assertEqual(len(StudentSessionManager.get_state(self.client.session)()), 0)
+
+    def test_unknown_and_malformed_actions_are_reported(self):
+        response = self._post([
+            {'action': 'made_up', 'name': 'ana'},
+            {'action': ['add_student'], 'name': 'ana'},
+            {'action': {}, 'name': 'ana'},
+            {'name': 'ana'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = [(r['status'], r['error']) for r in response.json()['results']]
+        self.assertEqual(errors, [
+            ('error', "unknown action 'made_up'"),
+            ('error', '"action" must be a string'),
+            ('error', '"action" must be a string'),
+            ('error', '"action" must be a string'),
+        ])
+
+
+@skipIf(columnar.np is None, 'NumPy is not installed')
+class BenchmarkCommandTests(SimpleTestCase):
+    """Checks the roster generator and the baseline comparison of the benchmark command"""
+
+    def test_generator_is_reproducible(self):
+        roster = generate_roster(50, subjects_per_student=3, subjects=5, seed=4)
+        self.assertEqual(roster, generate_roster(50, subjects_per_student=3, subjects=5, seed=4))
+        self.assertNotEqual(roster, generate_roster(50, subjects_per_student=3, subjects=5, seed=5))
+        self.assertTrue(all(len(subjects) == 3 for subjects in roster.values()))
+
+    def test_baseline_regression_fails(self):
+        options = {
+            'students': 20, 'only': ['core.calculate_average'], 'min_time': 0.01, 'rounds': 1,
+            'stdout': io.StringIO(),
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/baseline.json'
+            call_command('benchmark', baseline=path, save_baseline=True, **options)
+            call_command('benchmark', baseline=path, threshold=0.99, **options)
+
+            with open(path) as file:
+                baseline = json.load(file)
+            baseline['results']['core.calculate_average']['ops_per_sec'] *= 1000
+            with open(path, 'w') as file:
+                json.dump(baseline, file)
+            with self.assertRaisesMessage(CommandError, 'core.calculate_average'):
+                call_command('benchmark', baseline=path, **options)
+
+    def test_changes_are_timed_with_every_index_built(self):
+        context = Context(30, subjects_per_student=2, subjects=4, seed=1)
+        roster = context.state()()
+        self.assertEqual(set(roster.indexes), {index_type.name for index_type in Roster.INDEXES})
+        # A change carries every index over to the new roster
+        name = context.names[0]
+        changed = update_grade(context.state(), name, context.subject_of(name), 1)()
+        self.assertEqual(set(changed.indexes), set(roster.indexes))
+
+    def test_importtime_report_and_budget(self):
+        report = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |     django.utils\n'
+            'import time:       300 |        420 |   django\n'
+            'import time:        50 |         50 | students.views\n'
+            'some other output\n'
+        )
+        modules = parse_importtime(report)
+        self.assertEqual(modules[0], ('django.utils', 120, 120, 2))
+        self.assertEqual(by_package(modules), [('django', 420), ('students', 50)])
+
+        medians = {'cold_start': 250.0, 'imports': 120.0}
+        self.assertEqual(over_budget(medians, {'cold_start': 200.0, 'imports': 150.0}), ['cold_start'])
+        self.assertEqual(over_budget(medians, {'cold_start': None, 'imports': 150.0}), [])
+
+
+class ColumnarGradebookTests(SimpleTestCase):
+    """Checks the vectorized analytics against the nested dictionaries"""
+
+    def setUp(self):
+        rng = random.Random(3)
+        self.data = {
+            f'student{i}': {s: rng.randint(0, 100) for s in rng.sample(['math', 'art', 'music'], rng.randint(0, 3))}
+            for i in range(200)
+        }
+        self.gradebook = columnar.to_columnar(lambda: Roster(self.data))()
+
+    def test_round_trip(self):
+        self.assertEqual(columnar.from_columnar(self.gradebook)().to_dict(), self.data)
+
+    def test_analytics_match_python(self):
+        averages = dict(zip(self.gradebook.students, self.gradebook.student_averages().tolist()))
+        for name, subjects in self.data.items():
+            self.assertAlmostEqual(averages[name], statistics.mean(subjects.values()) if subjects else 0)
+
+        math = [s['math'] for s in self.data.values() if 'math' in s]
+        self.assertAlmostEqual(self.gradebook.subject_means()['math'], statistics.mean(math))
+        self.assertAlmostEqual(self.gradebook.percentile(90, 'math'), columnar.np.percentile(math, 90))
+
+        best = sorted(averages.values(), reverse=True)[:5]
+        self.assertEqual([score for _, score in self.gradebook.top_k(5)], best)
+
+
+class SubjectQueryTests(TestCase):
+    """Checks the subject and grade-range queries and their endpoint"""
+
+    def setUp(self):
+        self.client.post('/batch/', {'operations': [
+            {'action': 'add_student', 'name': 'ana', 'subjects': {'math': 55, 'physics': 90}},
+            {'action': 'add_student', 'name': 'bob', 'subjects': {'math': 80}},
+            {'action': 'add_student', 'name': 'cid', 'subjects': {'math': 40, 'physics': 70}},
+            {'action': 'update_grade', 'name': 'bob', 'subject': 'math', 'grade': 59},
+        ]}, content_type='application/json')
+
+    def test_students_taking_subject(self):
+        response = self.client.get('/filter/', {'subject': 'physics'})
+        self.assertEqual(response.json()['results'], [{'name': 'ana', 'grade': 90}, {'name': 'cid', 'grade': 70}])
+
+    def test_grade_range(self):
+        response = self.client.get('/filter/', {'subject': 'math', 'max': 59, 'limit': 2})
+        data = response.json()
+        self.assertEqual(data['total'], 3)
+        self.assertEqual([r['name'] for r in data['results']], ['cid', 'ana'])
+        self.assertEqual(data['next_offset'], 2)
+
+    def test_ranking_endpoint(self):
+        data = self.client.get('/ranking/', {'top': 2, 'name': 'bob', 'percentile': 50}).json()
+        self.assertEqual(data['top'], [{'name': 'ana', 'score': 72.5}, {'name': 'bob', 'score': 59.0}])
+        self.assertEqual(data['rank'], {'name': 'bob', 'rank': 2})
+        self.assertEqual(data['percentile'], {'percentile': 50.0, 'name': 'bob', 'score': 59.0})
+
+        data = self.client.get('/ranking/', {'subject': 'physics', 'name': 'bob'}).json()
+        self.assertEqual([row['name'] for row in data['top']], ['ana', 'cid'])
+        self.assertIsNone(data['rank']['rank'])
+        self.assertEqual(self.client.get('/ranking/', {'percentile': 101}).status_code, 400)
+
+    def test_queries_follow_removals(self):
+        state = remove_student(StudentSessionManager.get_state(self.client.session), 'cid')
+        self.assertEqual(students_in_grade_range(state, 'math', 50, 60)(), (2, [('ana', 55), ('bob', 59)]))
+        self.assertEqual(students_taking(state, 'physics')(), (1, [('ana', 90)]))
+
+
+class ChangesTests(TestCase):
+    """Checks the delta-sync endpoint and its long polling"""
+
+    def _batch(self, *operations):
+        self.client.post('/batch/', {'operations': list(operations)}, content_type='application/json')
+
+    def test_changes_since_a_version(self):
+        self._batch(
+            {'action': 'add_student', 'name': 'ana', 'subjects': {'math': 55, 'art': 90}},
+            {'action': 'add_student', 'name': 'bob', 'subjects': {'math': 80}},
+        )
+        first = self.client.get('/changes/', {'since': 0}).json()
+        self.assertFalse(first['reset'])
+        self.assertEqual(first['added'], {'ana': {'math': 55, 'art': 90}, 'bob': {'math': 80}})
+
+        self._batch(
+            {'action': 'update_grade', 'name': 'ana', 'subject': 'math', 'grade': 60},
+            {'action': 'remove_student', 'name': 'bob'},
+        )
+        second = self.client.get('/changes/', {'since': first['version']}).json()
+        self.assertEqual(second['version'], first['version'] + 1)
+        self.assertEqual(second['updated'], {'ana': {'math': 60}})
+        self.assertEqual((second['added'], second['removed']), ({}, ['bob']))
+
+        # Versions outside the change log are answered with the whole roster
+        reset = self.client.get('/changes/', {'since': 1000}).json()
+        self.assertTrue(reset['reset'])
+        self.assertEqual(reset['students'], {'ana': {'math': 60, 'art': 90}})
+        self.assertEqual(self.client.get('/changes/', {'since': 'x'}).status_code, 400)
+
+    @override_settings(STUDENT_CHANGE_LOG_SIZE=3)
+    def test_database_changes_are_served_by_any_process(self):
+        writer, other = DatabaseStore(), DatabaseStore()
+        writer.save('roster', {'ana': {'math': 55, 'art': 90}, 'bob': {'math': 80}})
+        writer.save('roster', {'ana': {'math': 60, 'art': 90}, 'bob': {'math': 80}, 'cid': {}})
+        # A blind save from a process that missed the last version
+        other.save('roster', {'ana': {'math': 60}, 'cid': {}})
+
+        version, state, changes = other.changes_since('roster', 1)
+        self.assertEqual(version, 3)
+        self.assertEqual(sorted(changes, key=lambda change: change[0]), [
+            ('ana', {'math': 55, 'art': 90}, {'math': 60}),
+            ('bob', {'math': 80}, MISSING),
+            ('cid', MISSING, {}),
+        ])
+        self.assertEqual(DatabaseStore().changes_since('roster', 3)[2], [])
+
+        # Only the last STUDENT_CHANGE_LOG_SIZE versions can be diffed
+        writer.save('roster', {'ana': {'math': 61}})
+        self.assertIsNone(other.changes_since('roster', 0)[2])
+        self.assertEqual(sorted(name for name, _, _ in other.changes_since('roster', 1)[2]), ['ana', 'bob'])
+        self.assertEqual(RosterChange.objects.count(), 3)
+
+    def test_wait_for_change_wakes_up_on_save(self):
+        store = MemoryStore()
+        store.save('roster', {'ana': {'math': 90}})
+        timer = threading.Timer(0.05, store.save, ('roster', {'ana': {'math': 95}}))
+        timer.start()
+        self.assertEqual(store.wait_for_change('roster', 1, timeout=5), 2)
+        timer.join()
+        _, _, changes = store.changes_since('roster', 1)
+        self.assertEqual([name for name, _, _ in changes], ['ana'])
+
+
+class NameSearchTests(TestCase):
+    """Checks prefix and typo-tolerant name search and its endpoint"""
+
+    def setUp(self):
+        self.client.post('/batch/', {'operations': [
+            {'action': 'add_student', 'name': name, 'subjects': {'Mathematics': 80}}
+            for name in ('Alice', 'Alina', 'Bob', 'Robert', 'alfred')
+        ]}, content_type='application/json')
+
+    def test_prefix_and_typos(self):
+        state = StudentSessionManager.get_state(self.client.session)
+        self.assertEqual(search_students(state, 'AL')(), [('alfred', 0), ('Alice', 0), ('Alina', 0)])
+        # A swapped pair of letters is one typo; prefix matches come first
+        self.assertEqual(search_students(state, 'lai', max_distance=1)(), [('Alice', 1), ('Alina', 1)])
+        self.assertEqual(search_students(state, 'Rboert')(), [('Robert', 1)])
+
+        # Names stay searchable as the roster changes
+        state = add_student(remove_student(state, 'Alina'), 'Alan', {})
+        self.assertEqual(search_students(state, 'ala')(), [('Alan', 0), ('alfred', 1), ('Alice', 1)])
+
+    def test_autocomplete_endpoint_and_suggestions(self):
+        data = self.client.get('/autocomplete/', {'q': 'math'}).json()
+        self.assertEqual(data['subjects'], [{'subject': 'Mathematics', 'distance': 0}])
+        self.assertEqual(self.client.get('/autocomplete/', {'q': 'Rob', 'fuzzy': '0'}).json()['students'], [
+            {'name': 'Robert', 'distance': 0},
+        ])
+        self.assertEqual(self.client.get('/autocomplete/').status_code, 400)
+
+        response = self.client.post(
+            '/', {'action': 'update_grade', 'name': 'Robret', 'subject': 'art', 'grade': 1}, follow=True
+        )
+        self.assertContains(response, 'Student Robret not found. Did you mean Robert?')
@@ -1,6 +1,37 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
-urlpatterns = [
-    path('', views.home, name='home'),
-]
\ No newline at end of file
+
+def student_urlpatterns(module):
+    """Returns the app's URL patterns, routed to the views of a module
+
+    The bulk import stays a sync view in both cases: it consumes the upload
+    as a blocking stream and commits batch by batch. So does the export,
+    which waits on its worker processes, and so do the counters and the
+    metrics, which do no I/O.
+
+    Args:
+        module: ``views`` or ``async_views``
+    """
+    return [
+        path('', module.home, name='home'),
+        path('import/', views.import_roster, name='import_roster'),
+        path('export/', views.export, name='export'),
+        path('batch/', module.batch, name='batch'),
+        path('filter/', module.filter_students, name='filter_students'),
+        path('autocomplete/', module.autocomplete, name='autocomplete'),
+        path('ranking/', module.ranking, name='ranking'),
+        path('changes/', module.changes, name='changes'),
+        path('stats/', views.transaction_stats, name='transaction_stats'),
+        path('metrics/', views.metrics_view, name='metrics'),
+    ]
+
+
+# The async views are only imported when they are served
+if settings.STUDENT_ASYNC_VIEWS:
+    from . import async_views
+
+    urlpatterns = student_urlpatterns(async_views)
+else:
+    urlpatterns = student_urlpatterns(views)
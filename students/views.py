@@ -1,11 +1,247 @@
+import io
+import json
+
 from django.shortcuts import render, redirect
 from django.contrib import messages
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import require_GET, require_POST
 
+from .persistent import MISSING
 from .functional_core import (
     add_student, add_subject, update_grade, 
-    remove_student, calculate_average, list_students
+    remove_student, calculate_average, iter_students,
+    page_start, student_at, parse_subjects,
+    students_taking, students_in_grade_range,
+    rank_of, top_k, percentile, search_students, search_subjects
 )
+from . import metrics, page_cache
+from .batch import MAX_BATCH_OPERATIONS, apply_batch
+from .bulk_import import DEFAULT_BATCH_SIZE, FORMATS, detect_format, import_rows, read_rows
+from .export import EXPORTS, iter_export
+from .export import FORMATS as EXPORT_FORMATS
 from .session_manager import StudentSessionManager
+from .state_store import VersionConflict
+
+
+# Number of students shown per page of the student list, and the most a
+# client may ask for (streamed responses are not limited)
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Most row errors listed in a bulk import report (the rest are only counted)
+MAX_REPORTED_ERRORS = 100
+
+# Placeholder rendered in place of the student list when streaming
+STREAM_MARKER = '\0students\0'
+
+# Suggestions returned by the autocomplete endpoint by default, and at most
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 100
+
+# Students listed by the ranking endpoint unless asked otherwise
+DEFAULT_TOP = 10
+
+# Longest a client may wait for a change of the roster, in seconds (long
+# polling of GET /changes/)
+MAX_CHANGES_WAIT = 30
+
+# Reported when a change kept conflicting with concurrent ones
+CONFLICT_MESSAGE = 'The roster is being changed by another request, please try again'
+
+
+def _int_param(params, key, default):
+    """Reads a non-negative integer query parameter, falling back to a default"""
+    try:
+        value = int(params[key])
+    except (KeyError, ValueError):
+        return default
+    return value if value >= 0 else default
+
+
+def split_home_page(request):
+    """Renders the home page around a placeholder for the student list
+    
+    Returns:
+        The (head, tail) parts of the page before and after the list
+    """
+    student_list = mark_safe(f'<pre>{STREAM_MARKER}</pre>')
+    page = render_to_string('students/home.html', {'student_list': student_list}, request)
+    head, tail = page.split(STREAM_MARKER, 1)
+    return head, tail
+
+
+def _stream_home(request, lines):
+    """Streams the home page, sending student rows as they are produced
+    
+    The template is rendered once around a placeholder; the part before it
+    is sent first, then one escaped row at a time, then the rest of the page.
+    
+    Args:
+        request: The HTTP request object
+        lines: An iterable of formatted student lines
+    
+    Returns:
+        A StreamingHttpResponse
+    """
+    head, tail = split_home_page(request)
+    
+    def content():
+        yield head
+        for line in lines:
+            yield escape(line) + "\n"
+        yield tail
+    
+    return StreamingHttpResponse(content(), content_type='text/html; charset=utf-8')
+
+
+def _not_found(state, name):
+    """Describes an unknown student, suggesting the closest names"""
+    suggestions = [match for match, _ in search_students(state, name, limit=3)()]
+    if suggestions:
+        return messages.ERROR, f'Student {name} not found. Did you mean {" or ".join(suggestions)}?'
+    return messages.ERROR, f'Student {name} not found'
+
+
+def apply_form_action(state, data):
+    """Applies one of the home page forms to a state
+    
+    This is the request-independent part of the home view, shared by the
+    sync and async views: it reads the form fields, calls the functional
+    core and describes the outcome, but neither saves nor reports anything.
+    
+    Args:
+        state: A lambda function returning the current state
+        data: The submitted form data (e.g. request.POST)
+    
+    Returns:
+        A (new_state, notes) tuple: a lambda returning the state to save, or
+        None when nothing is to be saved, and a list of (level, text)
+        messages for the user
+    """
+    # Extract the requested action from the form data
+    action = data.get('action')
+    
+    # Handle "add student" action
+    if action == 'add_student':
+        # Extract form data
+        name = data.get('name')
+        subjects_str = data.get('subjects')
+        
+        # Validate that required fields are provided
+        if not (name and subjects_str):
+            return None, [(messages.ERROR, 'Please provide name and subjects')]
+        try:
+            # Parse the subjects string (format: "math:90, science:85")
+            subjects_dict = parse_subjects(subjects_str)
+        except ValueError:
+            # Handle conversion errors (e.g., non-numeric grades)
+            return None, [(messages.ERROR, 'Error in subjects format. Use "subject:grade, subject2:grade2"')]
+        
+        # Call the functional core to get a new state with the added student
+        return add_student(state, name, subjects_dict), [(messages.SUCCESS, f'Student {name} added successfully')]
+    
+    # Handle "add subject" and "update grade" actions, which take the same fields
+    if action in ('add_subject', 'update_grade'):
+        # Extract form data
+        name = data.get('name')
+        subject = data.get('subject')
+        grade = data.get('grade')
+        
+        # Validate that required fields are provided
+        if not (name and subject and grade):
+            return None, [(messages.ERROR, 'All fields are required')]
+        try:
+            # Convert grade to integer
+            grade = int(grade)
+        except ValueError:
+            # Handle conversion errors
+            return None, [(messages.ERROR, 'Grade must be a number')]
+        
+        # A mistyped name would otherwise change nothing
+        if name not in state():
+            return None, [_not_found(state, name)]
+        
+        # Call the functional core to get a new state with the added subject
+        # or the updated grade
+        if action == 'add_subject':
+            return add_subject(state, name, subject, grade), [(messages.SUCCESS, f'Subject {subject} added to {name}')]
+        return update_grade(state, name, subject, grade), [(messages.SUCCESS, f'Grade updated for {name} in {subject}')]
+    
+    # Handle "remove student" and "calculate average" actions
+    if action in ('remove_student', 'calculate_average'):
+        # Extract form data
+        name = data.get('name')
+        
+        # Validate that required fields are provided
+        if not name:
+            return None, [(messages.ERROR, 'Please provide the student name')]
+        
+        # Check if the student exists
+        if name not in state():
+            return None, [_not_found(state, name)]
+        
+        if action == 'remove_student':
+            # Call the functional core to get a new state without the student
+            return remove_student(state, name), [(messages.SUCCESS, f'Student {name} removed successfully')]
+        
+        # Call the functional core and execute the returned lambda to get the average
+        average = calculate_average(state, name)()
+        return None, [(messages.INFO, f'The average grade for {name} is: {average:.2f}')]
+    
+    # Unknown actions are ignored
+    return None, []
+
+
+def home_page(state, params):
+    """Works out which page of students the home page shows
+    
+    Students are ordered by name and a page starts at an offset, or right
+    after the last name of the previous page (?after=<name>). Shared by the
+    sync and async views.
+    
+    Args:
+        state: A lambda function returning the current state
+        params: The query parameters (e.g. request.GET)
+    
+    Returns:
+        ('stream', lines) when the page is to be streamed, with an iterator
+        of formatted student lines, otherwise ('page', context) with the
+        template context of the page
+    """
+    after = params.get('after')
+    offset = _int_param(params, 'offset', 0)
+    
+    # Locate the first student of the page without scanning the roster
+    start = page_start(state, offset, after)()
+    
+    # Streamed responses send the whole roster unless a limit is given
+    if params.get('stream') == '1':
+        return 'stream', iter_students(state, start, _int_param(params, 'limit', None))()
+    
+    limit = min(_int_param(params, 'limit', PAGE_SIZE) or PAGE_SIZE, MAX_PAGE_SIZE)
+    
+    # Format only the students of the page
+    lines = list(iter_students(state, start, limit)())
+    total = len(state())
+    end = start + len(lines)
+    if lines:
+        students_formatted = "\n".join(lines)
+    else:
+        students_formatted = "No students registered" if not total else "No students on this page"
+    
+    # The page and the links around it
+    return 'page', {
+        'students_formatted': students_formatted,
+        'total': total,
+        'page_first': start + 1,
+        'page_last': end,
+        'limit': limit,
+        'prev_offset': max(start - limit, 0) if start > 0 else None,
+        'next_cursor': student_at(state, end - 1)() if end < total else None,
+    }
 
 
 def home(request):
@@ -21,160 +257,534 @@ def home(request):
     Returns:
         A rendered template or a redirect response
     """
-    # Get the current state from the session using our session manager
-    # This returns a lambda function that, when called, provides the current state
-    state = StudentSessionManager.get_state(request.session)
-    
     # Process any submitted forms (POST requests)
     if request.method == 'POST':
-        # Extract the requested action from the form data
-        action = request.POST.get('action')
-        
-        # Handle "add student" action
-        if action == 'add_student':
-            # Extract form data
-            name = request.POST.get('name')
-            subjects_str = request.POST.get('subjects')
-            
-            # Validate that required fields are provided
-            if name and subjects_str:
-                try:
-                    # Parse the subjects string (format: "math:90, science:85")
-                    subject_items = [item.strip() for item in subjects_str.split(',')]
-                    subjects_dict = {}
-                    
-                    # Convert each item into a subject:grade pair
-                    for item in subject_items:
-                        if ':' in item:
-                            subject, grade = item.split(':', 1)
-                            subjects_dict[subject.strip()] = int(grade.strip())
-                    
-                    # Call the functional core to get a new state with the added student
-                    new_state = add_student(state, name, subjects_dict)
-                    
-                    # Update the session with the new state
-                    StudentSessionManager.update_session(request.session, new_state)
-                    
-                    # Add a success message
-                    messages.success(request, f'Student {name} added successfully')
-                except ValueError:
-                    # Handle conversion errors (e.g., non-numeric grades)
-                    messages.error(request, 'Error in subjects format. Use "subject:grade, subject2:grade2"')
-            else:
-                # Handle missing input fields
-                messages.error(request, 'Please provide name and subjects')
-        
-        # Handle "add subject" action
-        elif action == 'add_subject':
-            # Extract form data
-            name = request.POST.get('name')
-            subject = request.POST.get('subject')
-            grade = request.POST.get('grade')
-            
-            # Validate that required fields are provided
-            if name and subject and grade:
-                try:
-                    # Convert grade to integer
-                    grade = int(grade)
-                    
-                    # Call the functional core to get a new state with the added subject
-                    new_state = add_subject(state, name, subject, grade)
-                    
-                    # Update the session with the new state
-                    StudentSessionManager.update_session(request.session, new_state)
-                    
-                    # Add a success message
-                    messages.success(request, f'Subject {subject} added to {name}')
-                except ValueError:
-                    # Handle conversion errors
-                    messages.error(request, 'Grade must be a number')
-            else:
-                # Handle missing input fields
-                messages.error(request, 'All fields are required')
-        
-        # Handle "update grade" action
-        elif action == 'update_grade':
-            # Extract form data
-            name = request.POST.get('name')
-            subject = request.POST.get('subject')
-            grade = request.POST.get('grade')
-            
-            # Validate that required fields are provided
-            if name and subject and grade:
-                try:
-                    # Convert grade to integer
-                    grade = int(grade)
-                    
-                    # Call the functional core to get a new state with the updated grade
-                    new_state = update_grade(state, name, subject, grade)
-                    
-                    # Update the session with the new state
-                    StudentSessionManager.update_session(request.session, new_state)
-                    
-                    # Add a success message
-                    messages.success(request, f'Grade updated for {name} in {subject}')
-                except ValueError:
-                    # Handle conversion errors
-                    messages.error(request, 'Grade must be a number')
-            else:
-                # Handle missing input fields
-                messages.error(request, 'All fields are required')
-        
-        # Handle "remove student" action
-        elif action == 'remove_student':
-            # Extract form data
-            name = request.POST.get('name')
-            
-            # Validate that required fields are provided
-            if name:
-                # Call the functional core to get a new state without the student
-                new_state = remove_student(state, name)
-                
-                # Update the session with the new state
-                StudentSessionManager.update_session(request.session, new_state)
-                
-                # Add a success message
-                messages.success(request, f'Student {name} removed successfully')
-            else:
-                # Handle missing input fields
-                messages.error(request, 'Please provide the student name')
-        
-        # Handle "calculate average" action
-        elif action == 'calculate_average':
-            # Extract form data
-            name = request.POST.get('name')
-            
-            # Validate that required fields are provided
-            if name:
-                # Check if the student exists
-                if name in state():
-                    # Call the functional core to calculate the average
-                    avg_func = calculate_average(state, name)
-                    
-                    # Execute the returned lambda to get the average value
-                    average = avg_func()
-                    
-                    # Add an info message with the result
-                    messages.info(request, f'The average grade for {name} is: {average:.2f}')
-                else:
-                    # Handle non-existent student
-                    messages.error(request, f'Student {name} not found')
-            else:
-                # Handle missing input fields
-                messages.error(request, 'Please provide the student name')
+        # Apply the form to the roster and save the new state, if any. A
+        # concurrent change of the roster makes the form apply again to it.
+        try:
+            _, notes = StudentSessionManager.transact(
+                request.session, lambda state: apply_form_action(state, request.POST)
+            )
+        except VersionConflict:
+            notes = [(messages.ERROR, CONFLICT_MESSAGE)]
+        for level, text in notes:
+            messages.add_message(request, level, text)
         
         # Redirect to the same page to prevent form resubmission
         return redirect('home')
     
-    # For GET requests, prepare data for the template
-    student_data = state()
+    # For GET requests, get the current state from the session using our session manager
+    # This returns the roster's version and a lambda function that provides the current state
+    version, state = StudentSessionManager.get_versioned_state(request.session)
     
-    # Get a formatted representation of all students and their grades
-    students_list_func = list_students(state)
-    students_formatted = students_list_func() if student_data else "No students registered"
+    # Streamed pages are produced as they are sent and never cached
+    if request.GET.get('stream') == '1':
+        _, lines = home_page(state, request.GET)
+        return _stream_home(request, lines)
     
-    # Render the template with the prepared data
-    return render(request, 'students/home.html', {
-        'students': student_data,
-        'students_formatted': students_formatted,
-    })
\ No newline at end of file
+    # Answer with 304 when the client already has this page of this version
+    key = StudentSessionManager.get_roster_key(request.session)
+    validate = page_cache.can_validate(request)
+    if validate:
+        response = page_cache.not_modified(request, key, version)
+        if response is not None:
+            return response
+    
+    # Render the page around the student list, formatted once per version
+    student_list = page_cache.student_list(key, version, request.GET, lambda: home_page(state, request.GET)[1])
+    with metrics.phase('render'):
+        response = render(request, 'students/home.html', {'student_list': mark_safe(student_list)})
+    return page_cache.finish(request, response, key, version, validate)
+
+
+@require_POST
+def import_roster(request):
+    """Bulk import of students from an uploaded CSV or JSON lines file
+    
+    The file is read as a stream and applied in batches, saving the roster
+    once per batch. Accepts the form fields ``file``, and optionally
+    ``format`` ('csv' or 'jsonl', guessed from the file name by default) and
+    ``batch_size``.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A JSON report when the client accepts JSON, otherwise a redirect to
+        the home page with the report as messages
+    """
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+    upload = request.FILES.get('file')
+    fmt = request.POST.get('format') or (detect_format(upload.name) if upload else None)
+    
+    # Validate the upload before touching the state
+    if upload is None or fmt not in FORMATS:
+        error = 'Please provide a CSV or JSON lines file'
+        if wants_json:
+            return JsonResponse({'error': error}, status=400)
+        messages.error(request, error)
+        return redirect('home')
+    
+    # Keep the first few row errors for the report
+    errors = []
+    
+    def report(row):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'line': row.line, 'error': row.error})
+    
+    # Each batch is applied to the current roster and saved with a
+    # compare-and-swap, so concurrent changes to other students are kept
+    committed = []
+    
+    def commit(batch):
+        state, _ = StudentSessionManager.transact(request.session, lambda state: (batch(state), None))
+        committed.append(batch)
+        return state
+    
+    lines = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        _, result = import_rows(
+            StudentSessionManager.get_state(request.session), read_rows(lines, fmt), commit,
+            batch_size=_int_param(request.POST, 'batch_size', DEFAULT_BATCH_SIZE) or DEFAULT_BATCH_SIZE,
+            on_error=report,
+        )
+    except VersionConflict:
+        # The batches saved so far stay imported
+        error = f'{CONFLICT_MESSAGE} ({len(committed)} batches were imported)'
+        if wants_json:
+            return JsonResponse({'error': error, 'batches': len(committed)}, status=409)
+        messages.error(request, error)
+        return redirect('home')
+    
+    if wants_json:
+        return JsonResponse({
+            'imported': result.imported,
+            'failed': result.failed,
+            'batches': result.batches,
+            'errors': errors,
+        })
+    
+    messages.success(request, f'Imported {result.imported} students')
+    if result.failed:
+        shown = '; '.join(f"line {error['line']}: {error['error']}" for error in errors[:5])
+        messages.error(request, f'{result.failed} rows were rejected ({shown})')
+    return redirect('home')
+
+
+@require_GET
+def export(request):
+    """Downloads the student transcripts or subject statistics of the roster
+    
+    Query parameters: ``kind`` ('transcripts', the default, or 'subjects')
+    and ``format`` ('csv', the default, or 'jsonl'). The file is formatted
+    and streamed chunk by chunk, in this process: forking worker processes
+    from a threaded or async server could deadlock on locks held by other
+    threads, and would let any client start processes. Large exports are
+    parallelized by the ``export_roster`` command instead.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A streamed file attachment
+    """
+    kind = request.GET.get('kind', 'transcripts')
+    fmt = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or fmt not in EXPORT_FORMATS:
+        error = f'"kind" must be one of {", ".join(EXPORTS)} and "format" one of {", ".join(EXPORT_FORMATS)}'
+        return JsonResponse({'error': error}, status=400)
+    
+    state = StudentSessionManager.get_state(request.session)
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(
+        iter_export(state, kind, fmt, workers=1),
+        content_type=f'{content_type}; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+def read_operations(body):
+    """Parses the JSON body of a batch request
+    
+    Args:
+        body: The raw request body
+    
+    Returns:
+        An (operations, error) tuple: the list of operations, or None and
+        an error message when the body is invalid
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None, 'The request body must be JSON'
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list):
+        return None, '"operations" must be a list'
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return None, f'At most {MAX_BATCH_OPERATIONS} operations per batch'
+    return operations, None
+
+
+def batch_operation(operations):
+    """Returns a batch as an operation for ``StudentSessionManager.transact``
+    
+    The new state is only kept when every operation of the batch succeeded.
+    """
+    def operation(state):
+        new_state, results, ok = apply_batch(state, operations)
+        return (new_state if ok else None), (results, ok)
+    return operation
+
+
+@require_POST
+def batch(request):
+    """Applies a list of operations to the roster in one state transition
+    
+    The request body is JSON: ``{"operations": [{"action": ..., ...}, ...]}``
+    with the same actions and fields as the home page forms (``subjects``
+    may be an object). The state is read once, the operations are folded
+    through the functional core, and the result is saved once. The batch is
+    atomic: if any operation fails, nothing is saved.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A JSON response with ``applied`` and one result per operation
+        (status 400 when the batch was rejected)
+    """
+    # Parse and validate the request body
+    operations, error = read_operations(request.body)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    
+    # Read the state once, fold every operation into it and write once, and
+    # only if the whole batch succeeded (a conflicting write re-runs it)
+    try:
+        _, (results, ok) = StudentSessionManager.transact(request.session, batch_operation(operations))
+    except VersionConflict:
+        return JsonResponse({'error': CONFLICT_MESSAGE}, status=409)
+    
+    return JsonResponse({'applied': ok, 'results': results}, status=200 if ok else 400)
+
+
+def filter_results(state, params):
+    """Answers a subject query from the roster's subject indexes
+    
+    Shared by the sync and async ``filter_students`` views.
+    
+    Args:
+        state: A lambda function returning the current state
+        params: The query parameters (e.g. request.GET)
+    
+    Returns:
+        A (payload, status) tuple for the JSON response
+    """
+    subject = params.get('subject')
+    if not subject:
+        return {'error': '"subject" is required'}, 400
+    
+    # Grade bounds may be any whole number, including negative ones
+    bounds = {}
+    for param in ('min', 'max'):
+        if params.get(param, '') != '':
+            try:
+                bounds[param] = int(params[param])
+            except ValueError:
+                return {'error': f'"{param}" must be a whole number'}, 400
+    
+    offset = _int_param(params, 'offset', 0)
+    limit = min(_int_param(params, 'limit', PAGE_SIZE) or PAGE_SIZE, MAX_PAGE_SIZE)
+    
+    # Query the subject indexes through the functional core
+    if bounds:
+        query = students_in_grade_range(state, subject, bounds.get('min'), bounds.get('max'), offset, limit)
+    else:
+        query = students_taking(state, subject, offset, limit)
+    total, page = query()
+    
+    return {
+        'subject': subject,
+        'total': total,
+        'offset': offset,
+        'results': [{'name': name, 'grade': grade} for name, grade in page],
+        'next_offset': offset + len(page) if offset + len(page) < total else None,
+    }, 200
+
+
+@require_GET
+def filter_students(request):
+    """JSON listing of the students taking a subject, optionally by grade range
+    
+    Query parameters: ``subject`` (required), ``min`` and ``max`` (inclusive
+    grade bounds), ``offset`` and ``limit``. Without bounds, students are
+    listed in name order; with a bound, in grade order. Both are answered
+    from the roster's subject indexes without scanning the roster.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A JSON response with the total number of matches and one page of them
+    """
+    state = StudentSessionManager.get_state(request.session)
+    payload, status = filter_results(state, request.GET)
+    return JsonResponse(payload, status=status)
+
+
+def autocomplete_results(state, params):
+    """Answers a name search from the roster's search index
+    
+    Shared by the sync and async ``autocomplete`` views.
+    
+    Args:
+        state: A lambda function returning the current state
+        params: The query parameters (e.g. request.GET)
+    
+    Returns:
+        A (payload, status) tuple for the JSON response
+    """
+    query = params.get('q', '').strip()
+    if not query:
+        return {'error': '"q" is required'}, 400
+    limit = min(_int_param(params, 'limit', AUTOCOMPLETE_LIMIT) or AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT)
+    # fuzzy=0 restricts the search to exact prefixes
+    max_distance = 0 if params.get('fuzzy') == '0' else None
+    
+    return {
+        'query': query,
+        'students': [
+            {'name': name, 'distance': distance}
+            for name, distance in search_students(state, query, limit, max_distance)()
+        ],
+        'subjects': [
+            {'subject': subject, 'distance': distance}
+            for subject, distance in search_subjects(state, query, limit, max_distance)()
+        ],
+    }, 200
+
+
+def ranking_results(state, params):
+    """Answers a ranking query from the roster's ranking index
+    
+    Shared by the sync and async ``ranking`` views.
+    
+    Args:
+        state: A lambda function returning the current state
+        params: The query parameters (e.g. request.GET)
+    
+    Returns:
+        A (payload, status) tuple for the JSON response
+    """
+    subject = params.get('subject') or None
+    top = min(_int_param(params, 'top', DEFAULT_TOP), MAX_PAGE_SIZE)
+    payload = {
+        'subject': subject,
+        'top': [{'name': name, 'score': score} for name, score in top_k(state, top, subject)()],
+    }
+    
+    name = params.get('name')
+    if name:
+        payload['rank'] = {'name': name, 'rank': rank_of(state, name, subject)()}
+    
+    if params.get('percentile', '') != '':
+        try:
+            p = float(params['percentile'])
+        except ValueError:
+            p = None
+        if p is None or not 0 <= p <= 100:
+            return {'error': '"percentile" must be a number from 0 to 100'}, 400
+        found = percentile(state, p, subject)()
+        payload['percentile'] = {
+            'percentile': p,
+            'name': found[0] if found else None,
+            'score': found[1] if found else None,
+        }
+    return payload, 200
+
+
+def read_changes_params(params):
+    """Reads the query of a changes request
+    
+    Args:
+        params: The query parameters (e.g. request.GET)
+    
+    Returns:
+        A (since, wait, error) tuple; error is a message when the query is
+        invalid, else None
+    """
+    try:
+        since = int(params['since'])
+    except (KeyError, ValueError):
+        return None, 0, '"since" must be a roster version (a whole number)'
+    if since < 0:
+        return None, 0, '"since" must be a roster version (a whole number)'
+    try:
+        wait = float(params.get('wait') or 0)
+    except ValueError:
+        return None, 0, '"wait" must be a number of seconds'
+    # Not a number (nan) fails both comparisons and counts as no wait
+    wait = min(wait, MAX_CHANGES_WAIT) if wait > 0 else 0
+    return since, wait, None
+
+
+def changes_payload(since, version, state, changes):
+    """Describes the changes of a roster for the ``changes`` views
+    
+    Args:
+        since: The version the client has
+        version: The current version
+        state: A lambda function returning the current state
+        changes: The changes as returned by ``StateStore.changes_since``, or
+            None when they cannot be computed from ``since``
+    
+    Returns:
+        The JSON payload: the students added (with all their subjects), the
+        grades added or changed per student, the subjects removed per
+        student and the students removed. When the changes are unknown, it
+        is a reset holding the whole roster instead.
+    """
+    if changes is None:
+        return {'since': since, 'version': version, 'reset': True, 'students': state().to_dict()}
+    
+    added, updated, removed_subjects, removed = {}, {}, {}, []
+    for name, old, new in changes:
+        if new is MISSING:
+            removed.append(name)
+        elif old is MISSING:
+            added[name] = dict(new)
+        else:
+            grades = {subject: grade for subject, grade in new.items() if old.get(subject, MISSING) != grade}
+            if grades:
+                updated[name] = grades
+            dropped = [subject for subject in old if subject not in new]
+            if dropped:
+                removed_subjects[name] = dropped
+    
+    return {
+        'since': since,
+        'version': version,
+        'reset': False,
+        'added': added,
+        'updated': updated,
+        'removed_subjects': removed_subjects,
+        'removed': removed,
+    }
+
+
+@require_GET
+def autocomplete(request):
+    """JSON suggestions of student and subject names for a partial name
+    
+    Query parameters: ``q`` (required), the text typed so far, ``limit``
+    and ``fuzzy`` (0 to only match names starting with ``q``). Case is
+    ignored. Names starting with ``q`` come first (distance 0), then names
+    whose start is one typo away (distance 1), or two for longer queries
+    that matched nothing closer; see ``search.find``.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A JSON response described by ``autocomplete_results``
+    """
+    state = StudentSessionManager.get_state(request.session)
+    payload, status = autocomplete_results(state, request.GET)
+    return JsonResponse(payload, status=status)
+
+
+@require_GET
+def ranking(request):
+    """JSON leaderboard, ranks and percentiles by average grade or by subject
+    
+    Query parameters: ``subject`` (rank by the grade in that subject rather
+    than by average), ``top`` (how many of the best students to list),
+    ``name`` (also give that student's rank; tied scores share a rank) and
+    ``percentile`` (also give the student and score at that percentile,
+    nearest-rank). Each part is read from the roster's ranking index in
+    O(log N) plus the size of the list.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A JSON response described by ``ranking_results``
+    """
+    state = StudentSessionManager.get_state(request.session)
+    payload, status = ranking_results(state, request.GET)
+    return JsonResponse(payload, status=status)
+
+
+@require_GET
+def changes(request):
+    """JSON changes of the roster since a version the client has
+    
+    Query parameters: ``since`` (required), the ``version`` of an earlier
+    answer (0 for an empty roster), and ``wait``, a number of seconds (at
+    most MAX_CHANGES_WAIT) to wait for a change when there is none yet, so
+    that live views can long-poll instead of polling.
+    
+    Only the recent versions kept by the state store can be diffed; older
+    or unknown ones are answered with ``reset`` and the whole roster.
+    DatabaseStore keeps them in the database, for every process; the other
+    stores keep them in the memory of the process that saw them. A long
+    poll notices changes made by other processes within
+    ``StateStore.POLL_INTERVAL``.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A JSON response described by ``changes_payload``
+    """
+    since, wait, error = read_changes_params(request.GET)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    
+    version, state, changes = StudentSessionManager.get_changes(request.session, since, wait)
+    return JsonResponse(changes_payload(since, version, state, changes))
+
+
+@require_GET
+def transaction_stats(request):
+    """JSON counters of the roster transactions of this process
+    
+    Reports how many transactions ran and committed, how many saves were
+    rejected by a concurrent change (and retried), how many transactions
+    gave up, and the resulting conflict and retry rates.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A JSON response with the counters
+    """
+    return JsonResponse(StudentSessionManager.stats.snapshot())
+
+
+@require_GET
+def metrics_view(request):
+    """Prometheus metrics of this process
+    
+    Serves the request, phase and payload metrics collected by
+    ``metrics.MetricsMiddleware`` and the app, plus the transaction counters
+    of ``transaction_stats``, in the Prometheus text format.
+    
+    Args:
+        request: The HTTP request object
+    
+    Returns:
+        A text/plain response in the Prometheus exposition format
+    """
+    stats = StudentSessionManager.stats.snapshot()
+    extra = []
+    for name in ('transactions', 'commits', 'conflicts', 'failures'):
+        extra += [
+            f'# HELP student_{name}_total Roster {name} of this process',
+            f'# TYPE student_{name}_total counter',
+            f'student_{name}_total {stats[name]}',
+        ]
+    return HttpResponse(
+        metrics.render_metrics(extra), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )